@@ -37,6 +37,7 @@ from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.utils.translation import ugettext as _, activate
 from django.conf import settings
+from django.db import connection
 from uds.REST.handlers import Handler, HandlerError, AccessDenied, NotFound, RequestError, ResponseError, NotSupportedError
 
 import time
@@ -134,12 +135,16 @@ class Dispatcher(View):
 
         # Invokes the handler's operation, add headers to response and returns
         try:
+            queries = len(connection.queries)
             response = operation()
 
             if not handler.raw:  # Raw handlers will return an HttpResponse Object
-                response = processor.getResponse(response)
+                response = processor.getResponse(response, stream=handler.stream)
             for k, val in handler.headers().items():
                 response[k] = val
+            if settings.DEBUG:  # Queries are only recorded on debug. Allows to check the queries needed by every request
+                response['X-Query-Count'] = len(connection.queries) - queries
+                logger.debug('{} queries processing {} {}'.format(response['X-Query-Count'], http_method, full_path))
             return response
         except RequestError as e:
             return http.HttpResponseBadRequest(six.text_type(e), content_type="text/plain")
@@ -95,6 +95,11 @@ class Handler(object):
     REST requests handler base class
     """
     raw = False  # If true, Handler will return directly an HttpResponse Object
+    # If true, generators returned by Handler are streamed while rendered. As response is sent as they are rendered,
+    # errors found while iterating them can't be reported (client gets a truncated response) and the queries
+    # they do are not included on X-Query-Count. So only for big lists of simple items. Operations can also set it
+    # on the instance for a single response (as ModelHandler listings do)
+    stream = False
     name = None  # If name is not used, name will be the class name in lower case
     path = None  # Path for this method, so we can do /auth/login, /auth/logout, /auth/auths in a simple way
     authenticated = True  # By default, all handlers needs authentication
@@ -270,8 +275,8 @@ class Handler(object):
         authId = self.getValue('auth')
         username = self.getValue('username')
         # Maybe it's root user??
-        if (GlobalConfig.SUPER_USER_ALLOW_WEBACCESS.getBool(True) and
-                username == GlobalConfig.SUPER_USER_LOGIN.get(True) and
+        if (GlobalConfig.SUPER_USER_ALLOW_WEBACCESS.getBool() and
+                username == GlobalConfig.SUPER_USER_LOGIN.get() and
                 authId == -1):
             return getRootUser()
         return Authenticator.objects.get(pk=authId).users.get(name=username)
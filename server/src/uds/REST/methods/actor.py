@@ -180,7 +180,7 @@ class Actor(Handler):
                 service.setProperty('actor_version', actorVersion)
                 maxIdle = None
                 if service.deployed_service.osmanager is not None:
-                    maxIdle = service.deployed_service.osmanager.getInstance().maxIdle()
+                    maxIdle = service.deployed_service.osmanager.getInstance(shared=True).maxIdle()
                     logger.debug('Max idle: {}'.format(maxIdle))
                 return Actor.result((service.uuid,
                                      service.unique_id,
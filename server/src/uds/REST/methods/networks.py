@@ -67,7 +67,7 @@ class Networks(ModelHandler):
     def beforeSave(self, fields):
         logger.debug('Before {0}'.format(fields))
         try:
-            nr = net.networksFromString(fields['net_string'], False)
+            nr = Network.dbRange(net.networksFromString(fields['net_string'], False))
             fields['net_start'] = nr[0]
             fields['net_end'] = nr[1]
         except Exception as e:
@@ -120,11 +120,9 @@ class Providers(ModelHandler):
         """
         Custom method that returns "all existing services", no mater who's his daddy :)
         """
-        for s in Service.objects.all():
+        for s in permissions.filterPermitted(self._user, Service.objects.all(), permissions.PERMISSION_READ):
             try:
-                perm = permissions.getEffectivePermission(self._user, s)
-                if perm >= permissions.PERMISSION_READ:
-                    yield DetailServices.serviceToDict(s, perm, True)
+                yield DetailServices.serviceToDict(s, permissions.getEffectivePermission(self._user, s), True)
             except Exception:
                 logger.exception('Passed service cause type is unknown')
 
@@ -33,15 +33,22 @@
 from __future__ import unicode_literals
 
 from django.utils.translation import ugettext, ugettext_lazy as _
+from django import http
 
 from uds.REST import model
 from uds import reports
+from uds.core.managers import reportsManager
 
 import six
 import logging
 
 logger = logging.getLogger(__name__)
 
+STREAM = 'stream'
+QUEUE = 'queue'
+JOBS = 'jobs'
+RESULT = 'result'
+
 VALID_PARAMS = ('authId', 'authSmallName', 'auth', 'username', 'realname', 'password', 'groups', 'servicePool', 'transport')
 
 
@@ -91,22 +98,47 @@ class Reports(model.BaseModelHandler):
         if nArgs == 2:
             if self._args[0] == model.GUI:
                 return self.getGui(self._args[1])
+            elif self._args[0] == JOBS:  # Status of a background generation
+                status = reportsManager().status(self._args[1])
+                if status is None:
+                    return self.invalidRequestException(_('Invalid report job'))
+                return status
+
+        if nArgs == 3 and self._args[0] == JOBS and self._args[2] == RESULT:
+            result = reportsManager().result(self._args[1])
+            if result is None:
+                return self.invalidRequestException(_('Report is not available'))
+            return result
 
         return self.invalidRequestException()
 
     def put(self):
         """
         Processes a PUT request
+
+        reports/<uuid> returns the report inside a json object, reports/<uuid>/stream returns the
+        report itself (as an attachment), sent to client as it is generated, and reports/<uuid>/queue
+        enqueues the report for background generation, returning the job status
+        (that can be polled at reports/jobs/<id> and, once finished, obtained at reports/jobs/<id>/result)
         """
         logger.debug('method PUT for {0}, {1}, {2}'.format(self.__class__.__name__, self._args, self._params))
 
-        if len(self._args) != 1:
+        if len(self._args) not in (1, 2) or (len(self._args) == 2 and self._args[1] not in (STREAM, QUEUE)):
             return self.invalidRequestException()
 
         report = self._findReport(self._args[0], self._params)
 
+        if len(self._args) == 2 and self._args[1] == QUEUE:
+            return reportsManager().queue(self._args[0], self._params)
+
         try:
             logger.debug('Report: {}'.format(report))
+            if len(self._args) == 2:
+                self.raw = True  # This is returned as is, not processed
+                response = http.StreamingHttpResponse(report.generateChunks(), content_type=report.mime_type)
+                response['Content-Disposition'] = 'attachment; filename="{}"'.format(report.filename)
+                return response
+
             result = report.generateEncoded()
 
             data = {
@@ -31,6 +31,7 @@
 @author: Adolfo Gómez, dkmaster at dkmon dot com
 """
 from django.utils.translation import ugettext, ugettext_lazy as _
+from django.db.models import Count, Q
 from uds.models import DeployedService, OSManager, Service, Image, ServicesPoolGroup, Account
 from uds.models.CalendarAction import (
     CALENDAR_ACTION_INITIAL,
@@ -102,6 +103,26 @@ class ServicesPools(ModelHandler):
 
     custom_methods = [('setFallbackAccess', True), ('actionsList', True)]
 
+    list_select_related = ('servicesPoolGroup', 'servicesPoolGroup__image', 'image', 'account', 'service', 'service__provider', 'osmanager')
+    list_prefetch_related = ('tags',)
+    list_db_fields = {
+        'id': 'uuid', 'name': 'name', 'short_name': 'short_name', 'comments': 'comments', 'parent': 'service__name',
+        'visible': 'visible', 'show_transports': 'show_transports'
+    }
+    list_annotations = {
+        'user_services_count': Count('userServices', filter=~Q(userServices__state__in=State.INFO_STATES)),
+        'user_services_in_preparation': Count('userServices', filter=Q(userServices__state=State.PREPARING)),
+        'restrained_errors': DeployedService.restrainedErrorsAnnotation,
+    }
+
+    # Services in preparation by provider, needed to check if pools are slowed down. Loaded once per request
+    _preparingByProvider = None
+
+    def isSlowedDown(self, item):
+        if self._preparingByProvider is None:
+            self._preparingByProvider = userServiceManager().getServicesInStateByProvider(State.PREPARING)
+        return userServiceManager().canInitiateServiceFromDeployedService(item, self._preparingByProvider.get(item.service.provider_id, 0)) is False
+
     def item_as_dict(self, item):
         summary = 'summarize' in self._params
         # if item does not have an associated service, hide it (the case, for example, for a removed service)
@@ -118,7 +139,7 @@ class ServicesPools(ModelHandler):
         state = item.state
         if item.isInMaintenance():
             state = State.MAINTENANCE
-        elif userServiceManager().canInitiateServiceFromDeployedService(item) is False:
+        elif self.isSlowedDown(item):
             state = State.SLOWED_DOWN
 
         val = {
@@ -150,26 +171,16 @@ class ServicesPools(ModelHandler):
 
         # Extended info
         if not summary:
-            state = item.state
-            if item.isInMaintenance():
-                state = State.MAINTENANCE
-            elif userServiceManager().canInitiateServiceFromDeployedService(item) is False:
-                state = State.SLOWED_DOWN
-
-            poolGroupId = None
-            poolGroupName = _('Default')
-            poolGroupThumb = DEFAULT_THUMB_BASE64
-            if item.servicesPoolGroup is not None:
-                poolGroupId = item.servicesPoolGroup.uuid
-                poolGroupName = item.servicesPoolGroup.name
-                if item.servicesPoolGroup.image is not None:
-                    poolGroupThumb = item.servicesPoolGroup.image.thumb64
-
-            val['state'] = state
-            val['thumb'] = item.image.thumb64 if item.image is not None else DEFAULT_THUMB_BASE64
-            val['user_services_count'] = item.userServices.exclude(state__in=State.INFO_STATES).count()
-            val['user_services_in_preparation'] = item.userServices.filter(state=State.PREPARING).count()
-            val['tags'] = [tag.tag for tag in item.tags.all()]
+            # Counters are annotated when items are listed, but not when an item is returned after being saved
+            userServicesCount = getattr(item, 'user_services_count', None)
+            if userServicesCount is None:
+                userServicesCount = item.userServices.exclude(state__in=State.INFO_STATES).count()
+            inPreparation = getattr(item, 'user_services_in_preparation', None)
+            if inPreparation is None:
+                inPreparation = item.userServices.filter(state=State.PREPARING).count()
+
+            val['user_services_count'] = userServicesCount
+            val['user_services_in_preparation'] = inPreparation
             val['restrained'] = item.isRestrained()
             val['permission'] = permissions.getEffectivePermission(self._user, item)
             val['info'] = Services.serviceInfo(item.service)
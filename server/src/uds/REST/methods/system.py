@@ -36,6 +36,7 @@ from uds.models import User, Service, UserService, DeployedService, getSqlDateti
 
 from uds.core.util.stats import counters
 from uds.core.util.Cache import Cache
+from uds.core.util.InstanceCache import InstanceCache
 from uds.core.util.State import State
 from uds.core.util import encoders
 from uds.REST import Handler, RequestError, ResponseError
@@ -107,6 +108,11 @@ class System(Handler):
                     return getServicesPoolsCounters(None, counters.CT_ASSIGNED)
                 if self._args[1] == 'inuse':
                     return getServicesPoolsCounters(None, counters.CT_INUSE)
+                if self._args[1] == 'caches' and self.is_admin():  # Hits & misses of this process caches
+                    return {
+                        'cache': Cache.counters(),
+                        'instances': InstanceCache.counters(),
+                    }
 
         raise RequestError('invalid request')
 
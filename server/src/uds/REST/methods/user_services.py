@@ -54,6 +54,13 @@ class AssignedService(DetailHandler):
     """
     Rest handler for Assigned Services, wich parent is Service
     """
+    list_select_related = ('deployed_service', 'publication', 'user', 'user__manager')
+    list_prefetch_related = ('properties',)
+    list_db_fields = {
+        'id': 'uuid', 'unique_id': 'unique_id', 'friendly_name': 'friendly_name', 'state': 'state', 'os_state': 'os_state',
+        'state_date': 'state_date', 'creation_date': 'creation_date', 'revision': 'publication__revision', 'cache_level': 'cache_level',
+        'in_use': 'in_use', 'in_use_date': 'in_use_date', 'source_host': 'src_hostname', 'source_ip': 'src_ip'
+    }
 
     @staticmethod
     def itemToDict(item, is_cache=False):
@@ -108,10 +115,9 @@ class AssignedService(DetailHandler):
         # Extract provider
         try:
             if item is None:
-                return [AssignedService.itemToDict(k) for k in parent.assignedUserServices().all()
-                        .prefetch_related('properties').prefetch_related('deployed_service').prefetch_related('publication')]
+                return [AssignedService.itemToDict(k) for k in self.applyListParams(self.applyListPlan(parent.assignedUserServices()))]
             else:
-                return parent.assignedUserServices().get(processUuid(uuid=processUuid(item)))
+                return AssignedService.itemToDict(self.applyListPlan(parent.assignedUserServices()).get(uuid=processUuid(item)))
         except Exception:
             logger.exception('getItems')
             self.invalidItemException()
@@ -202,10 +208,9 @@ class CachedService(AssignedService):
         # Extract provider
         try:
             if item is None:
-                return [AssignedService.itemToDict(k, True) for k in parent.cachedUserServices().all()
-                        .prefetch_related('properties').prefetch_related('deployed_service').prefetch_related('publication')]
+                return [AssignedService.itemToDict(k, True) for k in self.applyListParams(self.applyListPlan(parent.cachedUserServices()))]
             else:
-                k = parent.cachedUserServices().get(uuid=processUuid(item))
+                k = self.applyListPlan(parent.cachedUserServices()).get(uuid=processUuid(item))
                 return AssignedService.itemToDict(k, True)
         except Exception:
             logger.exception('getItems')
@@ -239,6 +244,7 @@ class Groups(DetailHandler):
     """
     Processes the groups detail requests of a Service Pool
     """
+    list_select_related = ('manager',)
 
     def getItems(self, parent, item):
         return [{
@@ -249,7 +255,7 @@ class Groups(DetailHandler):
             'state': i.state,
             'type': i.is_meta and 'meta' or 'group',
             'auth_name': i.manager.name,
-        } for i in parent.assignedGroups.all()]
+        } for i in self.applyListPlan(parent.assignedGroups.all())]
 
     def getTitle(self, parent):
         return _('Assigned groups')
@@ -35,6 +35,7 @@ from __future__ import unicode_literals
 from django.utils.translation import ugettext as _
 from django.forms.models import model_to_dict
 from django.db import IntegrityError
+from django.db.models import Count, Q, Prefetch
 from django.core.exceptions import ValidationError
 
 from uds.core.util.State import State
@@ -69,13 +70,21 @@ def getGroupsFromMeta(groups):
 
 
 def getPoolsForGroups(groups):
-    for servicePool in ServicePool.getDeployedServicesForGroups(groups):
+    # Reloaded with everything needed for listing them, to avoid a query per pool
+    pools = ServicePool.getDeployedServicesForGroups(groups)
+    for servicePool in ServicePool.objects.filter(pk__in=[p.pk for p in pools]).select_related('image').annotate(
+        user_services_count=Count('userServices', filter=~Q(userServices__state__in=(State.REMOVED, State.ERROR))),
+        restrained_errors=ServicePool.restrainedErrorsAnnotation()
+    ):
         yield servicePool
 
 
 class Users(DetailHandler):
 
     custom_methods = ['servicesPools', 'userServices']
+    list_db_fields = {
+        'id': 'uuid', 'name': 'name', 'real_name': 'real_name', 'comments': 'comments', 'state': 'state', 'last_access': 'last_access'
+    }
 
     @staticmethod
     def uuid_to_id(iterator):
@@ -89,7 +98,7 @@ class Users(DetailHandler):
         # Extract authenticator
         try:
             if item is None:
-                values = list(Users.uuid_to_id(parent.users.all().values('uuid', 'name', 'real_name', 'comments', 'state', 'staff_member', 'is_admin', 'last_access', 'parent')))
+                values = list(Users.uuid_to_id(self.applyListParams(parent.users.all()).values('uuid', 'name', 'real_name', 'comments', 'state', 'staff_member', 'is_admin', 'last_access', 'parent')))
                 for res in values:
                     res['role'] = res['staff_member'] and (res['is_admin'] and _('Admin') or _('Staff member')) or _('User')
                 return values
@@ -214,7 +223,7 @@ class Users(DetailHandler):
                 'id': i.uuid,
                 'name': i.name,
                 'thumb': i.image.thumb64 if i.image is not None else DEFAULT_THUMB_BASE64,
-                'user_services_count': i.userServices.exclude(state__in=(State.REMOVED, State.ERROR)).count(),
+                'user_services_count': i.user_services_count,
                 'state': _('With errors') if i.isRestrained() else _('Ok'),
             })
 
@@ -224,12 +233,11 @@ class Users(DetailHandler):
         uuid = processUuid(item)
         user = parent.users.get(uuid=processUuid(uuid))
         res = []
-        for i in user.userServices.all():
-            if i.state == State.USABLE:
-                v = AssignedService.itemToDict(i)
-                v['pool'] = i.deployed_service.name
-                v['pool_id'] = i.deployed_service.uuid
-                res.append(v)
+        for i in user.userServices.filter(state=State.USABLE).select_related('deployed_service', 'publication', 'user', 'user__manager').prefetch_related('properties'):
+            v = AssignedService.itemToDict(i)
+            v['pool'] = i.deployed_service.name
+            v['pool_id'] = i.deployed_service.uuid
+            res.append(v)
 
         return res
 
@@ -246,6 +254,7 @@ class Groups(DetailHandler):
                 q = parent.groups.all().order_by('name')
             else:
                 q = parent.groups.filter(uuid=processUuid(item))
+            q = q.prefetch_related(Prefetch('groups', queryset=Group.objects.order_by('name')))
             res = []
             for i in q:
                 val = {
@@ -257,7 +266,7 @@ class Groups(DetailHandler):
                     'meta_if_any': i.meta_if_any
                 }
                 if i.is_meta:
-                    val['groups'] = list(x.uuid for x in i.groups.all().order_by('name'))
+                    val['groups'] = list(x.uuid for x in i.groups.all())
                 res.append(val)
             if multi:
                 return res
@@ -379,7 +388,7 @@ class Groups(DetailHandler):
                 'id': i.uuid,
                 'name': i.name,
                 'thumb': i.image.thumb64 if i.image is not None else DEFAULT_THUMB_BASE64,
-                'user_services_count': i.userServices.exclude(state__in=(State.REMOVED, State.ERROR)).count(),
+                'user_services_count': i.user_services_count,
                 'state': _('With errors') if i.isRestrained() else _('Ok'),
             })
 
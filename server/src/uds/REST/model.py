@@ -36,6 +36,8 @@ from __future__ import unicode_literals
 from uds.REST.handlers import NotFound, RequestError, ResponseError, AccessDenied, NotSupportedError
 from django.utils.translation import ugettext as _
 from django.db import IntegrityError
+from django.db.models import Q, CharField, TextField
+from django.core.exceptions import FieldDoesNotExist
 
 from uds.core.ui.UserInterface import gui as uiGui
 from uds.REST.handlers import Handler, HandlerError
@@ -63,6 +65,38 @@ TABLEINFO = 'tableinfo'
 GUI = 'gui'
 LOG = 'log'
 
+# Header with the total number of items of a listing (before paging)
+TOTAL_COUNT_HEADER = 'X-Total-Count'
+
+
+def globToQ(lookup, pattern):
+    """
+    Translates a filter pattern (unix files like glob, with optional ^ and $) to a case insensitive
+    database condition over "lookup".
+    Returns None if the pattern can't be translated
+    """
+    if pattern[:1] == '^':
+        pattern = pattern[1:]
+    if pattern[-1:] == '$':
+        pattern = pattern[:-1]
+
+    if '[' in pattern:  # Sequences are only processed on python
+        return None
+
+    if '*' not in pattern and '?' not in pattern:
+        return Q(**{lookup + '__iexact': pattern})
+
+    inner = pattern.strip('*')
+    if '*' not in inner and '?' not in inner:
+        if pattern[0] == '*' and pattern[-1] == '*':
+            return Q(**{lookup + '__icontains': inner})
+        if pattern[-1] == '*':
+            return Q(**{lookup + '__istartswith': inner})
+        return Q(**{lookup + '__iendswith': inner})
+
+    regex = ''.join('.*' if c == '*' else '.' if c == '?' else re.escape(c) for c in pattern)
+    return Q(**{lookup + '__iregex': '^' + regex + '$'})
+
 OK = 'ok'  # Constant to be returned when result is just "operation complete successfully"
 
 
@@ -78,6 +112,27 @@ class BaseModelHandler(Handler):
     """
     Base Handler for Master & Detail Handlers
     """
+    # Query plan for listing items, so listing N items costs a constant number of queries
+    # select_related & prefetch_related are applied "as is", and annotations is a dictionary name --> expression (or
+    # a callable returning the expression, if it depends on request time values), available as attribute on listed items
+    list_select_related = ()
+    list_prefetch_related = ()
+    list_annotations = {}
+    # Fields of listed items that can be filtered & sorted on database: item field --> model field lookup
+    # Annotations can also be sorted on database using its name
+    list_db_fields = {}
+
+    def applyListPlan(self, queryset):
+        """
+        Applies the handler listing query plan to the queryset
+        """
+        if self.list_select_related:
+            queryset = queryset.select_related(*self.list_select_related)
+        if self.list_prefetch_related:
+            queryset = queryset.prefetch_related(*self.list_prefetch_related)
+        if self.list_annotations:
+            queryset = queryset.annotate(**{k: v() if callable(v) else v for k, v in six.iteritems(self.list_annotations)})
+        return queryset
 
     def addField(self, gui, field):  # pylint: disable=no-self-use
         """
@@ -441,6 +496,13 @@ class DetailHandler(BaseModelHandler):  # pylint: disable=abstract-class-not-use
 
         return self.deleteItem(parent, self._args[0])
 
+    def applyListParams(self, queryset):
+        """
+        Applies listing parameters (filter, sort & paging) received by parent handler to the queryset of
+        listed items, so they are resolved on database if possible
+        """
+        return self._parent.applyListParams(queryset, self.list_db_fields, self.list_annotations)
+
     def fallbackGet(self):
         """
         Invoked if default get can't process request.
@@ -565,8 +627,13 @@ class ModelHandler(BaseModelHandler):
     # Which model does this manage
     model = None
 
-    # By default, filter is empty
+    # By default, filter, sorting & paging are empty
     fltr = None
+    sort = None
+    offset = None
+    limit = None
+
+    list_db_fields = {'id': 'uuid', 'name': 'name', 'comments': 'comments'}
 
     # This is an array of tuples of two items, where first is method and second inticates if method needs parent id
     # For example ('services', True) -- > .../id_parent/services
@@ -656,36 +723,126 @@ class ModelHandler(BaseModelHandler):
 
     # End overridable
 
+    def __extractParam(self, name):
+        if name not in self._params:
+            return None
+        value = self._params[name]
+        del self._params[name]  # Remove parameter
+        return value
+
     def extractFilter(self):
-        # Extract filter from params if present
-        self.fltr = None
-        if 'filter' in self._params:
-            self.fltr = self._params['filter']
-            del self._params['filter']  # Remove parameter
+        # Extract filter, sorting & paging from params if present
+        self.fltr = self.__extractParam('filter')
+        self.sort = self.__extractParam('sort')
+        try:
+            self.offset = self.__extractParam('offset')
+            self.offset = int(self.offset) if self.offset is not None else None
+            self.limit = self.__extractParam('limit')
+            self.limit = int(self.limit) if self.limit is not None else None
+        except ValueError:
+            raise RequestError('Invalid paging parameters')
+        self._listDone = set()  # Listing operations already done on database
+        if self.fltr is not None:
             logger.debug('Found a filter expression ({})'.format(self.fltr))
 
+    def __splitFilter(self):
+        try:
+            fld, pattern = self.fltr.split('=')
+            return fld, pattern
+        except Exception:
+            logger.info('Filtering expression {} is invalid!'.format(self.fltr))
+            raise RequestError('Filtering expression {} is invalid'.format(self.fltr))
+
+    def __sortFields(self):
+        return [(f[1:], True) if f[0] == '-' else (f, False) for f in self.sort.split(',') if f]
+
+    @staticmethod
+    def __modelField(model, lookup):
+        field = None
+        for part in lookup.split('__'):
+            if model is None:
+                raise FieldDoesNotExist(lookup)
+            field = model._meta.get_field(part)
+            model = field.related_model
+        return field
+
+    def applyListParams(self, queryset, dbFields=None, annotations=None):
+        """
+        Applies listing parameters (filter, sort & paging) to the queryset of listed items, as long as they can be resolved on database.
+        The ones that can't are applied later, by doFilter, over the items dictionaries
+        Sorting & paging are only resolved on database if everything before them also is.
+        :param dbFields: items field --> model field lookup, defaults to list_db_fields
+        :param annotations: annotations of queryset, defaults to list_annotations
+        """
+        dbFields = self.list_db_fields if dbFields is None else dbFields
+        annotations = self.list_annotations if annotations is None else annotations
+        done = self._listDone = set()
+
+        if self.fltr is not None:
+            fld, pattern = self.__splitFilter()
+            q = None
+            try:
+                if fld in dbFields and isinstance(self.__modelField(queryset.model, dbFields[fld]), (CharField, TextField)):
+                    q = globToQ(dbFields[fld], pattern)
+            except FieldDoesNotExist:
+                pass
+            if q is None:
+                return queryset
+            queryset = queryset.filter(q)
+            done.add('filter')
+
+        if self.sort is not None:
+            ordering = []
+            for fld, desc in self.__sortFields():
+                lookup = fld if fld in annotations else dbFields.get(fld)
+                if lookup is None:
+                    return queryset
+                if lookup not in annotations:
+                    try:
+                        self.__modelField(queryset.model, lookup)
+                    except FieldDoesNotExist:
+                        return queryset
+                ordering.append(('-' if desc else '') + lookup)
+            queryset = queryset.order_by(*(ordering + ['pk']))  # pk ensures stable pages
+            done.add('sort')
+
+        if self.offset is not None or self.limit is not None:
+            self.addHeader(TOTAL_COUNT_HEADER, queryset.count())
+            offset = self.offset or 0
+            queryset = queryset[offset:offset + self.limit] if self.limit is not None else queryset[offset:]
+            done.add('paging')
+
+        return queryset
+
     def doFilter(self, data):
         # Right now, filtering only supports a single filter, in a future
         # we may improve it
-        if self.fltr is None:
+        if self.fltr is None and self.sort is None and self.offset is None and self.limit is None:
             return data
 
         # Filtering a non iterable (list or tuple)
         if not isinstance(data, (list, tuple, types.GeneratorType)):
             return data
 
-        logger.debug('data: {}, fltr: {}'.format(data, self.fltr))
-        try:
-            fld, pattern = self.fltr.split('=')
-            s, e = '', ''
-            if pattern[0] == '^':
-                pattern = pattern[1:]
-                s = '^'
-            if pattern[-1] == '$':
-                pattern = pattern[:-1]
-                e = '$'
+        done = getattr(self, '_listDone', set())
 
-            r = re.compile(s + fnmatch.translate(pattern) + e, re.IGNORECASE)
+        if self.fltr is not None and 'filter' not in done:
+            logger.debug('data: {}, fltr: {}'.format(data, self.fltr))
+            fld, pattern = self.__splitFilter()
+            try:
+                s, e = '', ''
+                if pattern[0] == '^':
+                    pattern = pattern[1:]
+                    s = '^'
+                if pattern[-1] == '$':
+                    pattern = pattern[:-1]
+                    e = '$'
+
+                r = re.compile(s + fnmatch.translate(pattern) + e, re.IGNORECASE)
+            except Exception:
+                logger.exception('Exception:')
+                logger.info('Filtering expression {} is invalid!'.format(self.fltr))
+                raise RequestError('Filtering expression {} is invalid'.format(self.fltr))
 
             def fltr_function(item):
                 try:
@@ -695,14 +852,25 @@ class ModelHandler(BaseModelHandler):
                     return False
                 return True
 
-            res = list(filter(fltr_function, data))
+            data = list(filter(fltr_function, data))
 
-            logger.debug('After filtering: {}'.format(res))
-            return res
-        except:
-            logger.exception('Exception:')
-            logger.info('Filtering expression {} is invalid!'.format(self.fltr))
-            raise RequestError('Filtering expression {} is invalid'.format(self.fltr))
+            logger.debug('After filtering: {}'.format(data))
+
+        if self.sort is not None and 'sort' not in done:
+            data = list(data)
+            # Stable sorts, from last field to first one
+            for fld, desc in reversed(self.__sortFields()):
+                try:
+                    data.sort(key=lambda item: (item.get(fld) is None, item.get(fld)), reverse=desc)
+                except TypeError:  # Non comparable values, sort them as text
+                    data.sort(key=lambda item: six.text_type(item.get(fld, '')), reverse=desc)
+
+        if 'paging' not in done:
+            data = list(data)
+            self.addHeader(TOTAL_COUNT_HEADER, len(data))
+            if self.offset is not None or self.limit is not None:
+                offset = self.offset or 0
+                data = data[offset:offset + self.limit] if self.limit is not None else data[offset:]
 
         return data
 
@@ -738,10 +906,10 @@ class ModelHandler(BaseModelHandler):
         raise Exception('Invalid code executed on processDetail')
 
     def getItems(self, overview=True, *args, **kwargs):
-        for item in self.model.objects.filter(*args, **kwargs):
+        # Items without read permission are filtered out on database
+        query = self.applyListPlan(permissions.filterPermitted(self._user, self.model.objects.filter(*args, **kwargs), permissions.PERMISSION_READ))
+        for item in self.applyListParams(query):
             try:
-                if permissions.checkPermissions(self._user, item, permissions.PERMISSION_READ) is False:
-                    continue
                 if overview:
                     yield self.item_as_dict_overview(item)
                 else:
@@ -752,6 +920,20 @@ class ModelHandler(BaseModelHandler):
                 # logger.exception('Exception getting item from {0}'.format(self.model))
                 pass
 
+    def listItems(self, overview=True):
+        """
+        Returns the items listing. Listings are the biggest responses (i.e. user services of big pools), so if no listing
+        parameter has been requested, items are returned as a generator and streamed while rendered (see Handler.stream).
+        The trade-off is that errors found while iterating end the response with an invalid json instead of an http error,
+        and the queries done are not counted on X-Query-Count.
+        If listing parameters are requested, items are read at once, as they are applied (doFilter) after reading them
+        """
+        items = self.getItems(overview=overview)
+        if self.fltr is None and self.sort is None and self.offset is None and self.limit is None:
+            self.stream = True
+            return items
+        return list(items)
+
     def get(self):
         """
         Wraps real get method so we can process filters if they exists
@@ -765,7 +947,7 @@ class ModelHandler(BaseModelHandler):
         nArgs = len(self._args)
 
         if nArgs == 0:
-            return list(self.getItems(overview=False))
+            return self.listItems(overview=False)
 
         # if has custom methods, look for if this request matches any of them
         for cm in self.custom_methods:
@@ -792,7 +974,7 @@ class ModelHandler(BaseModelHandler):
 
         if nArgs == 1:
             if self._args[0] == OVERVIEW:
-                return list(self.getItems())
+                return self.listItems()
             elif self._args[0] == TYPES:
                 return list(self.getTypes())
             elif self._args[0] == TABLEINFO:
@@ -802,7 +984,7 @@ class ModelHandler(BaseModelHandler):
 
             # get item ID
             try:
-                val = self.model.objects.get(uuid=self._args[0].lower())
+                val = self.applyListPlan(self.model.objects.all()).get(uuid=self._args[0].lower())
 
                 self.ensureAccess(val, permissions.PERMISSION_READ)
 
@@ -44,6 +44,13 @@ from django import http
 
 import logging
 
+try:
+    import orjson  # Optional, faster json encoder. Used if installed
+    if not hasattr(orjson, 'OPT_PASSTHROUGH_DATETIME'):  # Too old, dates must be rendered as we want
+        orjson = None
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
 
@@ -77,10 +84,11 @@ class ContentProcessor(object):
         """
         return ''
 
-    def getResponse(self, obj):
+    def getResponse(self, obj, stream=False):
         """
         Converts an obj to a response of specific type (json, XML, ...)
         This is done using "render" method of specific type
+        If stream is True, processors able to do it can stream generators instead of rendering them at once
         """
         return http.HttpResponse(content=self.render(obj), content_type=self.mime_type + "; charset=utf-8")
 
@@ -90,6 +98,19 @@ class ContentProcessor(object):
         """
         return six.text_type(obj)
 
+    @staticmethod
+    def renderDefault(obj):
+        """
+        Converts the values that renderers can't serialize by themselves, the same way procesForRender does
+        """
+        if isinstance(obj, (datetime.datetime, datetime.date)):
+            return int(time.mktime(obj.timetuple()))
+        elif isinstance(obj, six.binary_type):
+            return obj.decode('utf-8')
+        elif isinstance(obj, types.GeneratorType):
+            return list(obj)
+        return six.text_type(obj)
+
     @staticmethod
     def procesForRender(obj):
         """
@@ -148,11 +169,53 @@ class MarshallerProcessor(ContentProcessor):
 class JsonProcessor(MarshallerProcessor):
     """
     Provides JSON content processor
+
+    Objects are rendered in a single pass, converting values json can't serialize (dates, bytes, ...) as they are found.
+    Generators returned by handlers that allow it (Handler.stream) are streamed as an array, so they are never kept whole on memory
     """
     mime_type = 'application/json'
     extensions = ['json']
     marshaller = json
 
+    # Size of the chunks of streamed responses
+    streamChunkSize = 65536
+
+    encoder = json.JSONEncoder(default=ContentProcessor.renderDefault)
+
+    def getResponse(self, obj, stream=False):
+        if stream and isinstance(obj, types.GeneratorType):
+            return http.StreamingHttpResponse(self.renderStream(obj), content_type=self.mime_type + "; charset=utf-8")
+        return super(JsonProcessor, self).getResponse(obj)
+
+    def render(self, obj):
+        if orjson is not None:
+            try:
+                return orjson.dumps(obj, default=ContentProcessor.renderDefault, option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS).decode('utf-8')
+            except TypeError:  # Things like integers bigger than 64 bits, let standard encoder process them
+                pass
+        return self.encoder.encode(obj)
+
+    def renderStream(self, items):
+        """
+        Renders the items as a json array, in chunks of (about) streamChunkSize
+        """
+        chunk, size, separator = ['['], 1, ''
+        try:
+            for item in items:
+                data = separator + self.render(item)
+                separator = ','
+                chunk.append(data)
+                size += len(data)
+                if size >= self.streamChunkSize:
+                    yield ''.join(chunk)
+                    chunk, size = [], 0
+        except Exception:
+            # Headers are already sent, so the error can't be reported to client (it will get an invalid json)
+            logger.exception('Error streaming response')
+            raise
+        chunk.append(']')
+        yield ''.join(chunk)
+
 # ---------------
 # XML Processor
 # ---------------
@@ -85,7 +85,7 @@ def getUDSCookie(request, response=None, force=False):
 def getRootUser():
     # pylint: disable=unexpected-keyword-arg, no-value-for-parameter
     from uds.models import Authenticator
-    u = User(id=ROOT_ID, name=GlobalConfig.SUPER_USER_LOGIN.get(True), real_name=_('System Administrator'), state=State.ACTIVE, staff_member=True, is_admin=True)
+    u = User(id=ROOT_ID, name=GlobalConfig.SUPER_USER_LOGIN.get(), real_name=_('System Administrator'), state=State.ACTIVE, staff_member=True, is_admin=True)
     u.manager = Authenticator()
     u.getGroups = lambda: []
     u.updateLastAccess = lambda: None
@@ -144,7 +144,7 @@ def trustedSourceRequired(view_func):
         Wrapped function for decorator
         """
         from uds.core.util import net
-        if net.ipInNetwork(request.ip, GlobalConfig.TRUSTED_SOURCES.get(True)) is False:
+        if net.ipInNetwork(request.ip, GlobalConfig.TRUSTED_SOURCES.get()) is False:
             return HttpResponseForbidden()
         return view_func(request, *args, **kwargs)
 
@@ -203,7 +203,7 @@ def authenticate(username, password, authenticator, useInternalAuthenticate=Fals
     logger.debug('Authenticating user {0} with authenticator {1}'.format(username, authenticator))
 
     # If global root auth is enabled && user/password is correct,
-    if GlobalConfig.SUPER_USER_ALLOW_WEBACCESS.getBool(True) and username == GlobalConfig.SUPER_USER_LOGIN.get(True) and password == GlobalConfig.SUPER_USER_PASS.get(True):
+    if GlobalConfig.SUPER_USER_ALLOW_WEBACCESS.getBool() and username == GlobalConfig.SUPER_USER_LOGIN.get() and password == GlobalConfig.SUPER_USER_PASS.get():
         return getRootUser()
 
     gm = auths.GroupsManager(authenticator)
@@ -41,7 +41,9 @@ from uds.core.util import encoders
 from socket import gethostname
 from pickle import loads, dumps
 from datetime import timedelta
+import collections
 import threading
+import heapq
 import time
 import logging
 
@@ -50,27 +52,21 @@ __updated__ = '2018-09-17'
 logger = logging.getLogger(__name__)
 
 
-class DelayedTaskThread(threading.Thread):
-    """
-    Class responsible of executing a delayed task in its own thread
-    """
-
-    def __init__(self, taskInstance):
-        super(DelayedTaskThread, self).__init__()
-        self._taskInstance = taskInstance
-
-    def run(self):
-        try:
-            self._taskInstance.execute()
-        except Exception as e:
-            logger.exception("Exception in thread {0}: {1}".format(e.__class__, e))
-
-
 class DelayedTaskRunner(object):
     """
     Delayed task runner class
+
+    The "run" method is executed on several threads (as many as DELAYED_TASKS_THREADS). All of them
+    share this instance, and work this way:
+      * Only one of them at a time (the dispatcher) claims due tasks from database, in batches
+        of as many tasks as idle runner threads are there
+      * Claimed tasks are put on an in-memory queue, from where all runner threads (including the
+        dispatcher, once its claim is done) take them and execute them
+      * When there is nothing to do, threads sleep until the next known task is due (or until
+        a new task is inserted on this node), but never longer than "granularity" seconds,
+        so tasks inserted by other nodes are also noticed
     """
-    # How often tasks r checked
+    # Max time (in seconds) that we can be without looking at database for new tasks
     granularity = 2
 
     # to keep singleton DelayedTaskRunner
@@ -80,13 +76,24 @@ class DelayedTaskRunner(object):
         logger.debug("Initializing delayed task runner")
         self._hostname = gethostname()
         self._keepRunning = True
+        self._condition = threading.Condition()
+        self._pending = collections.deque()  # Claimed tasks, waiting for a runner thread
+        self._upcoming = []  # Heap of known next executions (as local time.time() values)
+        self._lastCheck = 0  # Last time (time.time()) that database was checked
+        self._dispatching = False  # True while a thread is claiming tasks from database
+        self._workers = 0  # Number of threads executing "run"
+        self._busy = 0  # Number of threads executing a task
+        self._executed = 0
+        self._maxBusy = 0
 
     def notifyTermination(self):
         """
         Invoke this whenever you want to terminate the delayed task runner thread
         It will mark the thread to "stop" ASAP
         """
-        self._keepRunning = False
+        with self._condition:
+            self._keepRunning = False
+            self._condition.notify_all()
 
     @staticmethod
     def runner():
@@ -99,31 +106,118 @@ class DelayedTaskRunner(object):
             DelayedTaskRunner._runner = DelayedTaskRunner()
         return DelayedTaskRunner._runner
 
-    def executeOneDelayedTask(self):
+    def claimDelayedTasks(self, maxTasks):
+        """
+        Atomically removes from database up to "maxTasks" tasks that are due, and returns their instances.
+        Also refreshes the known upcoming executions, so we can wake up exactly when next one is due.
+        """
         now = getSqlDatetime()
         filt = Q(execution_time__lt=now) | Q(insert_date__gt=now + timedelta(seconds=30))
         # If next execution is before now or last execution is in the future (clock changed on this server, we take that task as executable)
-        try:
-            with transaction.atomic():  # Encloses
-                # Throws exception if no delayed task is avilable
-                task = dbDelayedTask.objects.select_for_update().filter(filt).order_by('execution_time')[0]  # @UndefinedVariable
-                if task.insert_date > now + timedelta(seconds=30):
-                    logger.warning('EXecuted {} due to insert_date being in the future!'.format(task.type))
-                taskInstanceDump = encoders.decode(task.instance, 'base64')
-                task.delete()
-            taskInstance = loads(taskInstanceDump)
-        except IndexError:
-            return  # No problem, there is no waiting delayed task
-        except Exception:
-            # Transaction have been rolled back using the "with atomic", so here just return
-            # Note that is taskInstance can't be loaded, this task will not be retried
-            logger.exception('Executing one task')
-            return
+        # If database allows it, rows locked by other nodes are skipped, so nodes do not serialize on same rows
+        lockParams = {'skip_locked': True} if connection.features.has_select_for_update_skip_locked else {}
+        with transaction.atomic():  # Encloses
+            tasks = list(dbDelayedTask.objects.select_for_update(**lockParams).filter(filt).order_by('execution_time')[:maxTasks])  # @UndefinedVariable
+            if tasks:
+                dbDelayedTask.objects.filter(id__in=[t.id for t in tasks]).delete()  # @UndefinedVariable
+
+        upcoming = dbDelayedTask.objects.filter(execution_time__gte=now).order_by('execution_time').values_list('execution_time', flat=True)[:maxTasks]  # @UndefinedVariable
+
+        # Database times are translated to local times, so we do not need to ask database for time while waiting
+        localNow = time.time()
+        nextExecutions = [localNow + (t - now).total_seconds() for t in upcoming]
+        if len(tasks) == maxTasks:  # Probably there are more tasks waiting, so check again asap
+            nextExecutions.append(localNow)
+
+        instances = []
+        for task in tasks:
+            if task.insert_date > now + timedelta(seconds=30):
+                logger.warning('EXecuted {} due to insert_date being in the future!'.format(task.type))
+            try:
+                instances.append(loads(encoders.decode(task.instance, 'base64')))
+            except Exception:
+                # Note that is taskInstance can't be loaded, this task will not be retried
+                logger.exception('Loading delayed task {}'.format(task.type))
+
+        return instances, nextExecutions
 
-        if taskInstance is not None:
-            logger.debug('Executing delayedTask:>{0}<'.format(task))
+    def executeDelayedTask(self, taskInstance):
+        logger.debug('Executing delayedTask:>{0}<'.format(taskInstance))
+        with self._condition:
+            self._busy += 1
+            self._maxBusy = max(self._maxBusy, self._busy)
+        try:
             taskInstance.env = Environment.getEnvForType(taskInstance.__class__)
-            DelayedTaskThread(taskInstance).start()
+            taskInstance.execute()
+        except Exception as e:
+            logger.exception("Exception executing delayed task {0}: {1}".format(e.__class__, e))
+        finally:
+            with self._condition:
+                self._busy -= 1
+                self._executed += 1
+
+    def stats(self, reset=False):
+        """
+        Returns a dictionary with current status of runner threads, and counters since start (or last reset)
+        "pending" are tasks already claimed from database waiting for a free thread, so if it is usually
+        not empty (or maxBusy equals threads), DELAYED_TASKS_THREADS can be increased
+        """
+        with self._condition:
+            res = {
+                'name': 'DelayedTasks',
+                'threads': self._workers,
+                'busy': self._busy,
+                'pending': len(self._pending),
+                'maxBusy': self._maxBusy,
+                'executed': self._executed,
+            }
+            if reset:
+                self._maxBusy, self._executed = self._busy, 0
+        return res
+
+    def __nextDelay(self):
+        """
+        Seconds to wait before going to database again (<= 0 means "go now")
+        Must be invoked with self._condition acquired
+        """
+        now = time.time()
+        delay = self._lastCheck + self.granularity - now
+        if self._upcoming:
+            delay = min(delay, self._upcoming[0] - now)
+        return delay
+
+    def __nextTask(self):
+        """
+        Returns next task instance to execute, waiting until there is one available.
+        Returns None if a claim has been done (or termination requested), so the caller simply loops
+        """
+        with self._condition:
+            while True:
+                if not self._keepRunning:
+                    return None
+                if self._pending:
+                    return self._pending.popleft()
+                delay = self.granularity if self._dispatching else self.__nextDelay()
+                if delay <= 0:
+                    break
+                self._condition.wait(delay)
+            self._dispatching = True
+            # Only as many tasks as idle threads (this one included) are claimed, so the rest can be run by other nodes
+            maxTasks = max(1, self._workers - self._busy - len(self._pending))
+
+        # Database is accessed without holding the lock, so the other threads can keep executing pending tasks
+        instances, nextExecutions = [], [time.time() + self.granularity]
+        try:
+            instances, nextExecutions = self.claimDelayedTasks(maxTasks)
+        finally:
+            with self._condition:
+                self._dispatching = False
+                self._lastCheck = time.time()
+                self._pending.extend(instances)
+                self._upcoming = nextExecutions
+                heapq.heapify(self._upcoming)
+                self._condition.notify_all()
+        return None
 
     def __insert(self, instance, delay, tag):
         now = getSqlDatetime()
@@ -137,6 +231,12 @@ class DelayedTaskRunner(object):
         dbDelayedTask.objects.create(type=typeName, instance=instanceDump,  # @UndefinedVariable
                                      insert_date=now, execution_delay=delay, execution_time=exec_time, tag=tag)
 
+        # Wake up runner threads (if running on this process) so this task is not waiting for next database check
+        with self._condition:
+            if self._workers > 0:
+                heapq.heappush(self._upcoming, time.time() + delay)
+                self._condition.notify()
+
     def insert(self, instance, delay, tag=''):
         retries = 3
         while retries > 0:
@@ -178,14 +278,28 @@ class DelayedTaskRunner(object):
 
     def run(self):
         logger.debug("At loop")
-        while self._keepRunning:
-            try:
-                time.sleep(self.granularity)
-                self.executeOneDelayedTask()
-            except Exception as e:
-                logger.error('Unexpected exception at run loop {0}: {1}'.format(e.__class__, e))
+        with self._condition:
+            self._workers += 1
+        try:
+            while self._keepRunning:
                 try:
-                    connection.close()
-                except Exception:
-                    logger.exception('Exception clossing connection at delayed task')
+                    taskInstance = self.__nextTask()
+                    if taskInstance is not None:
+                        self.executeDelayedTask(taskInstance)
+                except Exception as e:
+                    logger.error('Unexpected exception at run loop {0}: {1}'.format(e.__class__, e))
+                    try:
+                        connection.close()
+                    except Exception:
+                        logger.exception('Exception clossing connection at delayed task')
+                    time.sleep(self.granularity)  # Avoid hammering a failing database
+        finally:
+            # Claimed tasks are already removed from database, so the ones not executed yet would be lost
+            while True:
+                with self._condition:
+                    if not self._pending:
+                        self._workers -= 1
+                        break
+                    taskInstance = self._pending.popleft()
+                self.executeDelayedTask(taskInstance)
         logger.info('Exiting DelayedTask Runner because stop has been requested')
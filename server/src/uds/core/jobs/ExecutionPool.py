@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) 2012 Virtual Cable S.L.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#    * Neither the name of Virtual Cable S.L. nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+@author: Adolfo Gómez, dkmaster at dkmon dot com
+"""
+from __future__ import unicode_literals
+
+from django.db import connection
+import collections
+import threading
+import time
+import logging
+
+__updated__ = '2018-09-17'
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 32
+
+
+class ExecutionPool(object):
+    """
+    Fixed size pool of threads used to execute jobs.
+
+    * Threads are created once and reused, so their database connections are also reused
+      (they are only closed if unusable or older than CONN_MAX_AGE)
+    * The number of waiting items is limited by "queueSize", submit returns False if it is full
+    * Every item is submitted with a "key" (usually the job type), and a maximum number of concurrent
+      executions of that key on this pool
+    * Keeps counters so saturation of the pool can be checked (see "stats")
+    """
+
+    def __init__(self, name, numThreads, queueSize=DEFAULT_QUEUE_SIZE):
+        self._name = name
+        self._numThreads = max(1, numThreads)
+        self._queueSize = queueSize
+        self._condition = threading.Condition()
+        self._queue = collections.deque()
+        self._threads = []
+        self._keepRunning = True
+        self._running = collections.Counter()  # key -> number of items queued or executing
+        self._busy = 0
+        # Counters
+        self._executed = 0
+        self._rejected = 0
+        self._maxBusy = 0
+        self._maxQueued = 0
+        self._busyTime = 0.0
+        self._startTime = time.time()
+
+    def __start(self):
+        # Must be invoked with self._condition acquired
+        if not self._threads:
+            for n in range(self._numThreads):
+                thread = threading.Thread(target=self.__worker, name='{}-{}'.format(self._name, n))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def __worker(self):
+        while True:
+            with self._condition:
+                while self._keepRunning and not self._queue:
+                    self._condition.wait()
+                if not self._queue:  # Not running and nothing more to do
+                    break
+                key, func, args, kwargs = self._queue.popleft()
+                self._busy += 1
+                self._maxBusy = max(self._maxBusy, self._busy)
+
+            start = time.time()
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                logger.exception('Executing {} on pool {}'.format(key, self._name))
+            finally:
+                # Connection is kept for next item, unless it is broken or too old
+                try:
+                    connection.close_if_unusable_or_obsolete()
+                except Exception:
+                    logger.exception('Checking db connection at pool {}'.format(self._name))
+
+                with self._condition:
+                    self._busy -= 1
+                    self._running[key] -= 1
+                    if self._running[key] <= 0:
+                        del self._running[key]
+                    self._executed += 1
+                    self._busyTime += time.time() - start
+                    self._condition.notify_all()
+
+        # Thread is finishing, release its connection
+        connection.close()
+
+    def hasCapacity(self):
+        """
+        Returns True if a new item can be queued right now
+        """
+        with self._condition:
+            return self._keepRunning and len(self._queue) < self._queueSize
+
+    def saturatedKeys(self, maxConcurrency):
+        """
+        Returns the list of keys that have reached their concurrency limit.
+        maxConcurrency is a callable that returns the limit for a key (0 means no limit, as on submit)
+        """
+        with self._condition:
+            return [key for key, count in self._running.items() if 0 < maxConcurrency(key) <= count]
+
+    def submit(self, key, maxConcurrency, func, *args, **kwargs):
+        """
+        Queues "func" for execution.
+
+        Args:
+            key: Identifier of the kind of item (for concurrency caps)
+            maxConcurrency: Max items with this key queued or executing at once on this pool (0 means no limit)
+
+        Returns:
+            True if the item has been queued, False if the pool is full, or stopped, or "key" is at its limit
+        """
+        with self._condition:
+            if not self._keepRunning or len(self._queue) >= self._queueSize or (maxConcurrency > 0 and self._running[key] >= maxConcurrency):
+                self._rejected += 1
+                return False
+            self.__start()
+            self._running[key] += 1
+            self._queue.append((key, func, args, kwargs))
+            self._maxQueued = max(self._maxQueued, len(self._queue))
+            self._condition.notify()
+        return True
+
+    def stats(self, reset=False):
+        """
+        Returns a dictionary with current pool status and counters since creation (or last reset):
+          * threads, busy, queued: Current status
+          * maxBusy, maxQueued: Peak values
+          * executed, rejected: Number of items executed and rejected
+          * utilization: Fraction of time threads have been busy (near 1.0 means the pool is undersized)
+        """
+        with self._condition:
+            now = time.time()
+            elapsed = max(now - self._startTime, 0.001)
+            busyTime = self._busyTime
+            res = {
+                'name': self._name,
+                'threads': self._numThreads,
+                'busy': self._busy,
+                'queued': len(self._queue),
+                'queueSize': self._queueSize,
+                'maxBusy': self._maxBusy,
+                'maxQueued': self._maxQueued,
+                'executed': self._executed,
+                'rejected': self._rejected,
+                'utilization': busyTime / (elapsed * self._numThreads),
+            }
+            if reset:
+                self._executed = self._rejected = 0
+                self._maxBusy, self._maxQueued = self._busy, len(self._queue)
+                self._busyTime = 0.0
+                self._startTime = now
+        return res
+
+    def shutdown(self, wait=True):
+        """
+        Stops accepting new items. Items already queued are executed before threads finish
+        """
+        with self._condition:
+            self._keepRunning = False
+            self._condition.notify_all()
+            threads, self._threads = self._threads, []
+
+        if wait:
+            for thread in threads:
+                thread.join()
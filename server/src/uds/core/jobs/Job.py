@@ -46,6 +46,9 @@ class Job(Environmentable):
     frecuency = 24 * 3600 + 3  # Defaults to a big one, and i know frecuency is written as frequency, but this is an "historical mistake" :)
     frecuency_cfg = None  # If we use a configuration variable from DB, we need to update the frecuency asap, but not before app is ready
     friendly_name = 'Unknown'
+    # Max number of concurrent executions of this job on a node. Note that scheduler database state already
+    # avoids most concurrent executions, this ensures it even if a "running" job is released (i.e. because it's considered stuck)
+    maxConcurrency = 1
 
     def __init__(self, environment):
         """
@@ -36,10 +36,11 @@ from django.db.models import Q
 from django.db import transaction, DatabaseError, connection
 from uds.models import Scheduler as dbScheduler, getSqlDatetime
 from uds.core.util.State import State
+from uds.core.util.Config import GlobalConfig
 from uds.core.jobs.JobsFactory import JobsFactory
+from uds.core.jobs.ExecutionPool import ExecutionPool
 from datetime import timedelta
 import platform
-import threading
 import time
 import logging
 
@@ -48,34 +49,77 @@ __updated__ = '2018-03-02'
 logger = logging.getLogger(__name__)
 
 
-class JobThread(threading.Thread):
+class Scheduler(object):
     """
-    Class responsible of executing one job.
-    This class:
-      Ensures that the job is executed in a controlled way (any exception will be catch & processed)
-      Ensures that the scheduler db entry is released after run
+    Class responsible of maintain/execute scheduled jobs
+
+    Scheduler "run" loop claims jobs from database and executes them on a fixed size pool of threads
+    (SCHEDULER_THREADS), so there is never more jobs running on a node than threads on the pool.
     """
-    def __init__(self, jobInstance, dbJob):
-        super(JobThread, self).__init__()
-        self._jobInstance = jobInstance
-        self._dbJobId = dbJob.id
+    granularity = 2  # We check for cron jobs every THIS seconds
 
-    def run(self):
+    # to keep singleton Scheduler
+    _scheduler = None
+
+    def __init__(self):
+        self._hostname = platform.node()
+        self._keepRunning = True
+        self._pool = None
+        logger.info('Initialized scheduler for host "{}"'.format(self._hostname))
+
+    @staticmethod
+    def scheduler():
+        """
+        Returns a singleton to the Scheduler
+        """
+        if Scheduler._scheduler is None:
+            Scheduler._scheduler = Scheduler()
+        return Scheduler._scheduler
+
+    def notifyTermination(self):
+        """
+        Invoked to signal that termination of scheduler task(s) is requested
+        """
+        self._keepRunning = False
+
+    def pool(self):
+        """
+        Returns the execution pool used by this scheduler
+        """
+        if self._pool is None:
+            numThreads = GlobalConfig.SCHEDULER_THREADS.getInt()
+            # Jobs are only claimed when there is room for them, so a small queue is enough
+            self._pool = ExecutionPool('Scheduler', numThreads, queueSize=numThreads)
+        return self._pool
+
+    @staticmethod
+    def maxConcurrency(jobName):
+        """
+        Max number of concurrent executions on this node of the job registered as "jobName"
+        """
+        jobType = JobsFactory.factory().lookup(jobName)
+        return jobType.maxConcurrency if jobType is not None else 1
+
+    def executeJob(self, jobInstance, dbJobId):
+        """
+        Executes one job on a pool thread, ensuring that the scheduler db entry is released after run
+        """
         try:
-            self._jobInstance.execute()
+            jobInstance.execute()
         except Exception:
-            logger.warning("Exception executing job {0}".format(self._dbJobId))
+            logger.warning("Exception executing job {0}".format(dbJobId))
         finally:
-            self.jobDone()
+            self.jobDone(dbJobId)
 
-    def jobDone(self):
+    def jobDone(self, dbJobId, reschedule=True):
         """
         Invoked whenever a job is is finished (with or without exception)
+        or when it could not be executed (reschedule=False), so it is immediately available again
         """
         done = False
         while done is False:
             try:
-                self.__updateDb()
+                self.__updateDb(dbJobId, reschedule)
                 done = True
             except Exception:
                 # Databases locked, maybe because we are on a multitask environment, let's try again in a while
@@ -86,63 +130,38 @@ class JobThread(threading.Thread):
                 # logger.info('Database access failed... Retrying')
                 time.sleep(1)
 
-        # Ensures DB connection is released after job is done
-        connection.close()
-
-    def __updateDb(self):
+    def __updateDb(self, dbJobId, reschedule):
         """
         Atomically updates the scheduler db to "release" this job
         """
         with transaction.atomic():
-            job = dbScheduler.objects.select_for_update().get(id=self._dbJobId)  # @UndefinedVariable
+            job = dbScheduler.objects.select_for_update().get(id=dbJobId)  # @UndefinedVariable
             job.state = State.FOR_EXECUTE
             job.owner_server = ''
-            job.next_execution = getSqlDatetime() + timedelta(seconds=job.frecuency)
+            if reschedule:
+                job.next_execution = getSqlDatetime() + timedelta(seconds=job.frecuency)
             # Update state and last execution time at database
             job.save()
 
-
-class Scheduler(object):
-    """
-    Class responsible of maintain/execute scheduled jobs
-    """
-    granularity = 2  # We check for cron jobs every THIS seconds
-
-    # to keep singleton Scheduler
-    _scheduler = None
-
-    def __init__(self):
-        self._hostname = platform.node()
-        self._keepRunning = True
-        logger.info('Initialized scheduler for host "{}"'.format(self._hostname))
-
-    @staticmethod
-    def scheduler():
-        """
-        Returns a singleton to the Scheduler
-        """
-        if Scheduler._scheduler is None:
-            Scheduler._scheduler = Scheduler()
-        return Scheduler._scheduler
-
-    def notifyTermination(self):
-        """
-        Invoked to signal that termination of scheduler task(s) is requested
-        """
-        self._keepRunning = False
-
     def executeOneJob(self):
         """
         Looks for the best waiting job and executes it
+        Returns True if a job has been sent to execution
         """
+        pool = self.pool()
+        if not pool.hasCapacity():
+            return False
+
         jobInstance = None
         try:
             now = getSqlDatetime()  # Datetimes are based on database server times
             fltr = Q(state=State.FOR_EXECUTE) & (Q(last_execution__gt=now) | Q(next_execution__lt=now))
+            # Jobs already running on this node up to its concurrency limit are not claimed
+            saturated = pool.saturatedKeys(self.maxConcurrency)
             with transaction.atomic():
                 # If next execution is before now or last execution is in the future (clock changed on this server, we take that task as executable)
                 # This params are all set inside fltr (look at __init__)
-                job = dbScheduler.objects.select_for_update().filter(fltr).order_by('next_execution')[0]  # @UndefinedVariable
+                job = dbScheduler.objects.select_for_update().filter(fltr).exclude(name__in=saturated).order_by('next_execution')[0]  # @UndefinedVariable
                 if job.last_execution > now:
                     logger.warning('EXecuted {} due to last_execution being in the future!'.format(job.name))
                 job.state = State.RUNNING
@@ -155,12 +174,16 @@ class Scheduler(object):
             if jobInstance is None:
                 logger.error('Job instance can\'t be resolved for {0}, removing it'.format(job))
                 job.delete()
-                return
+                return False
             logger.debug('Executing job:>{0}<'.format(job.name))
-            JobThread(jobInstance, job).start()  # Do not instatiate thread, just run it
+            if not pool.submit(job.name, jobInstance.maxConcurrency, self.executeJob, jobInstance, job.id):
+                logger.info('Job {} could not be queued for execution, releasing it'.format(job.name))
+                self.jobDone(job.id, reschedule=False)
+                return False
+            return True
         except IndexError:
             # Do nothing, there is no jobs for execution
-            return
+            return False
         except DatabaseError as e:
             # Whis will happen whenever a connection error or a deadlock error happens
             # This in fact means that we have to retry operation, and retry will happen on main loop
@@ -182,8 +205,8 @@ class Scheduler(object):
 
     def run(self):
         """
-        Loop that executes scheduled tasks
-        Can be executed more than once, in differents threads
+        Loop that claims scheduled tasks and sends them to the execution pool
+        Only one thread per node needs to execute it (the pool is the one that runs jobs concurrently)
         """
         # We ensure that the jobs are also in database so we can
         logger.debug('Run Scheduler thread')
@@ -191,8 +214,9 @@ class Scheduler(object):
         logger.debug("At loop")
         while self._keepRunning:
             try:
-                time.sleep(self.granularity)
-                self.executeOneJob()
+                # While jobs are being found and there is room on pool, keep on claiming them
+                if not self.executeOneJob():
+                    time.sleep(self.granularity)
             except Exception as e:
                 # This can happen often on sqlite, and this is not problem at all as we recover it.
                 # The log is removed so we do not get increased workers.log file size with no information at all
@@ -202,5 +226,8 @@ class Scheduler(object):
                     connection.close()
                 except Exception:
                     logger.exception('Exception clossing connection at delayed task')
+                time.sleep(self.granularity)
         logger.info('Exiting Scheduler because stop has been requested')
+        # Wait for running jobs, so they are correctly released
+        self.pool().shutdown()
         self.releaseOwnShedules()
@@ -43,6 +43,13 @@ from uds.core.util import log
 
 from uds.core.util.Config import GlobalConfig
 
+from django.db import connection
+from django.db.models import Q, Count
+from datetime import timedelta
+import collections
+import threading
+import atexit
+import time
 import logging
 
 logger = logging.getLogger(__name__)
@@ -66,11 +73,32 @@ transDict = {
 class LogManager(object):
     """
     Manager for logging (at database) events
+
+    Log entries are queued on memory, and written in background (with a bulk insert) every "flushInterval"
+    seconds, or as soon as "batchSize" entries are waiting. Duplicates are detected on memory, and the logs of
+    every owner are trimmed to MAX_LOGS_PER_ELEMENT with one delete per owner and flush.
     """
     _manager = None
 
+    # Seconds between writes of queued entries
+    flushInterval = 1
+    # Number of queued entries that triggers a write
+    batchSize = 256
+    # Max number of entries waiting to be written. Over this, new entries are discarded
+    maxQueued = 10000
+    # Max number of owners whose last entries are kept for duplicates detection
+    maxDuplicatesKeys = 10000
+
     def __init__(self):
-        pass
+        self._lock = threading.Lock()
+        self._flushLock = threading.Lock()
+        self._queue = []
+        self._last = collections.OrderedDict()  # (owner_type, owner_id, level, source) -> last message
+        self._thread = None
+        self._wakeUp = threading.Event()
+        self._dropped = 0
+        self._written = 0
+        self._failed = 0
 
     @staticmethod
     def manager():
@@ -78,37 +106,121 @@ class LogManager(object):
             LogManager._manager = LogManager()
         return LogManager._manager
 
+    def __startFlusher(self):
+        # Must be invoked with self._lock acquired
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.__flusher, name='LogFlusher')
+            self._thread.daemon = True
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def __flusher(self):
+        while True:
+            self._wakeUp.wait(self.flushInterval)
+            self._wakeUp.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Writing log entries')
+            finally:
+                try:
+                    connection.close_if_unusable_or_obsolete()
+                except Exception:
+                    pass
+
     def __log(self, owner_type, owner_id, level, message, source, avoidDuplicates):
         """
         Logs a message associated to owner
         """
-        from uds.models import getSqlDatetime
-        from uds.models import Log
-
         # Ensure message fits on space
         message = message[:255]
 
-        qs = Log.objects.filter(owner_id=owner_id, owner_type=owner_type)
-        # First, ensure we do not have more than requested logs, and we can put one more log item
-        if qs.count() >= GlobalConfig.MAX_LOGS_PER_ELEMENT.getInt():
-            for i in qs.order_by('-created',)[GlobalConfig.MAX_LOGS_PER_ELEMENT.getInt() - 1:]:
-                i.delete()
-
-        if avoidDuplicates is True:
-            try:
-                lg = Log.objects.filter(owner_id=owner_id, owner_type=owner_type, level=level, source=source).order_by('-created', '-id')[0]
-                if lg.message == message:
+        with self._lock:
+            if avoidDuplicates is True:
+                key = (owner_type, owner_id, level, source)
+                if self._last.get(key) == message:
                     # Do not log again, already logged
                     return
-            except Exception:  # Do not exists log
-                pass
+                self._last.pop(key, None)
+                self._last[key] = message
+                while len(self._last) > self.maxDuplicatesKeys:
+                    self._last.popitem(last=False)
+
+            if len(self._queue) >= self.maxQueued:
+                self._dropped += 1
+                return
+
+            self._queue.append((owner_type, owner_id, level, message, source, time.time()))
+            self.__startFlusher()
+            if len(self._queue) >= self.batchSize:
+                self._wakeUp.set()
+
+    def flush(self):
+        """
+        Writes to database all queued log entries, and trims logs of the owners of these entries
+        """
+        from uds.models import getSqlDatetime
+        from uds.models import Log
+
+        with self._flushLock:
+            with self._lock:
+                queue, self._queue = self._queue, []
+            if not queue:
+                return
+
+            # Entries times are translated to database times
+            now, localNow = getSqlDatetime(), time.time()
+            written = self.__write([
+                Log(owner_type=owner_type, owner_id=owner_id, created=now - timedelta(seconds=localNow - stamp), source=source, level=level, data=message)
+                for owner_type, owner_id, level, message, source, stamp in queue
+            ])
+
+            with self._lock:
+                self._written += written
+                self._failed += len(queue) - written
+            if written == 0:
+                return
+
+            # Now, ensure we do not have more than requested logs for any owner
+            maxLogs = GlobalConfig.MAX_LOGS_PER_ELEMENT.getInt()
+            owners = Q()
+            for owner_type, owner_id in {(v[0], v[1]) for v in queue}:
+                owners |= Q(owner_type=owner_type, owner_id=owner_id)
+            for v in Log.objects.filter(owners).values('owner_type', 'owner_id').annotate(count=Count('id')).filter(count__gt=maxLogs).order_by():
+                qs = Log.objects.filter(owner_type=v['owner_type'], owner_id=v['owner_id'])
+                try:
+                    created, id_ = qs.order_by('-created', '-id').values_list('created', 'id')[maxLogs]
+                except IndexError:
+                    continue
+                qs.filter(Q(created__lt=created) | Q(created=created, id__lte=id_)).delete()
+
+    def __write(self, entries):
+        """
+        Writes log entries, splitting the batch on failure so only the failing entries are lost
+        Returns the number of entries written
+        """
+        from uds.models import Log
+        from django.db import transaction
 
-        # now, we add new log
         try:
-            Log.objects.create(owner_type=owner_type, owner_id=owner_id, created=getSqlDatetime(), source=source, level=level, data=message)
-        except:
-            # Some objects will not get logged, such as System administrator objects
-            pass
+            with transaction.atomic():
+                Log.objects.bulk_create(entries)
+            return len(entries)
+        except Exception:
+            if len(entries) == 1:
+                # Some objects will not get logged, such as System administrator objects
+                logger.exception('Writing log entry {}'.format(entries[0].data))
+                return 0
+
+        half = len(entries) // 2
+        return self.__write(entries[:half]) + self.__write(entries[half:])
+
+    def stats(self):
+        """
+        Returns number of entries waiting to be written, written, discarded because queue was full and failed to be written
+        """
+        with self._lock:
+            return {'queued': len(self._queue), 'written': self._written, 'dropped': self._dropped, 'failed': self._failed}
 
     def __getLogs(self, owner_type, owner_id, limit):
         """
@@ -116,6 +228,8 @@ class LogManager(object):
         """
         from uds.models import Log
 
+        # Queued entries are written first, so they are also returned
+        self.flush()
         qs = Log.objects.filter(owner_id=owner_id, owner_type=owner_type)
         return [{'date': x.created, 'level': x.level, 'source': x.source, 'message': x.data} for x in reversed(qs.order_by('-created', '-id')[:limit])]
 
@@ -125,6 +239,7 @@ class LogManager(object):
         """
         from uds.models import Log
 
+        self.flush()
         Log.objects.filter(owner_id=owner_id, owner_type=owner_type).delete()
 
     def doLog(self, wichObject, level, message, source, avoidDuplicates=True):
@@ -96,7 +96,7 @@ class PublicationLauncher(DelayedTask):
             state = pi.publish()
             deployedService = servicePoolPub.deployed_service
             deployedService.current_pub_revision += 1
-            deployedService.storeValue('toBeReplacedIn', pickle.dumps(now + datetime.timedelta(hours=GlobalConfig.SESSION_EXPIRE_TIME.getInt(True))))
+            deployedService.storeValue('toBeReplacedIn', pickle.dumps(now + datetime.timedelta(hours=GlobalConfig.SESSION_EXPIRE_TIME.getInt())))
             deployedService.save()
             PublicationFinishChecker.checkAndUpdateState(servicePoolPub, pi, state)
         except Exception:
@@ -140,7 +140,7 @@ class PublicationFinishChecker(DelayedTask):
 
                         if doPublicationCleanup:
                             pc = PublicationOldMachinesCleaner(old.id)
-                            pc.register(GlobalConfig.SESSION_EXPIRE_TIME.getInt(True) * 3600, 'pclean-' + str(old.id), True)
+                            pc.register(GlobalConfig.SESSION_EXPIRE_TIME.getInt() * 3600, 'pclean-' + str(old.id), True)
 
                     servicePoolPub.setState(State.USABLE)
                     servicePoolPub.deployed_service.markOldUserServicesAsRemovables(servicePoolPub)
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) 2012 Virtual Cable S.L.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#    * Neither the name of Virtual Cable S.L. nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+@author: Adolfo Gómez, dkmaster at dkmon dot com
+"""
+from __future__ import unicode_literals
+
+from django.utils.translation import ugettext as _
+
+from uds.core.jobs.DelayedTask import DelayedTask
+from uds.core.jobs.DelayedTaskRunner import DelayedTaskRunner
+from uds.core.util.Storage import Storage
+from uds.core.util.Config import GlobalConfig
+from uds.core.util import encoders
+from uds.models import DBFile, getSqlDatetime
+
+from datetime import timedelta
+import hashlib
+import json
+import six
+import logging
+
+logger = logging.getLogger(__name__)
+
+REPORTS_OWNER = 'reports'  # Owner of reports results (DBFile) and jobs status (Storage)
+REPORTS_TAG = 'rptgen-'
+
+(QUEUED, RUNNING, FINISHED, ERROR) = ('queued', 'running', 'finished', 'error')
+
+# A job that has not changed its status in this time (in seconds) is considered dead (i.e. server stopped while generating)
+MAX_JOB_SILENCE = 3600
+
+
+class ReportGenerator(DelayedTask):
+    """
+    Delayed task that generates a report in background
+    """
+    def __init__(self, jobId, reportUuid, params):
+        super(ReportGenerator, self).__init__()
+        self._jobId = jobId
+        self._reportUuid = reportUuid
+        self._params = params
+
+    def run(self):
+        ReportsManager.manager().generate(self._jobId, self._reportUuid, self._params)
+
+
+class ReportsManager(object):
+    """
+    Manager for background generation of reports.
+
+    Jobs are identified by the report uuid and its parameters, so identical requests share the job,
+    and its result is reused for GlobalConfig.REPORTS_CACHE_VALIDITY seconds.
+    """
+    _manager = None
+
+    def __init__(self):
+        self._storage = Storage(REPORTS_OWNER)
+
+    @staticmethod
+    def manager():
+        if ReportsManager._manager is None:
+            ReportsManager._manager = ReportsManager()
+        return ReportsManager._manager
+
+    @staticmethod
+    def jobId(reportUuid, params):
+        """
+        Key of a report generated with some parameters
+        """
+        return hashlib.sha1(json.dumps([reportUuid, params or {}], sort_keys=True, default=six.text_type).encode('utf8')).hexdigest()
+
+    @staticmethod
+    def findReport(reportUuid):
+        from uds import reports
+        for i in reports.availableReports:
+            if i.getUuid() == reportUuid:
+                return i
+        return None
+
+    def __setStatus(self, jobId, state, progress, **kwargs):
+        status = {
+            'id': jobId,
+            'state': state,
+            'progress': progress,
+            'stamp': getSqlDatetime(True),
+        }
+        status.update(kwargs)
+        self._storage.putPickle(jobId, status)
+        return status
+
+    def __resultFile(self, jobId, valid=True):
+        """
+        Returns the DBFile with the result of the job, if it exists (and is still valid if valid is True)
+        """
+        qs = DBFile.objects.filter(name=REPORTS_TAG + jobId)
+        if valid:
+            qs = qs.filter(modified__gte=getSqlDatetime() - timedelta(seconds=GlobalConfig.REPORTS_CACHE_VALIDITY.getInt()))
+        return qs.first()
+
+    def status(self, jobId):
+        """
+        Returns the status of a job (dict with id, state, progress, ...) or None if it does not exists
+        """
+        return self._storage.getPickle(jobId)
+
+    def queue(self, reportUuid, params):
+        """
+        Enqueues the generation of a report, returning its job status.
+        If the same report (with same parameters) is already being generated, or has been generated
+        recently, no new generation is requested
+        """
+        jobId = self.jobId(reportUuid, params)
+        status = self.status(jobId)
+
+        if status is not None:
+            if status['state'] == FINISHED and self.__resultFile(jobId) is not None:
+                return status
+            if status['state'] in (QUEUED, RUNNING) and status['stamp'] > getSqlDatetime(True) - MAX_JOB_SILENCE:
+                return status
+
+        status = self.__setStatus(jobId, QUEUED, 0, report=reportUuid)
+        DelayedTaskRunner.runner().insert(ReportGenerator(jobId, reportUuid, params), 0, REPORTS_TAG + jobId)
+        return status
+
+    def generate(self, jobId, reportUuid, params):
+        """
+        Generates the report of a job, storing its result
+        """
+        try:
+            reportCls = self.findReport(reportUuid)
+            if reportCls is None:
+                raise Exception(_('Invalid report!'))
+
+            report = reportCls(params)
+            self.__setStatus(jobId, RUNNING, 0, report=reportUuid)
+            report.setProgressCallback(lambda percent: self.__setStatus(jobId, RUNNING, min(max(int(percent), 0), 99), report=reportUuid))
+
+            data = report.generate()
+            if not isinstance(data, (six.text_type, six.binary_type)):  # Chunked report
+                data = list(data)
+                data = data[0][:0].join(data) if data else b''
+
+            now = getSqlDatetime()
+            dbFile = self.__resultFile(jobId, valid=False) or DBFile(owner=REPORTS_OWNER, name=REPORTS_TAG + jobId, created=now)
+            dbFile.data = data
+            dbFile.modified = now
+            dbFile.save()
+
+            self.__setStatus(jobId, FINISHED, 100, report=reportUuid, mime_type=report.mime_type, filename=report.filename, encoded=report.encoded)
+        except Exception as e:
+            logger.exception('Generating report {}'.format(reportUuid))
+            self.__setStatus(jobId, ERROR, 100, report=reportUuid, error=six.text_type(e))
+
+    def result(self, jobId):
+        """
+        Returns the result of a finished job, as returned by reports REST PUT (mime_type, encoded, filename and data),
+        or None if it is not available
+        """
+        status = self.status(jobId)
+        if status is None or status['state'] != FINISHED:
+            return None
+
+        dbFile = self.__resultFile(jobId)
+        if dbFile is None:
+            return None
+
+        data = dbFile.data
+        if status['encoded']:
+            data = encoders.encode(data, 'base64', asText=True).replace('\n', '')
+        else:
+            data = data.decode('utf8')
+
+        return {
+            'mime_type': status['mime_type'],
+            'encoded': status['encoded'],
+            'filename': status['filename'],
+            'data': data
+        }
+
+    def cleanup(self):
+        """
+        Removes expired results and jobs status
+        """
+        validity = GlobalConfig.REPORTS_CACHE_VALIDITY.getInt()
+        DBFile.objects.filter(owner=REPORTS_OWNER, modified__lt=getSqlDatetime() - timedelta(seconds=validity)).delete()
+
+        limit = getSqlDatetime(True) - max(validity, MAX_JOB_SILENCE)
+        for _key, status, _attr1 in list(self._storage.filterPickle()):
+            if status['stamp'] < limit:
+                self._storage.remove(status['id'])
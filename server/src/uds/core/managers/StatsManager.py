@@ -33,12 +33,22 @@ from __future__ import unicode_literals
 
 from uds.core.util.Config import GlobalConfig
 from uds.models import StatsCounters
+from uds.models import StatsCountersAgg
 from uds.models import getSqlDatetime
 from uds.models import StatsEvents
 from uds.models import optimizeTable
+from django.conf import settings
+from django.db import transaction, connection
+import collections
+import threading
 import datetime
+import atexit
+import errno
+import glob
+import json
 import time
 import six
+import os
 
 import logging
 
@@ -52,11 +62,31 @@ class StatsManager(object):
     Right now, we are going to provide an interface to "counter stats", that is, statistics
     that has counters (such as how many users is at a time active at platform, how many services
     are assigned, are in use, in cache, etc...
+
+    Counters and events are buffered on memory and written in background with bulk inserts, every
+    "flushInterval" seconds or as soon as "batchSize" records are waiting. If database is not available
+    when writing, records are kept on a spool file until next write. Every process has its own spool file (STATS_SPOOL_FILE
+    setting, followed by process id), and spool files of processes not running anymore are taken by running ones.
+    Spooled records that can't be written even with database available are moved to a quarantine file (with ".quarantine" suffix)
     """
     _manager = None
 
+    # Seconds between writes of buffered stats
+    flushInterval = 2
+    # Number of buffered records that triggers a write
+    batchSize = 500
+    # Max number of records waiting to be written. Over this, new records are discarded
+    maxQueued = 50000
+
     def __init__(self):
-        pass
+        self._lock = threading.Lock()
+        self._flushLock = threading.Lock()
+        self._counters = []
+        self._events = []
+        self._thread = None
+        self._wakeUp = threading.Event()
+        self._metrics = collections.defaultdict(lambda: {'written': 0, 'spooled': 0, 'dropped': 0, 'quarantined': 0})
+        self._spoolFile = getattr(settings, 'STATS_SPOOL_FILE', os.path.join(settings.LOGDIR, 'stats.spool'))
 
     @staticmethod
     def manager():
@@ -64,6 +94,187 @@ class StatsManager(object):
             StatsManager._manager = StatsManager()
         return StatsManager._manager
 
+    def __startFlusher(self):
+        # Must be invoked with self._lock acquired
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.__flusher, name='StatsFlusher')
+            self._thread.daemon = True
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def __flusher(self):
+        while True:
+            self._wakeUp.wait(self.flushInterval)
+            self._wakeUp.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Writing stats')
+            finally:
+                try:
+                    connection.close_if_unusable_or_obsolete()
+                except Exception:
+                    pass
+
+    def __queue(self, queue, metric, record):
+        with self._lock:
+            if len(self._counters) + len(self._events) >= self.maxQueued:
+                self._metrics[metric]['dropped'] += 1
+                return False
+            queue.append(record)
+            self.__startFlusher()
+            if len(self._counters) + len(self._events) >= self.batchSize:
+                self._wakeUp.set()
+        return True
+
+    def __spoolName(self, *pids):
+        return '{}.{}'.format(self._spoolFile, '-'.join(str(pid) for pid in pids))
+
+    @staticmethod
+    def __isRunning(pid):
+        try:
+            os.kill(pid, 0)
+        except OSError as e:
+            return e.errno != errno.ESRCH
+        return True
+
+    def __readSpool(self):
+        """
+        Returns the records written to spool files of this process (because database was not available) and removes them.
+        Spool files of processes that are not running anymore are taken (renamed, so only one process takes them) and readed too
+        """
+        pid = os.getpid()
+        names = []
+        for name in glob.glob(self._spoolFile + '.*'):
+            owner = name[len(self._spoolFile) + 1:].split('-')[0]
+            if not owner.isdigit():  # Not an spool file (i.e. quarantine)
+                continue
+            if int(owner) == pid:
+                names.append(name)
+            elif not self.__isRunning(int(owner)):
+                claimed = self.__spoolName(pid, int(time.time() * 1000000))
+                try:
+                    os.rename(name, claimed)
+                    names.append(claimed)
+                except OSError:  # Taken by another process
+                    pass
+
+        counters, events = [], []
+        for name in names:
+            try:
+                with open(name, 'r') as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:  # Incomplete line (i.e. crash while writing it)
+                            continue
+                        (counters if record.pop('kind') == 'c' else events).append(record)
+                os.unlink(name)
+            except Exception:
+                logger.exception('Reading stats spool file {}'.format(name))
+        return counters, events
+
+    def __writeSpool(self, counters, events, quarantine=False):
+        name = self._spoolFile + '.quarantine' if quarantine else self.__spoolName(os.getpid())
+        try:
+            with open(name, 'a') as f:
+                for kind, records in (('c', counters), ('e', events)):
+                    for record in records:
+                        f.write(json.dumps(dict(record, kind=kind)) + '\n')
+        except Exception:
+            logger.exception('Writing stats spool file {}. {} records lost'.format(name, len(counters) + len(events)))
+            return False
+        return True
+
+    def __write(self, counters, events):
+        """
+        Writes counters (and its rollups) and events, in one transaction
+        """
+        with transaction.atomic():
+            StatsCounters.objects.bulk_create([StatsCounters(**{k: v for k, v in six.iteritems(c) if k != 'localStamp'}) for c in counters], batch_size=self.batchSize)
+            # Rollups are kept in sync with counters
+            StatsCountersAgg.accumulate(counters)
+            StatsEvents.objects.bulk_create([StatsEvents(**{k: v for k, v in six.iteritems(e) if k != 'localStamp'}) for e in events], batch_size=self.batchSize)
+
+    def __store(self, counters, events, spooled=False):
+        """
+        Writes records to database, returning the result for them ('written', 'spooled' or 'dropped')
+        Records readed from spool that can't be written with database available are written one by one, and failing ones are quarantined
+        """
+        try:
+            self.__write(counters, events)
+            return {'written': (counters, events)}
+        except Exception:
+            logger.exception('Exception handling stats saving (maybe database is full?)')
+
+        if spooled:
+            try:
+                getSqlDatetime()  # Database available, so some record is invalid
+                available = True
+            except Exception:
+                available = False
+
+            if available:
+                res = {'written': ([], []), 'quarantined': ([], [])}
+                for pos, records in enumerate((counters, events)):
+                    for record in records:
+                        try:
+                            self.__write(*(([record], []) if pos == 0 else ([], [record])))
+                            res['written'][pos].append(record)
+                        except Exception:
+                            logger.error('Stats record can\'t be written, moved to quarantine: {}'.format(record))
+                            res['quarantined'][pos].append(record)
+                if not self.__writeSpool(*res['quarantined'], quarantine=True):
+                    res['dropped'] = res.pop('quarantined')
+                return res
+
+        return {'spooled' if self.__writeSpool(counters, events) else 'dropped': (counters, events)}
+
+    def flush(self):
+        """
+        Writes to database all buffered stats (and stats that could not be written before)
+        If database is not available, they are kept on a spool file, to be written on next flush
+        New and spooled records are written on different transactions, so invalid spooled records do not affect new ones
+        """
+        with self._flushLock:
+            with self._lock:
+                counters, self._counters = self._counters, []
+                events, self._events = self._events, []
+
+            if counters or events:
+                # Records without stamp are stamped with database time (translated from local time)
+                try:
+                    offset = getSqlDatetime(unix=True) - time.time()
+                except Exception:
+                    offset = 0
+                counters = [dict(c, stamp=int(c.pop('localStamp') + offset) if c['stamp'] is None else c['stamp']) for c in counters]
+                events = [dict(e, stamp=int(e.pop('localStamp') + offset) if e['stamp'] is None else e['stamp']) for e in events]
+
+            results = []
+            spooledCounters, spooledEvents = self.__readSpool()
+            if spooledCounters or spooledEvents:
+                results.append(self.__store(spooledCounters, spooledEvents, spooled=True))
+            if counters or events:
+                results.append(self.__store(counters, events))
+
+            with self._lock:
+                for res in results:
+                    for result, (counters, events) in six.iteritems(res):
+                        for c in counters:
+                            self._metrics[('counter', c['counter_type'])][result] += 1
+                        for e in events:
+                            self._metrics[('event', e['event_type'])][result] += 1
+
+    def stats(self):
+        """
+        Returns the number of buffered records, and, per (kind, type), the number of records written, spooled and discarded
+        """
+        with self._lock:
+            return {
+                'queued': len(self._counters) + len(self._events),
+                'types': {k: dict(v) for k, v in six.iteritems(self._metrics)}
+            }
+
     def __doCleanup(self, model):
         minTime = time.mktime((getSqlDatetime() - datetime.timedelta(days=GlobalConfig.STATS_DURATION.getInt())).timetuple())
 
@@ -91,18 +302,14 @@ class StatsManager(object):
 
             Nothing
         """
-        if stamp is None:
-            stamp = getSqlDatetime()
-
-        # To Unix epoch
-        stamp = int(time.mktime(stamp.timetuple()))  # pylint: disable=maybe-no-member
+        if stamp is not None:
+            # To Unix epoch
+            stamp = int(time.mktime(stamp.timetuple()))  # pylint: disable=maybe-no-member
 
-        try:
-            StatsCounters.objects.create(owner_type=owner_type, owner_id=owner_id, counter_type=counterType, value=counterValue, stamp=stamp)
-            return True
-        except Exception:
-            logger.error('Exception handling counter stats saving (maybe database is full?)')
-        return False
+        # Stored on buffer, it will be written to database in background
+        return self.__queue(self._counters, ('counter', counterType), {
+            'owner_type': owner_type, 'owner_id': owner_id, 'counter_type': counterType, 'value': counterValue, 'stamp': stamp, 'localStamp': time.time()
+        })
 
     def getCounters(self, ownerType, counterType, ownerIds, since, to, limit, use_max=False):
         """
@@ -120,6 +327,8 @@ class StatsManager(object):
 
             Iterator, containing (date, counter) each element
         """
+        self.flush()  # Ensure buffered counters are also returned
+
         # To Unix epoch
         since = int(time.mktime(since.timetuple()))
         to = int(time.mktime(to.timetuple()))
@@ -128,9 +337,10 @@ class StatsManager(object):
 
     def cleanupCounters(self):
         """
-        Removes all counters previous to configured max keep time for stat information from database.
+        Removes all counters (and its rollups) previous to configured max keep time for stat information from database.
         """
         self.__doCleanup(StatsCounters)
+        self.__doCleanup(StatsCountersAgg)
 
     def getEventFldFor(self, fld):
         return {
@@ -163,28 +373,24 @@ class StatsManager(object):
         """
         logger.debug('Adding event stat')
         stamp = kwargs.get('stamp')
-        if stamp is None:
-            stamp = getSqlDatetime(unix=True)
-        else:
+        if stamp is not None:
             # To Unix epoch
             stamp = int(time.mktime(stamp.timetuple()))  # pylint: disable=maybe-no-member
 
-        try:
-
-            # Replaces nulls for ''
-            def noneToEmpty(value):
-                return six.text_type(value) if value is not None else ''
+        # Replaces nulls for ''
+        def noneToEmpty(value):
+            return six.text_type(value) if value is not None else ''
 
-            fld1 = noneToEmpty(kwargs.get('fld1', kwargs.get('username', kwargs.get('platform', ''))))
-            fld2 = noneToEmpty(kwargs.get('fld2', kwargs.get('srcip', kwargs.get('browser', ''))))
-            fld3 = noneToEmpty(kwargs.get('fld3', kwargs.get('dstip', kwargs.get('version', ''))))
-            fld4 = noneToEmpty(kwargs.get('fld4', kwargs.get('uniqueid', '')))
+        fld1 = noneToEmpty(kwargs.get('fld1', kwargs.get('username', kwargs.get('platform', ''))))
+        fld2 = noneToEmpty(kwargs.get('fld2', kwargs.get('srcip', kwargs.get('browser', ''))))
+        fld3 = noneToEmpty(kwargs.get('fld3', kwargs.get('dstip', kwargs.get('version', ''))))
+        fld4 = noneToEmpty(kwargs.get('fld4', kwargs.get('uniqueid', '')))
 
-            StatsEvents.objects.create(owner_type=owner_type, owner_id=owner_id, event_type=eventType, stamp=stamp, fld1=fld1, fld2=fld2, fld3=fld3, fld4=fld4)
-            return True
-        except Exception:
-            logger.exception('Exception handling event stats saving (maybe database is full?)')
-        return False
+        # Stored on buffer, it will be written to database in background
+        return self.__queue(self._events, ('event', eventType), {
+            'owner_type': owner_type, 'owner_id': owner_id, 'event_type': eventType, 'stamp': stamp,
+            'fld1': fld1, 'fld2': fld2, 'fld3': fld3, 'fld4': fld4, 'localStamp': time.time()
+        })
 
     def getEvents(self, ownerType, eventType, **kwargs):
         """
@@ -201,6 +407,7 @@ class StatsManager(object):
 
             Iterator, containing (date, counter) each element
         """
+        self.flush()  # Ensure buffered events are also returned
         return StatsEvents.get_stats(ownerType, eventType, **kwargs)
 
     def cleanupEvents(self):
@@ -63,6 +63,8 @@ class DelayedTaskThread(threading.Thread):
 
 class TaskManager(object):
     keepRunning = True
+    # Every this seconds, usage of scheduler & delayed task threads is logged, so they can be properly sized
+    statsInterval = 600
 
     @staticmethod
     def sigTerm(sigNum, frame):
@@ -89,6 +91,14 @@ class TaskManager(object):
         # Simply import this to make workers "auto import"
         from uds.core import workers  # @UnusedImport
 
+    @staticmethod
+    def logStats():
+        """
+        Logs (and resets) usage counters of scheduler pool and delayed tasks runner
+        """
+        for stats in (Scheduler.scheduler().pool().stats(reset=True), DelayedTaskRunner.runner().stats(reset=True)):
+            logger.info('Usage of {}: {}'.format(stats['name'], ', '.join('{}={}'.format(k, v) for k, v in sorted(stats.items()) if k != 'name')))
+
     @staticmethod
     def run():
         TaskManager.keepRunning = True
@@ -105,14 +115,14 @@ class TaskManager(object):
         noSchedulers = GlobalConfig.SCHEDULER_THREADS.getInt()
         noDelayedTasks = GlobalConfig.DELAYED_TASKS_THREADS.getInt()
 
-        logger.info('Starting {0} schedulers and {1} task executors'.format(noSchedulers, noDelayedTasks))
+        logger.info('Starting scheduler with {0} threads and {1} task executors'.format(noSchedulers, noDelayedTasks))
 
         threads = []
-        for _ in range(noSchedulers):
-            thread = SchedulerThread()
-            thread.start()
-            threads.append(thread)
-            time.sleep(0.5)
+        # Just one scheduler thread, that claims jobs and executes them on its own pool of "noSchedulers" threads
+        thread = SchedulerThread()
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.5)
 
         for _ in range(noDelayedTasks):
             thread = DelayedTaskThread()
@@ -128,8 +138,12 @@ class TaskManager(object):
         # Remote.on()
 
         # gc.set_debug(gc.DEBUG_LEAK)
+        nextStats = time.time() + TaskManager.statsInterval
         while TaskManager.keepRunning:
             time.sleep(1)
+            if time.time() > nextStats:
+                nextStats = time.time() + TaskManager.statsInterval
+                TaskManager.logStats()
 
         for thread in threads:
             thread.notifyTermination()
@@ -33,7 +33,7 @@
 from __future__ import unicode_literals
 
 from django.utils.translation import ugettext as _
-from django.db.models import Q
+from django.db.models import Q, Count
 from django.db import transaction
 from uds.core.services.Exceptions import OperationException
 from uds.core.util.State import State
@@ -44,19 +44,84 @@ from uds.models import ServicePool, UserService, getSqlDatetime, Transport
 from uds.core import services
 from uds.core.services import Service
 from uds.core.util.stats import events
+from uds.core.util.model import generateUuid
+
+from uds.core.jobs.ExecutionPool import ExecutionPool
 
 from .userservice.opchecker  import UserServiceOpChecker
 
+import threading
 import requests
+import random
 import json
+import time
 import logging
 
-__updated__ = '2018-09-24'
+__updated__ = '2018-10-18'
 
 logger = logging.getLogger(__name__)
 traceLogger = logging.getLogger('traceLog')
 
 
+class _CacheHints(object):
+    """
+    Per process, per service pool, list of ids of cache elements that are probably available for assignation
+    Every list is read from database in one query, and kept for a few seconds, so most logins do not need to look for candidates.
+    As they are just hints, elements are always checked when claimed.
+    """
+    # Number of candidates read at once
+    batchSize = 16
+    # Seconds that a list of candidates is valid
+    validity = 5
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hints = {}  # (pool id, kind) -> (expiration, list of ids)
+
+    def get(self, ds, kind, filters, tried=()):
+        """
+        Returns a candidate (not in "tried"), or None if database has no candidates at all
+        """
+        key = (ds.id, kind)
+        with self._lock:
+            expiration, ids = self._hints.get(key, (0, None))
+            if expiration > time.time():
+                while ids:
+                    candidate = ids.pop()
+                    if candidate not in tried:
+                        return candidate
+
+        # Candidates are read from a random position, and its order is randomized, so concurrent logins
+        # (even on other processes) try different elements
+        candidates = ds.cachedUserServices().filter(**filters).exclude(id__in=tried).order_by('id').values_list('id', flat=True)
+        total = candidates.count()
+        if total == 0:
+            return None
+        offset = random.randint(0, max(total - self.batchSize, 0))
+        ids = list(candidates[offset:offset + self.batchSize])
+        if not ids and offset > 0:  # Elements taken meanwhile
+            ids = list(candidates[:self.batchSize])
+        if not ids:
+            return None
+        random.shuffle(ids)
+        candidate = ids.pop()
+        with self._lock:
+            self._hints[key] = (time.time() + self.validity, ids)
+        return candidate
+
+    def drop(self, ds, kind):
+        """
+        Discards the candidates of a pool (because they are outdated)
+        """
+        with self._lock:
+            self._hints.pop((ds.id, kind), None)
+
+
+_cacheHints = _CacheHints()
+# Stats events are added in background, so they do not delay logins
+_statsPool = ExecutionPool('CacheStats', 1, queueSize=1024)
+
+
 class UserServiceManager(object):
     _manager = None
 
@@ -82,7 +147,7 @@ class UserServiceManager(object):
         Checks if maxDeployed for the service has been reached, and, if so,
         raises an exception that no more services of this kind can be reached
         """
-        serviceInstance = deployedService.service.getInstance()
+        serviceInstance = deployedService.service.getInstance(shared=True)
         # Early return, so no database count is needed
         if serviceInstance.maxDeployed == Service.UNLIMITED:
             return
@@ -138,6 +203,56 @@ class UserServiceManager(object):
         UserServiceOpChecker.checkAndUpdateState(cache, ci, state)
         return cache
 
+    def __createCacheManyAtDb(self, deployedServicePublication, cacheLevel, count):
+        """
+        Private method to instatiate up to "count" cache elements at database with default states, with just one insert.
+        The number of elements is limited by maxDeployed of the service
+        """
+        deployedService = deployedServicePublication.deployed_service
+        serviceInstance = deployedService.service.getInstance(shared=True)
+        if serviceInstance.maxDeployed != Service.UNLIMITED:
+            count = min(count, serviceInstance.maxDeployed - deployedService.userServices.filter(state__in=[State.PREPARING, State.USABLE]).count())
+            if count <= 0:
+                raise MaxServicesReachedError('Max number of allowed deployments for service reached')
+
+        now = getSqlDatetime()
+        # Uuids are set here, because bulk_create do not invokes save, and they are used to locate created elements
+        uuids = [generateUuid() for _ in range(count)]
+        UserService.objects.bulk_create([
+            UserService(uuid=uuid, cache_level=cacheLevel, state=State.PREPARING, os_state=State.PREPARING,
+                        state_date=now, creation_date=now, data='', deployed_service=deployedService,
+                        publication=deployedServicePublication, user=None, in_use=False) for uuid in uuids
+        ])
+        return list(UserService.objects.filter(uuid__in=uuids))
+
+    def createCacheForMany(self, deployedServicePublication, cacheLevel, count):
+        """
+        Creates up to "count" new cache elements for the deployed service publication at level indicated.
+        The number created is limited by the max preparing services of the provider and by the max deployed of the service.
+        Returns the list of created elements
+        """
+        ds = deployedServicePublication.deployed_service
+        serviceInstance = ds.service.getInstance(shared=True)
+        if serviceInstance.parent().getIgnoreLimits() is False:
+            count = min(count, serviceInstance.parent().getMaxPreparingServices() - self.getServicesInStateForProvider(ds.service.provider_id, State.PREPARING))
+        if count <= 0:
+            return []
+
+        logger.debug('Creating {0} new cache elements at level {1} for publication {2}'.format(count, cacheLevel, deployedServicePublication))
+        caches = self.__createCacheManyAtDb(deployedServicePublication, cacheLevel, count)
+        instances = [cache.getInstance() for cache in caches]
+        try:
+            states = ds.service.getType().deployedType.deployForCacheMany(instances, cacheLevel)
+        except Exception as e:  # Only overrides failing before starting anything should raise, so all elements are marked as errored
+            logger.exception('Deploying for cache')
+            for cache in caches:
+                log.doLog(cache, log.ERROR, 'Exception: {0}'.format(e), log.INTERNAL)
+            states = [State.ERROR] * len(caches)
+
+        for cache, ci, state in zip(caches, instances, states):
+            UserServiceOpChecker.checkAndUpdateState(cache, ci, state)
+        return caches
+
     def createAssignedFor(self, ds, user):
         """
         Creates a new assigned deployed service for the publication and user indicated
@@ -258,9 +373,49 @@ class UserServiceManager(object):
             #    return existing[0]
         return None
 
+    def __claimCache(self, ds, user, kind, **filters):
+        """
+        Assigns to user an L1 cache element of the pool that matches filters, and returns it (or None if none is available)
+
+        There is no lock involved. Candidates are taken from the hints of the pool, and every candidate is claimed with
+        an update that only succeeds if it's still an L1 cache element, so only one concurrent login gets each element.
+        If a claim fails, hints are outdated, so they are discarded and read again (without the elements already tried).
+        None is returned only when database has no more candidates.
+        """
+        filters['cache_level'] = services.UserDeployment.L1_CACHE
+        tried = set()
+        while True:
+            candidate = _cacheHints.get(ds, kind, filters, tried)
+            if candidate is None:
+                return None
+            if UserService.objects.filter(id=candidate, **filters).update(cache_level=0, user=user, state_date=getSqlDatetime()) == 1:
+                return UserService.objects.get(id=candidate)
+            tried.add(candidate)
+            _cacheHints.drop(ds, kind)
+
+    def __assignInstance(self, cache, user):
+        """
+        Notifies the user deployment of an already claimed cache element its assignation
+        """
+        ci = cache.getInstance()  # User Deployment instance
+        ci.assignToUser(user)
+        cache.updateData(ci)
+        cache.save(update_fields=['data'])
+
+    @staticmethod
+    def __addCacheEvent(ds, eventType, state):
+        """
+        Adds the cache hit/miss event, with the number of elements remaining on cache, out of the login path
+        """
+        def addEvent():
+            events.addEvent(ds, eventType, fld1=ds.cachedUserServices().filter(cache_level=services.UserDeployment.L1_CACHE, state=state).count())
+
+        if not _statsPool.submit('stats', 0, addEvent):
+            logger.debug('Stats queue is full, cache event discarded')
+
     def getAssignationForUser(self, ds, user):
 
-        if ds.service.getInstance().spawnsNew is False:
+        if ds.service.getInstance(shared=True).spawnsNew is False:
             assignedUserService = self.getExistingAssignationForUser(ds, user)
         else:
             assignedUserService = None
@@ -270,47 +425,25 @@ class UserServiceManager(object):
             return assignedUserService
 
         # Now try to locate 1 from cache already "ready" (must be usable and at level 1)
-        with transaction.atomic():
-            cache = ds.cachedUserServices().select_for_update().filter(cache_level=services.UserDeployment.L1_CACHE, state=State.USABLE, os_state=State.USABLE)[:1]
-            if len(cache) == 0:
-                cache = ds.cachedUserServices().select_for_update().filter(cache_level=services.UserDeployment.L1_CACHE, state=State.USABLE)[:1]
-            if len(cache) > 0:
-                cache = cache[0]
-                cache.assignToUser(user)
-                cache.save()  # Store assigned ASAP, we do not know how long assignToUser method of instance will take
-            else:
-                cache = None
+        cache = self.__claimCache(ds, user, 'ready', state=State.USABLE, os_state=State.USABLE)
+        if cache is None:
+            cache = self.__claimCache(ds, user, 'usable', state=State.USABLE)
 
-        # Out of atomic transaction
         if cache is not None:
             logger.debug('Found a cached-ready service from {0} for user {1}, item {2}'.format(ds, user, cache))
-            events.addEvent(ds, events.ET_CACHE_HIT, fld1=ds.cachedUserServices().filter(cache_level=services.UserDeployment.L1_CACHE, state=State.USABLE).count())
-            ci = cache.getInstance()  # User Deployment instance
-            ci.assignToUser(user)
-            cache.updateData(ci)
-            cache.save()
+            self.__addCacheEvent(ds, events.ET_CACHE_HIT, State.USABLE)
+            self.__assignInstance(cache, user)
             return cache
 
         # Cache missed
 
         # Now find if there is a preparing one
-        with transaction.atomic():
-            cache = ds.cachedUserServices().select_for_update().filter(cache_level=services.UserDeployment.L1_CACHE, state=State.PREPARING)[:1]
-            if len(cache) > 0:
-                cache = cache[0]
-                cache.assignToUser(user)
-                cache.save()
-            else:
-                cache = None
+        cache = self.__claimCache(ds, user, 'preparing', state=State.PREPARING)
 
-        # Out of atomic transaction
         if cache is not None:
             logger.debug('Found a cached-preparing service from {0} for user {1}, item {2}'.format(ds, user, cache))
-            events.addEvent(ds, events.ET_CACHE_MISS, fld1=ds.cachedUserServices().filter(cache_level=services.UserDeployment.L1_CACHE, state=State.PREPARING).count())
-            ci = cache.getInstance()  # User Deployment instance
-            ci.assignToUser(user)
-            cache.updateData(ci)
-            cache.save()
+            self.__addCacheEvent(ds, events.ET_CACHE_MISS, State.PREPARING)
+            self.__assignInstance(cache, user)
             return cache
 
         # Can't assign directly from L2 cache... so we check if we can create e new service in the limits requested
@@ -323,7 +456,7 @@ class UserServiceManager(object):
                 log.doLog(ds, log.WARN, 'Max number of services reached: {}'.format(ds.max_srvs), log.INTERNAL)
                 raise MaxServicesReachedError()
         # Can create new service, create it
-        events.addEvent(ds, events.ET_CACHE_MISS, fld1=0)
+        _statsPool.submit('stats', 0, events.addEvent, ds, events.ET_CACHE_MISS, fld1=0)
         return self.createAssignedFor(ds, user)
 
     def getServicesInStateForProvider(self, provider_id, state):
@@ -332,23 +465,33 @@ class UserServiceManager(object):
         """
         return UserService.objects.filter(deployed_service__service__provider__id=provider_id, state=state).count()
 
+    def getServicesInStateByProvider(self, state):
+        """
+        Returns a dictionary provider id --> number of services of that provider in the state indicated
+        """
+        return dict(
+            UserService.objects.filter(state=state).values_list('deployed_service__service__provider_id').annotate(count=Count('id')).order_by()
+        )
+
     def canRemoveServiceFromDeployedService(self, ds):
         """
         checks if we can do a "remove" from a deployed service
         serviceIsntance is just a helper, so if we already have unserialized deployedService
         """
         removing = self.getServicesInStateForProvider(ds.service.provider_id, State.REMOVING)
-        serviceInstance = ds.service.getInstance()
+        serviceInstance = ds.service.getInstance(shared=True)
         if removing >= serviceInstance.parent().getMaxRemovingServices() and serviceInstance.parent().getIgnoreLimits() is False:
             return False
         return True
 
-    def canInitiateServiceFromDeployedService(self, ds):
+    def canInitiateServiceFromDeployedService(self, ds, preparing=None):
         """
         Checks if we can start a new service
+        :param preparing: If known, number of services of the provider in preparation
         """
-        preparing = self.getServicesInStateForProvider(ds.service.provider_id, State.PREPARING)
-        serviceInstance = ds.service.getInstance()
+        if preparing is None:
+            preparing = self.getServicesInStateForProvider(ds.service.provider_id, State.PREPARING)
+        serviceInstance = ds.service.getInstance(shared=True)
         if preparing >= serviceInstance.parent().getMaxPreparingServices() and serviceInstance.parent().getIgnoreLimits() is False:
             return False
         return True
@@ -510,7 +653,7 @@ class UserServiceManager(object):
         """
         osm = uService.deployed_service.osmanager
         # If os manager says "machine is persistent", do not tray to delete "previous version" assigned machines
-        doPublicationCleanup = True if osm is None else not osm.getInstance().isPersistent()
+        doPublicationCleanup = True if osm is None else not osm.getInstance(shared=True).isPersistent()
 
         if doPublicationCleanup:
             remove = False
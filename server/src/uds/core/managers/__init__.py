@@ -34,7 +34,7 @@ UDS managers (downloads, users preferences, publications, ...)
 """
 from __future__ import unicode_literals
 
-__updated__ = '2018-08-30'
+__updated__ = '2018-10-18'
 
 
 def cryptoManager():
@@ -65,6 +65,12 @@ def statsManager():
     return StatsManager.manager()
 
 
+def reportsManager():
+    ':rtype uds.core.managers.ReportsManager.ReportsManager'
+    from .ReportsManager import ReportsManager
+    return ReportsManager.manager()
+
+
 def userServiceManager():
     from .UserServiceManager import UserServiceManager
     return UserServiceManager.manager()
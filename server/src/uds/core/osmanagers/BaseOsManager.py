@@ -229,7 +229,7 @@ class OSManager(Module):
             counter -= 1
         userService.setProperty('loginsCounter', six.text_type(counter))
 
-        if GlobalConfig.EXCLUSIVE_LOGOUT.getBool(True) is True:
+        if GlobalConfig.EXCLUSIVE_LOGOUT.getBool() is True:
             if counter > 0:
                 return
 
@@ -43,11 +43,12 @@ from weasyprint import HTML, CSS, default_url_fetcher
 from datetime import datetime
 
 import logging
+import csv
 import six
 
 logger = logging.getLogger(__name__)
 
-__updated__ = '2018-02-08'
+__updated__ = '2018-10-18'
 
 
 class Report(UserInterface):
@@ -59,6 +60,10 @@ class Report(UserInterface):
     encoded = True  # If the report is mean to be encoded (binary reports as PDFs == True, text reports must be False so utf-8 is correctly threated
     uuid = None
 
+    csvChunkSize = 65536  # Approximate size of chunks returned by asCSV
+
+    _progressCallback = None
+
     @classmethod
     def translated_name(cls):
         """
@@ -137,6 +142,23 @@ class Report(UserInterface):
 
         return Report.asPDF(t.render(dct), header=header, water=water, images=images)
 
+    @staticmethod
+    def asCSV(rows):
+        """
+        Generator that returns rows (iterables of values) as csv text, in chunks,
+        as rows are consumed. So reports can be sent without keeping them on memory
+        """
+        output = six.StringIO()
+        writer = csv.writer(output)
+        for row in rows:
+            writer.writerow(row)
+            if output.tell() >= Report.csvChunkSize:
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate()
+        if output.tell():
+            yield output.getvalue()
+
     def __init__(self, values=None):
         """
         Do not forget to invoke this in your derived class using
@@ -170,22 +192,58 @@ class Report(UserInterface):
         """
         Generates the reports
 
-        An string representing the report is to be expected to be returned
+        An string representing the report is to be expected to be returned.
+        An iterable (i.e. a generator) of strings can also be returned, so big reports can be
+        sent to client as they are generated (look at asCSV)
 
         this MUST be overriden
         """
         raise NotImplementedError()
 
+    def generateChunks(self):
+        """
+        Returns the report as an iterable of chunks, whatever generate returns
+        """
+        data = self.generate()
+        if isinstance(data, (six.text_type, six.binary_type)):
+            return (data,)
+        return data
+
     def generateEncoded(self):
         """
         Generated base 64 encoded report.
         Basically calls generate and encodes resuslt as base64
         """
-        data = self.generate()
+        return self.encode(self.generate())
+
+    def encode(self, data):
+        """
+        Joins a chunked report (if needed) and, if report must be encoded, encodes it as base64
+        """
+        if not isinstance(data, (six.text_type, six.binary_type)):  # Chunked report, join it
+            data = list(data)
+            data = data[0][:0].join(data) if data else ''
+
         if self.encoded:
             data = encoders.encode(data, 'base64', asText=True).replace('\n', '')
 
         return data
 
+    def setProgressCallback(self, callback):
+        """
+        Sets the callable that will receive the progress (0-100) of report generation (used by background generation)
+        """
+        self._progressCallback = callback
+
+    def progress(self, percent):
+        """
+        Reports can invoke this to notify how much of the report has been generated, as an integer 0-100
+        """
+        if self._progressCallback is not None:
+            try:
+                self._progressCallback(percent)
+            except Exception:
+                logger.exception('Notifying report progress')
+
     def __str__(self):
         return 'Report {} with uuid {}'.format(self.name, self.uuid)
@@ -36,7 +36,11 @@ from uds.core import Environmentable
 from uds.core import Serializable
 from uds.core.util.State import State
 
-__updated__ = '2018-06-11'
+import logging
+
+__updated__ = '2018-10-18'
+
+logger = logging.getLogger(__name__)
 
 
 class UserDeployment(Environmentable, Serializable):
@@ -374,6 +378,34 @@ class UserDeployment(Environmentable, Serializable):
         """
         raise Exception('Base deploy for cache invoked! for class {0}'.format(self.__class__.__name__))
 
+    @classmethod
+    def deployForCacheMany(cls, userDeployments, cacheLevel):
+        """
+        Deploys several user deployments (all of them of this class, and of the same service) as cache at once.
+
+        This is a task method, that returns a list with the state (RUNNING, FINISHED or ERROR) of each
+        user deployment, in the same order they are received.
+
+        Default implementation simply invokes :py:meth:.deployForCache for each one. Services that can
+        create several machines with a single request (bulk clones) can override it to do so.
+
+        :note: As with :py:meth:.deployForCache, this method must handle all exceptions. An exception raised
+               from here marks all the user deployments as errored, so overrides must only let one escape if
+               nothing has been started yet
+        """
+        from uds.core.util import log
+
+        states = []
+        for userDeployment in userDeployments:
+            # An exception only affects the user deployment that raised it, the others are already started
+            try:
+                states.append(userDeployment.deployForCache(cacheLevel))
+            except Exception as e:
+                logger.exception('Deploying {} for cache'.format(userDeployment))
+                userDeployment.doLog(log.ERROR, 'Exception: {0}'.format(e))
+                states.append(State.ERROR)
+        return states
+
     def deployForUser(self, user):
         """
         Deploys an service instance for an user.
@@ -175,7 +175,7 @@ class ServiceProvider(Module):
     def getMaxPreparingServices(self):
         val = self.maxPreparingServices
         if val is None:
-            val = self.maxPreparingServices = GlobalConfig.MAX_PREPARING_SERVICES.getInt(force=True)  # Recover global an cache till restart
+            val = self.maxPreparingServices = GlobalConfig.MAX_PREPARING_SERVICES.getInt()  # Recover global an cache till restart
 
         retVal = int(getattr(val, 'value', val))
         return retVal if retVal > 0 else 1
@@ -183,7 +183,7 @@ class ServiceProvider(Module):
     def getMaxRemovingServices(self):
         val = self.maxRemovingServices
         if val is None:
-            val = self.maxRemovingServices = GlobalConfig.MAX_REMOVING_SERVICES.getInt(force=True)  # Recover global an cache till restart
+            val = self.maxRemovingServices = GlobalConfig.MAX_REMOVING_SERVICES.getInt()  # Recover global an cache till restart
 
         retVal = int(getattr(val, 'value', val))
         return retVal if retVal > 0 else 1
@@ -191,7 +191,7 @@ class ServiceProvider(Module):
     def getIgnoreLimits(self):
         val = self.ignoreLimits
         if val is None:
-            val = self.ignoreLimits = GlobalConfig.IGNORE_LIMITS.getBool(force=True)  # Recover global an cache till restart
+            val = self.ignoreLimits = GlobalConfig.IGNORE_LIMITS.getBool()  # Recover global an cache till restart
 
         val = getattr(val, 'value', val)
         return val is True or val == gui.TRUE
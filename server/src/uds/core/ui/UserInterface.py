@@ -32,6 +32,7 @@
 """
 from django.utils.translation import get_language, ugettext as _, ugettext_noop
 from uds.core.util import encoders
+from uds.core.util import serializer
 import datetime
 import time
 import six
@@ -887,10 +888,8 @@ class UserInterface(object, metaclass=UserInterfaceType):
     def serializeForm(self):
         """
         All values stored at form fields are serialized and returned as a single
-        string
-        Separating char is
-
-        The returned string is zipped and then converted to base 64
+        string, using uds.core.util.serializer (forms stored by previous versions, zipped & pickled,
+        are still readed, and stored on new format when serialized again)
 
         Note: Hidens are not serialized, they are ignored
 
@@ -899,7 +898,7 @@ class UserInterface(object, metaclass=UserInterfaceType):
         # import inspect
         # logger.debug('Caller is : {}'.format(inspect.stack()))
 
-        arr = []
+        values = {}
         for k, v in six.iteritems(self._gui):
             logger.debug('serializing Key: {0}/{1}'.format(k, v.value))
             if v.isType(gui.InputField.HIDDEN_TYPE) and v.isSerializable() is False:
@@ -908,10 +907,7 @@ class UserInterface(object, metaclass=UserInterfaceType):
             if v.isType(gui.InputField.INFO_TYPE):
                 # logger.debug('Field {} is a dummy field and will not be serialized')
                 continue
-            if v.isType(gui.InputField.EDITABLE_LIST) or v.isType(gui.InputField.MULTI_CHOICE_TYPE):
-                # logger.debug('Serializing value {0}'.format(v.value))
-                val = b'\001' + pickle.dumps(v.value, protocol=0)
-            elif v.isType(gui.InputField.NUMERIC_TYPE):
+            if v.isType(gui.InputField.NUMERIC_TYPE):
                 val = six.text_type(int(v.num()))
             else:
                 val = v.value
@@ -919,9 +915,9 @@ class UserInterface(object, metaclass=UserInterfaceType):
                 val = gui.TRUE
             elif val is False:
                 val = gui.FALSE
-            arr.append(k.encode('utf8') + b'\003' + val)
-        logger.debug('Arr, >>%s<<', arr)
-        return encoders.encode(b'\002'.join(arr), 'zip')
+            values[k] = val
+        logger.debug('Values, >>%s<<', values)
+        return serializer.dumps(values)
 
     def unserializeForm(self, values):
         """
@@ -940,6 +936,13 @@ class UserInterface(object, metaclass=UserInterfaceType):
                     continue
                 self._gui[k].value = self._gui[k].defValue
 
+            if serializer.isSerialized(values):
+                for k, v in six.iteritems(serializer.loads(values)):
+                    if k in self._gui:
+                        self._gui[k].value = v
+                return
+
+            # Stored by previous versions
             values = encoders.decode(values, 'zip')
             if values == b'':  # Has nothing
                 return
@@ -36,7 +36,7 @@ from uds.core.util.Config import GlobalConfig
 
 
 def template(template_name):
-    theme_path = GlobalConfig.UDS_THEME.get(True)
+    theme_path = GlobalConfig.UDS_THEME.get()
     if theme_path == 'default':
         theme_path = ''
     else:
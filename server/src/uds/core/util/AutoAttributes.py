@@ -35,6 +35,7 @@ from __future__ import unicode_literals
 
 from uds.core.Serializable import Serializable
 from uds.core.util import encoders
+from uds.core.util import serializer
 import pickle
 import six
 import logging
@@ -97,11 +98,22 @@ class AutoAttributes(Serializable):
         self.dict = d
 
     def marshal(self):
-        return encoders.encode(b'\2'.join([b'%s\1%s' % (k.encode('utf8') if isinstance(k, str) else k, pickle.dumps(v)) for k, v in self.dict.items()]), 'bz2')
+        try:
+            return serializer.dumps({k: v.getValue() for k, v in six.iteritems(self.dict)})
+        except TypeError:  # Not basic types, stored pickled
+            return encoders.encode(b'\2'.join([b'%s\1%s' % (k.encode('utf8') if isinstance(k, str) else k, pickle.dumps(v)) for k, v in self.dict.items()]), 'bz2')
 
     def unmarshal(self, data):
         if data == b'':  # Can be empty
             return
+
+        if serializer.isSerialized(data):
+            for k, v in six.iteritems(serializer.loads(data)):
+                if k in self.dict:
+                    self.dict[k].setValue(v)  # Converted to declared type
+            return
+
+        # Stored by previous versions, rewritten on new format on next save
         # We keep original data (maybe incomplete)
         try:
             data = encoders.decode(data, 'bz2')
@@ -111,7 +123,7 @@ class AutoAttributes(Serializable):
         for pair in data.split(b'\2'):
             k, v = pair.split(b'\1')
             # logger.debug('k: %s  ---   v: %s', k, v)
-            self.dict[k] = pickle.loads(v)
+            self.dict[k.decode('utf8')] = pickle.loads(v)
 
     def __str__(self):
         str_ = '<AutoAttribute '
@@ -31,63 +31,305 @@
 @author: Adolfo Gómez, dkmaster at dkmon dot com
 """
 from __future__ import unicode_literals
-from django.db import transaction
+from django.conf import settings
+from django.db import transaction, IntegrityError
 import uds.models.Cache
 from uds.models.Util import getSqlDatetime
 from uds.core.util import encoders
-from datetime import datetime, timedelta
+from datetime import timedelta
+import collections
+import threading
 import six
 import hashlib
 import logging
 import pickle
+import time
 
 logger = logging.getLogger(__name__)
 
+# Values of this types are stored "as is" on local cache, any other is kept pickled so
+# callers can't modify the cached copy
+_IMMUTABLE_TYPES = six.string_types + (six.binary_type, bool, float, type(None)) + six.integer_types
+
+
+class LocalCache(object):
+    """
+    In process LRU cache, with expiration time, used as first tier of Cache.
+    As other processes (or nodes) can't invalidate it, items are kept for a short time only.
+    """
+
+    def __init__(self, maxEntries, maxValidity):
+        self._maxEntries = maxEntries
+        self._maxValidity = maxValidity
+        self._lock = threading.Lock()
+        self._data = collections.OrderedDict()  # key -> (owner, expiration, pickled, value)
+
+    def get(self, key):
+        """
+        Returns a tuple (found, value)
+        """
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None:
+                return False, None
+            if item[1] < time.time():
+                return False, None
+            self._data[key] = item  # Reinserted as most recently used
+
+        if item[2]:
+            return True, pickle.loads(item[3])
+        return True, item[3]
+
+    def put(self, key, owner, value, validity):
+        if self._maxEntries <= 0:
+            return
+        if isinstance(value, _IMMUTABLE_TYPES):
+            item = (owner, time.time() + min(validity, self._maxValidity), False, value)
+        else:
+            item = (owner, time.time() + min(validity, self._maxValidity), True, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = item
+            while len(self._data) > self._maxEntries:
+                self._data.popitem(last=False)
+
+    def remove(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def removeOwner(self, owner):
+        with self._lock:
+            for key in [k for k, v in six.iteritems(self._data) if v[0] == owner]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class DBCacheBackend(object):
+    """
+    Shared cache tier stored on uds.models.Cache table
+    """
+
+    def getMany(self, owner, keys):
+        """
+        Returns a dictionary key -> (value, remaining validity in seconds) with the valid values found for keys
+        """
+        res = {}
+        items = list(uds.models.Cache.objects.filter(pk__in=keys))  # @UndefinedVariable
+        if not items:
+            return res
+        now = getSqlDatetime()
+        for c in items:
+            remaining = (c.created + timedelta(seconds=c.validity) - now).total_seconds()
+            if remaining < 0:
+                continue
+            try:
+                res[c.key] = (pickle.loads(encoders.decode(c.value, 'base64')), remaining)
+            except Exception:  # If invalid, simple do no tuse it
+                logger.exception('Invalid pickle from cache')
+                c.delete()
+        return res
+
+    def putMany(self, owner, items, validity):
+        now = getSqlDatetime()
+        for key, value in six.iteritems(items):
+            value = encoders.encode(pickle.dumps(value), 'base64', asText=True)
+            try:
+                # Update first, most times key already exists (refreshing values), and if not, no row is locked
+                if uds.models.Cache.objects.filter(pk=key).update(owner=owner, value=value, created=now, validity=validity) == 0:  # @UndefinedVariable
+                    try:
+                        with transaction.atomic():
+                            uds.models.Cache.objects.create(owner=owner, key=key, value=value, created=now, validity=validity)  # @UndefinedVariable
+                    except IntegrityError:  # Created by someone else meanwhile
+                        uds.models.Cache.objects.filter(pk=key).update(owner=owner, value=value, created=now, validity=validity)  # @UndefinedVariable
+            except transaction.TransactionManagementError:
+                logger.debug('Transaction in course, cannot store value')
+
+    def remove(self, owner, key):
+        return uds.models.Cache.objects.filter(pk=key).delete()[0] > 0  # @UndefinedVariable
+
+    def refresh(self, owner, key):
+        return uds.models.Cache.objects.filter(pk=key).update(created=getSqlDatetime()) > 0  # @UndefinedVariable
+
+    def deleteOwner(self, owner):
+        if owner is None:
+            uds.models.Cache.objects.all().delete()  # @UndefinedVariable
+        else:
+            uds.models.Cache.objects.filter(owner=owner).delete()  # @UndefinedVariable
+
+    def purge(self):
+        self.deleteOwner(None)
+
+    def cleanUp(self):
+        uds.models.Cache.cleanUp()  # @UndefinedVariable
+
+
+class DjangoCacheBackend(object):
+    """
+    Shared cache tier stored on a django cache (i.e. the "memory" memcached cache)
+    As django caches can't remove by owner, every key is stored along with a "generation" of its owner,
+    and removing all keys of an owner simply increments its generation
+    """
+
+    def __init__(self, cacheName):
+        from django.core.cache import caches
+        self._cache = caches[cacheName]
+
+    @staticmethod
+    def __genKey(owner):
+        return 'udsgen' + hashlib.md5(owner.encode('utf8')).hexdigest()
+
+    def __generation(self, owner):
+        return self._cache.get(self.__genKey(owner), 0)
+
+    def getMany(self, owner, keys):
+        genKey = self.__genKey(owner)
+        values = self._cache.get_many([genKey] + ['uds' + k for k in keys])
+        generation = values.pop(genKey, 0)
+        now = time.time()
+        return {k[3:]: (v[2], v[1] - now) for k, v in six.iteritems(values) if v[0] == generation}
+
+    def putMany(self, owner, items, validity):
+        generation = self.__generation(owner)
+        expiration = time.time() + validity
+        self._cache.set_many({'uds' + k: (generation, expiration, v) for k, v in six.iteritems(items)}, validity)
+
+    def remove(self, owner, key):
+        found = self._cache.get('uds' + key) is not None
+        self._cache.delete('uds' + key)
+        return found
+
+    def refresh(self, owner, key):
+        # Django caches have no "touch" on all backends, and validity is not known here, so value is kept as is
+        return self._cache.get('uds' + key) is not None
+
+    def deleteOwner(self, owner):
+        if owner is None:
+            self.purge()
+            return
+        try:
+            self._cache.incr(self.__genKey(owner))
+        except ValueError:  # Key not found
+            self._cache.set(self.__genKey(owner), 1, None)
+
+    def purge(self):
+        self._cache.clear()
+
+    def cleanUp(self):
+        pass  # Django cache expires its own items
+
 
 class Cache(object):
-    # Simple hits vs missses counters
-    hits = 0
-    misses = 0
+    """
+    Volatile storage of values for an "owner".
 
+    Values are looked up first on an in-process LRU cache (items kept there at most UDS_LOCAL_CACHE_VALIDITY seconds),
+    and then on the shared cache, that is the database table by default, or the django cache named on UDS_SHARED_CACHE setting.
+    """
     DEFAULT_VALIDITY = 60
 
+    _local = LocalCache(getattr(settings, 'UDS_LOCAL_CACHE_ENTRIES', 4096), getattr(settings, 'UDS_LOCAL_CACHE_VALIDITY', 5))
+    _shared = None
+
+    # Hits & misses counters, per owner. Only most recently used owners are kept (there are owners per object),
+    # counters of the rest are added to OTHERS_COUNTERS, so totals are always right
+    OTHERS_COUNTERS = '*others*'
+    _countersLock = threading.Lock()
+    _counters = collections.OrderedDict()
+    _maxCounters = max(getattr(settings, 'UDS_CACHE_COUNTERS_OWNERS', 256), 1)
+
     def __init__(self, owner):
-        self._owner = owner.encode('utf-8') if isinstance(owner, six.text_type) else owner
+        self._owner = owner.decode('utf8') if isinstance(owner, six.binary_type) else owner
+        self._bOwner = self._owner.encode('utf8')
+
+    @staticmethod
+    def backend():
+        """
+        Returns the shared cache tier
+        """
+        if Cache._shared is None:
+            cacheName = getattr(settings, 'UDS_SHARED_CACHE', None)
+            if cacheName is not None:
+                try:
+                    Cache._shared = DjangoCacheBackend(cacheName)
+                except Exception:
+                    logger.error('Cache {} not available, using database for uds cache'.format(cacheName))
+            if Cache._shared is None:
+                Cache._shared = DBCacheBackend()
+        return Cache._shared
+
+    @staticmethod
+    def counters(owner=None):
+        """
+        Returns hits (local & shared) and misses counters for an owner, or for all owners if owner is None
+        """
+        with Cache._countersLock:
+            if owner is not None:
+                return dict(Cache._counters.get(owner, {'hits': 0, 'localHits': 0, 'misses': 0}))
+            return {k: dict(v) for k, v in six.iteritems(Cache._counters)}
+
+    def __count(self, counter, number=1):
+        with Cache._countersLock:
+            counters = Cache._counters.pop(self._owner, None)
+            if counters is None:
+                counters = {'hits': 0, 'localHits': 0, 'misses': 0}
+            counters[counter] += number
+            Cache._counters[self._owner] = counters
+            while len(Cache._counters) > Cache._maxCounters:
+                owner, counters = Cache._counters.popitem(last=False)
+                others = Cache._counters.setdefault(Cache.OTHERS_COUNTERS, {'hits': 0, 'localHits': 0, 'misses': 0})
+                for k, v in six.iteritems(counters):
+                    others[k] += v
 
     def __getKey(self, key):
         h = hashlib.md5()
         if isinstance(key, six.text_type):
             key = key.encode('utf8')
-        h.update(self._owner + key)
+        h.update(self._bOwner + key)
         return h.hexdigest()
 
     def get(self, skey, defValue=None):
-        now = getSqlDatetime()
         logger.debug('Requesting key "{}" for cache "{}"'.format(skey, self._owner))
-        try:
+        return self.getMany([skey], defValue)[skey]
+
+    def getMany(self, skeys, defValue=None):
+        """
+        Returns a dictionary skey -> value for all requested keys, with defValue for the ones not found (or expired)
+        Keys not found on local cache are requested from shared cache at once
+        """
+        res = {}
+        missing = {}
+        for skey in skeys:
             key = self.__getKey(skey)
-            logger.debug('Key: {}'.format(key))
-            c = uds.models.Cache.objects.get(pk=key)  # @UndefinedVariable
-            expired = now > c.created + timedelta(seconds=c.validity)
-            if expired:
-                return defValue
+            found, val = Cache._local.get(key)
+            if found:
+                res[skey] = val
+            else:
+                missing[key] = skey
+
+        if res:
+            self.__count('localHits', len(res))
+
+        if missing:
             try:
-                logger.debug('value: {}'.format(c.value))
-                val = pickle.loads(encoders.decode(c.value, 'base64'))
-            except Exception:  # If invalid, simple do no tuse it
-                logger.exception('Invalid pickle from cache')
-                c.delete()
-                return defValue
-            Cache.hits += 1
-            return val
-        except uds.models.Cache.DoesNotExist:  # @UndefinedVariable
-            Cache.misses += 1
-            logger.debug('key not found: {}'.format(skey))
-            return defValue
-        except Exception as e:
-            Cache.misses += 1
-            logger.debug('Cache inaccesible: {}:{}'.format(skey, e))
-            return defValue
+                values = self.backend().getMany(self._owner, list(missing))
+            except Exception as e:
+                logger.debug('Cache inaccesible: {}:{}'.format(list(missing.values()), e))
+                values = {}
+            for key, skey in six.iteritems(missing):
+                if key in values:
+                    val, remaining = values[key]
+                    res[skey] = val
+                    Cache._local.put(key, self._owner, val, remaining)
+                else:
+                    res[skey] = defValue
+            self.__count('hits', len(values))
+            self.__count('misses', len(missing) - len(values))
+
+        return res
 
     def remove(self, skey):
         """
@@ -95,63 +337,53 @@ class Cache(object):
         If cached item does not exists, nothing happens (no exception thrown)
         """
         # logger.debug('Removing key "%s" for uService "%s"' % (skey, self._owner))
-        try:
-            key = self.__getKey(skey)
-            uds.models.Cache.objects.get(pk=key).delete()  # @UndefinedVariable
-            return True
-        except uds.models.Cache.DoesNotExist:  # @UndefinedVariable
+        key = self.__getKey(skey)
+        Cache._local.remove(key)
+        if not self.backend().remove(self._owner, key):
             logger.debug('key not found')
             return False
+        return True
 
     def clean(self):
         Cache.delete(self._owner)
 
     def put(self, skey, value, validity=None):
         # logger.debug('Saving key "%s" for cache "%s"' % (skey, self._owner,))
+        self.putMany({skey: value}, validity)
+
+    def putMany(self, items, validity=None):
+        """
+        Stores all skey -> value items of dictionary "items", with same validity
+        """
         if validity is None:
             validity = Cache.DEFAULT_VALIDITY
-        key = self.__getKey(skey)
-        value = encoders.encode(pickle.dumps(value), 'base64', asText=True)
-        now = getSqlDatetime()
-        try:
-            uds.models.Cache.objects.create(owner=self._owner, key=key, value=value, created=now, validity=validity)  # @UndefinedVariable
-        except Exception:
-            try:
-                # Already exists, modify it
-                c = uds.models.Cache.objects.get(pk=key)  # @UndefinedVariable
-                c.owner = self._owner
-                c.key = key
-                c.value = value
-                c.created = now
-                c.validity = validity
-                c.save()
-            except transaction.TransactionManagementError:
-                logger.debug('Transaction in course, cannot store value')
+        values = {}
+        for skey, value in six.iteritems(items):
+            key = self.__getKey(skey)
+            values[key] = value
+            Cache._local.put(key, self._owner, value, validity)
+        self.backend().putMany(self._owner, values, validity)
 
     def refresh(self, skey):
         # logger.debug('Refreshing key "%s" for cache "%s"' % (skey, self._owner,))
-        try:
-            key = self.__getKey(skey)
-            c = uds.models.Cache.objects.get(pk=key)  # @UndefinedVariable
-            c.created = getSqlDatetime()
-            c.save()
-        except uds.models.Cache.DoesNotExist:  # @UndefinedVariable
+        if not self.backend().refresh(self._owner, self.__getKey(skey)):
             logger.debug('Can\'t refresh cache key %s because it doesn\'t exists' % skey)
-            return
 
     @staticmethod
     def purge():
-        uds.models.Cache.objects.all().delete()  # @UndefinedVariable
+        Cache._local.clear()
+        Cache.backend().purge()
 
     @staticmethod
     def cleanUp():
-        uds.models.Cache.cleanUp()  # @UndefinedVariable
+        Cache.backend().cleanUp()
 
     @staticmethod
     def delete(owner=None):
         # logger.info("Deleting cache items")
         if owner is None:
-            objects = uds.models.Cache.objects.all()  # @UndefinedVariable
+            Cache._local.clear()
         else:
-            objects = uds.models.Cache.objects.filter(owner=owner)  # @UndefinedVariable
-        objects.delete()
+            owner = owner.decode('utf8') if isinstance(owner, six.binary_type) else owner
+            Cache._local.removeOwner(owner)
+        Cache.backend().deleteOwner(owner)
@@ -33,8 +33,13 @@ from __future__ import unicode_literals
 
 from django.conf import settings
 from django.apps import apps
+from django.db import transaction
+from django.db.models import signals
 import uds.models.Config
 from uds.core.managers.CryptoManager import CryptoManager
+import threading
+import uuid
+import time
 import six
 import logging
 
@@ -44,6 +49,10 @@ GLOBAL_SECTION = 'UDS'
 SECURITY_SECTION = 'Security'
 CLUSTER_SECTION = 'Cluster'
 
+# Hidden value that changes every time any configuration value is changed
+GENERATION_SECTION = '__config'
+GENERATION_KEY = 'generation'
+
 # For save when initialized
 saveLater = []
 getLater = []
@@ -55,6 +64,10 @@ configParams = {}
 class Config(object):
     """
     Keeps persistence configuration data
+
+    Values are read from a process wide snapshot of configuration table. Any change on it stores a new "generation",
+    checked at most every "checkInterval" seconds, and whole snapshot is reloaded with just one query when it changes,
+    so values are kept up to date on every process without accessing database for each read.
     """
 
     # Fields types, so inputs get more "beautiful"
@@ -66,6 +79,13 @@ class Config(object):
     READ_FIELD = 5  # Only can viewed, but not changed (can be changed througn API, it's just read only to avoid "mistakes")
     HIDDEN_FIELD = 6  # Not visible on "admin" config edition
 
+    checkInterval = 2
+
+    _snapshot = None  # (section, key) -> (value, crypt, long, field_type)
+    _generation = None
+    _lastCheck = 0
+    _lock = threading.Lock()
+
     class _Value(object):
 
         def __init__(self, section, key, default='', crypt=False, longText=False, **kwargs):
@@ -94,16 +114,17 @@ class Config(object):
                 return self._default
 
             try:
-                if force or self._data is None:
-                    # logger.debug('Accessing db config {0}.{1}'.format(self._section.name(), self._key))
-                    readed = uds.models.Config.objects.get(section=self._section.name(), key=self._key)  # @UndefinedVariable
-                    self._data = readed.value
-                    self._crypt = [self._crypt, True][readed.crypt]  # True has "higher" precedende than False
-                    self._longText = readed.long
-                    if self._type != -1:  # readed.field_type == -1 and
-                        readed.field_type = self._type
-                        readed.save()
-                    self._type = readed.field_type
+                readed = Config.values(force).get((self._section.name(), self._key))
+                if readed is None:  # Not on snapshot, but may have been created meanwhile
+                    readed = uds.models.Config.objects.values_list('value', 'crypt', 'long', 'field_type').get(section=self._section.name(), key=self._key)  # @UndefinedVariable
+                self._data, crypt, self._longText, fieldType = readed
+                self._crypt = [self._crypt, True][crypt]  # True has "higher" precedende than False
+                if self._type != -1:  # readed.field_type == -1 and
+                    if fieldType != self._type:
+                        uds.models.Config.objects.filter(section=self._section.name(), key=self._key).update(field_type=self._type)  # @UndefinedVariable
+                        Config.invalidate()
+                else:
+                    self._type = fieldType
             except Exception:
                 # Not found
                 if self._default != '' and self._crypt:
@@ -194,6 +215,44 @@ class Config(object):
     def section(sectionName):
         return Config._Section(sectionName)
 
+    @staticmethod
+    def values(force=False):
+        """
+        Returns current snapshot of configuration values, (section, key) -> (value, crypt, long, field_type)
+        Generation is checked if checkInterval has elapsed since last check (or force is True), reloading the snapshot if it has changed
+        """
+        now = time.time()
+        if force or now - Config._lastCheck >= Config.checkInterval:
+            with Config._lock:
+                if force or now - Config._lastCheck >= Config.checkInterval:
+                    generation = uds.models.Config.objects.filter(section=GENERATION_SECTION, key=GENERATION_KEY).values_list('value', flat=True).first()  # @UndefinedVariable
+                    if generation is None:
+                        generation = Config.newGeneration()
+                    if Config._snapshot is None or generation != Config._generation:
+                        snapshot = {(v[0], v[1]): v[2:] for v in uds.models.Config.objects.values_list('section', 'key', 'value', 'crypt', 'long', 'field_type')}  # @UndefinedVariable
+                        # Generation readed with the snapshot, so changes done between both queries are not lost
+                        Config._generation = snapshot.get((GENERATION_SECTION, GENERATION_KEY), (generation,))[0]
+                        Config._snapshot = snapshot
+                        logger.debug('Configuration reloaded, generation {}'.format(Config._generation))
+                    Config._lastCheck = now
+        return Config._snapshot
+
+    @staticmethod
+    def newGeneration():
+        generation = uuid.uuid4().hex
+        uds.models.Config.objects.update_or_create(section=GENERATION_SECTION, key=GENERATION_KEY, defaults={'value': generation, 'field_type': Config.HIDDEN_FIELD})  # @UndefinedVariable
+        Config._lastCheck = 0  # This process sees the change on next read
+        return generation
+
+    @staticmethod
+    def invalidate(sender=None, instance=None, **kwargs):
+        """
+        Marks configuration snapshots as outdated on every process (once changes are commited). Connected to configuration changes
+        """
+        if instance is not None and instance.section == GENERATION_SECTION:
+            return
+        transaction.on_commit(Config.newGeneration)
+
     @staticmethod
     def enumerate():
         GlobalConfig.initialize()  # Ensures DB contains all values
@@ -290,6 +349,8 @@ class GlobalConfig(object):
 
     # Statistics duration, in days
     STATS_DURATION = Config.section(GLOBAL_SECTION).value('statsDuration', '365', type=Config.NUMERIC_FIELD)
+    # Time (in seconds) that a generated report is reused for identical report requests
+    REPORTS_CACHE_VALIDITY = Config.section(GLOBAL_SECTION).value('reportsCacheValidity', '600', type=Config.NUMERIC_FIELD)
     # If disallow login using /login url, and must go to an authenticator
     DISALLOW_GLOBAL_LOGIN = Config.section(GLOBAL_SECTION).value('disallowGlobalLogin', '0', type=Config.BOOLEAN_FIELD)
 
@@ -382,6 +443,10 @@ class GlobalConfig(object):
                 logger.debug('Config table do not exists!!!, maybe we are installing? :-)')
 
 
+signals.post_save.connect(Config.invalidate, sender=uds.models.Config, dispatch_uid='config-save')
+signals.post_delete.connect(Config.invalidate, sender=uds.models.Config, dispatch_uid='config-delete')
+
+
 # Context processor
 # noinspection PyUnusedLocal
 def context_processor(request):
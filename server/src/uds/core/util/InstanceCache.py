@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) 2012 Virtual Cable S.L.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#    * Neither the name of Virtual Cable S.L. nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+@author: Adolfo Gómez, dkmaster at dkmon dot com
+"""
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db.models import signals
+
+import collections
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+__updated__ = '2018-10-18'
+
+
+class InstanceCache(object):
+    """
+    Process wide, bounded (LRU), cache of instances unserialized from database objects (services, providers, os managers,
+    publications, ...), so objects readed again (on same or another request) are not instantiated and unserialized again.
+
+    Entries are keyed by (model, pk), and keep the "version" (the stored data they were built from, including the data of the
+    objects they depend on), so an entry is only used while database object (and its dependencies) hold the same data.
+    Entries are also removed when objects are saved or deleted on this process.
+
+    Cached instances are shared by all threads, so they are only used when requested explicitly (getInstance(shared=True))
+    by read only lookups, that must not modify them nor use their apis (providers clients are not thread safe).
+    """
+    maxEntries = getattr(settings, 'UDS_INSTANCE_CACHE_ENTRIES', 1024)
+
+    _lock = threading.Lock()
+    _data = collections.OrderedDict()  # (model, pk) -> (version, instance)
+    _counters = collections.defaultdict(lambda: {'hits': 0, 'misses': 0, 'invalidations': 0})
+
+    @staticmethod
+    def __key(obj):
+        return (obj._meta.label, obj.pk)
+
+    @staticmethod
+    def get(obj, version):
+        """
+        Returns the cached instance of database object obj, built from "version", or None if there is none
+        """
+        key = InstanceCache.__key(obj)
+        with InstanceCache._lock:
+            entry = InstanceCache._data.pop(key, None)
+            if entry is not None and entry[0] == version:
+                InstanceCache._data[key] = entry  # Reinserted as most recently used
+                InstanceCache._counters[key[0]]['hits'] += 1
+                return entry[1]
+            InstanceCache._counters[key[0]]['misses'] += 1
+        return None
+
+    @staticmethod
+    def put(obj, version, instance):
+        if InstanceCache.maxEntries <= 0 or obj.pk is None:
+            return
+        key = InstanceCache.__key(obj)
+        with InstanceCache._lock:
+            InstanceCache._data.pop(key, None)
+            InstanceCache._data[key] = (version, instance)
+            while len(InstanceCache._data) > InstanceCache.maxEntries:
+                InstanceCache._data.popitem(last=False)
+
+    @staticmethod
+    def invalidate(sender, instance, **kwargs):
+        """
+        Removes the cached instance of a database object. Connected to every model save & delete
+        """
+        key = (sender._meta.label, instance.pk)
+        if key not in InstanceCache._data:  # Most saved objects are not cached, avoid locking for them
+            return
+        with InstanceCache._lock:
+            if InstanceCache._data.pop(key, None) is not None:
+                InstanceCache._counters[key[0]]['invalidations'] += 1
+
+    @staticmethod
+    def clear():
+        with InstanceCache._lock:
+            InstanceCache._data.clear()
+
+    @staticmethod
+    def counters():
+        """
+        Returns hits, misses & invalidations counters (and hit rate) of this process, per model
+        """
+        with InstanceCache._lock:
+            res = {k: dict(v) for k, v in InstanceCache._counters.items()}
+        for v in res.values():
+            total = v['hits'] + v['misses']
+            v['hit_rate'] = float(v['hits']) / total if total else 0.0
+        return res
+
+
+signals.post_save.connect(InstanceCache.invalidate, dispatch_uid='instance-cache-save')
+signals.post_delete.connect(InstanceCache.invalidate, dispatch_uid='instance-cache-delete')
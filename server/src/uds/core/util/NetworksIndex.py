@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) 2012 Virtual Cable S.L.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#    * Neither the name of Virtual Cable S.L. nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+@author: Adolfo Gómez, dkmaster at dkmon dot com
+"""
+from __future__ import unicode_literals
+
+from django.db import transaction
+
+from uds.core.util.Cache import Cache
+from uds.core.util import net
+
+import threading
+import bisect
+import uuid
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+__updated__ = '2018-10-18'
+
+
+class NetworksIndex(object):
+    """
+    Process wide, in memory, index of networks (IPv4 & IPv6) and their relation with transports, so
+    networks containing an ip and transports valid for an ip are resolved without accessing database.
+
+    Networks ranges are split in non overlapping segments, sorted, each one with the set of networks that contains it,
+    so an ip is resolved with a binary search.
+
+    Index is rebuilt (lazily) when networks or transports change, on this process or on any other one
+    (through a generation stored on cache, checked at most every "checkInterval" seconds)
+    """
+    _index = None
+
+    checkInterval = 2
+    generationValidity = 3600 * 24 * 7
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cache = Cache('networksIndex')
+        self._generation = None
+        self._lastCheck = 0
+        # (sorted start of segments, networks ids of every segment, transport id -> (networks ids, nets_positive))
+        # Transports without networks are not included. Replaced as a whole, so readers do not need locking
+        self._data = ([], [], {})
+
+    @staticmethod
+    def index():
+        if NetworksIndex._index is None:
+            NetworksIndex._index = NetworksIndex()
+        return NetworksIndex._index
+
+    @staticmethod
+    def invalidate(*args, **kwargs):
+        """
+        Marks index as outdated on every process. Connected to changes on networks and transports
+        """
+        def newGeneration():
+            self = NetworksIndex.index()
+            self._cache.put('generation', uuid.uuid4().hex, NetworksIndex.generationValidity)
+            self._lastCheck = 0
+
+        # Other processes must not rebuild the index before changes are visible
+        transaction.on_commit(newGeneration)
+
+    def __build(self):
+        from uds.models import Network, Transport
+
+        ranges = []
+        for n in Network.objects.all():
+            try:
+                start, end = net.networksFromString(n.net_string, False) if n.net_string else (n.net_start, n.net_end)
+            except ValueError:
+                start, end = n.net_start, n.net_end
+            ranges.append((start, end, n.id))
+
+        # Segments boundaries: every start, and every position after an end
+        bounds = sorted(set([r[0] for r in ranges] + [r[1] + 1 for r in ranges]))
+        segments = [set() for _ in bounds]
+        for start, end, netId in ranges:
+            for i in range(bisect.bisect_left(bounds, start), bisect.bisect_left(bounds, end + 1)):
+                segments[i].add(netId)
+
+        transports = {}
+        netsPositive = dict(Transport.objects.values_list('id', 'nets_positive'))
+        for transportId, netId in Network.transports.through.objects.values_list('transport_id', 'network_id'):
+            transports.setdefault(transportId, (set(), netsPositive.get(transportId, True)))[0].add(netId)
+
+        self._data = (bounds, [frozenset(s) for s in segments], {k: (frozenset(v[0]), v[1]) for k, v in transports.items()})
+        logger.debug('Networks index rebuilt with {} networks and {} segments'.format(len(ranges), len(bounds)))
+
+    def __check(self):
+        now = time.time()
+        if now - self._lastCheck < self.checkInterval:
+            return
+        with self._lock:
+            if now - self._lastCheck < self.checkInterval:
+                return
+            generation = self._cache.get('generation')
+            if generation is None:
+                generation = uuid.uuid4().hex
+                self._cache.put('generation', generation, NetworksIndex.generationValidity)
+            if generation != self._generation:
+                self.__build()
+                self._generation = generation
+            self._lastCheck = now
+
+    def networksFor(self, ip):
+        """
+        Returns the (frozen) set of ids of networks that contains ip (IPv4 or IPv6 string)
+        """
+        self.__check()
+        bounds, segments, _transports = self._data
+        pos = bisect.bisect_right(bounds, net.ipToLong(ip)) - 1
+        return segments[pos] if pos >= 0 else frozenset()
+
+    def transportValidForNetworks(self, transportId, networkIds):
+        """
+        Same as Transport.validForIp, but with the ids of the networks of the ip already resolved:
+        * Transports without networks are valid for any ip
+        * With nets_positive, the ip must be contained in any of the transport networks
+        * Without nets_positive, the ip must not be contained in any of the transport networks
+        """
+        self.__check()
+        transport = self._data[2].get(transportId)
+        if transport is None:
+            return True
+        return bool(transport[0] & networkIds) == transport[1]
+
+    def transportValidForIp(self, transportId, ip):
+        return self.transportValidForNetworks(transportId, self.networksFor(ip))
+
+    def transportsValidFor(self, ip, transportIds):
+        """
+        Filters an iterable of transport ids, returning the ones that are valid for ip
+        """
+        networkIds = self.networksFor(ip)
+        return [t for t in transportIds if self.transportValidForNetworks(t, networkIds)]
@@ -32,7 +32,7 @@
 """
 from __future__ import unicode_literals
 
-from django.db import transaction
+from django.db import transaction, connection, IntegrityError
 from uds.models.Storage import Storage as dbStorage
 from uds.core.util import encoders
 import hashlib
@@ -44,6 +44,12 @@ logger = logging.getLogger(__name__)
 
 
 class Storage(object):
+    """
+    Persistent storage of values for an "owner"
+
+    Many keys can be readed or written (upserted) at once, with just one database operation.
+    Writes are done immediately, so they are part of current transaction (and rolled back with it)
+    """
 
     def __init__(self, owner):
         self._owner = owner.encode('utf-8') if isinstance(owner, six.text_type) else owner
@@ -54,18 +60,50 @@ class Storage(object):
         h.update(key.encode('utf8') if isinstance(key, six.text_type) else key)
         return h.hexdigest()
 
+    @staticmethod
+    def __upsert(rows):
+        """
+        Inserts or updates (key, owner, data, attr1) rows
+        """
+        if connection.vendor in ('mysql', 'sqlite', 'postgresql'):
+            qn = connection.ops.quote_name
+            ownerField = dbStorage._meta.get_field('owner')
+            # Same conversion django does for owner (as it can be bytes)
+            rows = [(key, ownerField.get_db_prep_value(owner, connection), data, attr1) for key, owner, data, attr1 in rows]
+            columns = ', '.join(qn(c) for c in ('key', 'owner', 'data', 'attr1'))
+            sql = 'INSERT INTO {} ({}) VALUES (%s, %s, %s, %s)'.format(qn(dbStorage._meta.db_table), columns)  # @UndefinedVariable
+            if connection.vendor == 'mysql':
+                sql += ' ON DUPLICATE KEY UPDATE ' + ', '.join('{0}=VALUES({0})'.format(qn(c)) for c in ('owner', 'data', 'attr1'))
+            else:
+                sql += ' ON CONFLICT ({}) DO UPDATE SET '.format(qn('key')) + ', '.join('{0}=excluded.{0}'.format(qn(c)) for c in ('owner', 'data', 'attr1'))
+            with connection.cursor() as cursor:
+                cursor.executemany(sql, rows)
+            return
+
+        for key, owner, data, attr1 in rows:
+            if dbStorage.objects.filter(key=key).update(owner=owner, data=data, attr1=attr1) == 0:  # @UndefinedVariable
+                try:
+                    with transaction.atomic():
+                        dbStorage.objects.create(owner=owner, key=key, data=data, attr1=attr1)  # @UndefinedVariable
+                except IntegrityError:  # Created meanwhile
+                    dbStorage.objects.filter(key=key).update(owner=owner, data=data, attr1=attr1)  # @UndefinedVariable
+
     def saveData(self, skey, data, attr1=None):
-        key = self.__getKey(skey)
-        if isinstance(data, six.text_type):
-            data = data.encode('utf-8')
-        data = encoders.encode(data, 'base64', asText=True)
-        attr1 = '' if attr1 is None else attr1
-        try:
-            dbStorage.objects.create(owner=self._owner, key=key, data=data, attr1=attr1)  # @UndefinedVariable
-        except Exception:
-            dbStorage.objects.filter(key=key).update(owner=self._owner, data=data, attr1=attr1)  # @UndefinedVariable
+        self.saveMany({skey: data}, attr1)
         # logger.debug('Key saved')
 
+    def saveMany(self, items, attr1=None):
+        """
+        Saves all skey -> data items of dictionary "items" (with same attr1) with just one database operation
+        """
+        rows = []
+        for skey, data in six.iteritems(items):
+            if isinstance(data, six.text_type):
+                data = data.encode('utf-8')
+            rows.append((self.__getKey(skey), self._owner, encoders.encode(data, 'base64', asText=True), '' if attr1 is None else attr1))
+
+        self.__upsert(rows)
+
     def put(self, skey, data):
         return self.saveData(skey, data)
 
@@ -75,23 +113,51 @@ class Storage(object):
     def updateData(self, skey, data, attr1=None):
         self.saveData(skey, data, attr1)
 
-    def readData(self, skey, fromPickle=False):
+    @staticmethod
+    def __decode(data, fromPickle):
+        val = encoders.decode(data, 'base64')
+
+        if fromPickle:
+            return val
+
         try:
-            key = self.__getKey(skey)
-            logger.debug('Accesing to {0} {1}'.format(skey, key))
-            c = dbStorage.objects.get(pk=key)  # @UndefinedVariable
-            val = encoders.decode(c.data, 'base64')
-
-            if fromPickle:
-                return val
-
-            try:
-                return val.decode('utf-8')  # Tries to encode in utf-8
-            except:
-                return val
-        except dbStorage.DoesNotExist:  # @UndefinedVariable
+            return val.decode('utf-8')  # Tries to encode in utf-8
+        except:
+            return val
+
+    def __readRaw(self, keys):
+        """
+        Returns a dictionary key -> base64 data for existing keys
+        """
+        return dict(dbStorage.objects.filter(key__in=keys).values_list('key', 'data'))  # @UndefinedVariable
+
+    def readData(self, skey, fromPickle=False):
+        key = self.__getKey(skey)
+        logger.debug('Accesing to {0} {1}'.format(skey, key))
+        data = self.__readRaw([key]).get(key)
+        if data is None:
             logger.debug('key not found')
             return None
+        return self.__decode(data, fromPickle)
+
+    def readMany(self, skeys, fromPickle=False):
+        """
+        Reads all keys in "skeys" with just one database query.
+        Returns a dictionary skey -> value, with None as value for not found keys
+        """
+        keys = {self.__getKey(skey): skey for skey in skeys}
+        found = self.__readRaw(list(keys))
+        res = {skey: None for skey in skeys}
+        for key, data in six.iteritems(found):
+            res[keys[key]] = self.__decode(data, fromPickle)
+        return res
+
+    def existsMany(self, skeys):
+        """
+        Returns the set of keys in "skeys" that are stored, with just one database query
+        """
+        keys = {self.__getKey(skey): skey for skey in skeys}
+        return set(keys[key] for key in dbStorage.objects.filter(key__in=list(keys)).values_list('key', flat=True))  # @UndefinedVariable
 
     def get(self, skey):
         return self.readData(skey)
@@ -110,8 +176,7 @@ class Storage(object):
 
     def remove(self, skey):
         try:
-            key = self.__getKey(skey)
-            dbStorage.objects.filter(key=key).delete()  # @UndefinedVariable
+            dbStorage.objects.filter(key=self.__getKey(skey)).delete()  # @UndefinedVariable
         except Exception:
             pass
 
@@ -33,22 +33,114 @@
 from __future__ import unicode_literals
 
 from django.db import transaction, OperationalError, connection
+from django.db.models import Max
 from django.db.utils import IntegrityError
 from uds.models.UniqueId import UniqueId
 from uds.models import getSqlDatetime
+from socket import gethostname
+import threading
+import bisect
+import atexit
 import logging
 import time
+import os
 
 logger = logging.getLogger(__name__)
 
 MAX_SEQ = 1000000000000000
 
+# Number of sequences leased at once by a process
+LEASE_SIZE = 16
+# Max number of freed sequences kept on a process for reuse (instead of returning them)
+MAX_LOCAL_FREE = 64
+# Seconds a process keeps its leased sequences before returning them (and leasing new ones if needed)
+LEASE_VALIDITY = 600
+
+# Owner of the rows leased by this process (assigned, but not given to anyone yet)
+LEASE_OWNER = '\tlease:{}:{}'.format(gethostname(), os.getpid())[:128]
+LEASE_OWNER_PREFIX = '\tlease:'
+
 
 class CreateNewIdException(Exception):
     pass
 
 
+class _Leases(object):
+    """
+    Sequences leased by this process, per basename, kept sorted so the lowest one in a range is found in O(log n)
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seqs = {}  # basename -> sorted list of leased seqs
+        self.expires = {}  # basename -> time.time() of lease expiration
+        self.registered = False
+
+    def take(self, basename, rangeStart, rangeEnd):
+        """
+        Removes from local list and returns the lowest leased seq in range, or None if none is available
+        """
+        with self.lock:
+            if self.expires.get(basename, 0) < time.time():
+                return None
+            seqs = self.seqs.get(basename, [])
+            pos = bisect.bisect_left(seqs, rangeStart)
+            if pos < len(seqs) and seqs[pos] <= rangeEnd:
+                return seqs.pop(pos)
+            return None
+
+    def canAdd(self, basename, number=1):
+        """
+        Returns True if number freed seqs can be kept right now (may change before adding them)
+        """
+        with self.lock:
+            return self.expires.get(basename, 0) >= time.time() and len(self.seqs.get(basename, [])) + number <= MAX_LOCAL_FREE
+
+    def add(self, basename, newSeqs, newLease=False):
+        """
+        Adds seqs to local list. Returns False if they can't be kept (lease expired or too much free seqs)
+        """
+        with self.lock:
+            if newLease:
+                if basename not in self.expires or self.expires[basename] < time.time():
+                    self.expires[basename] = time.time() + LEASE_VALIDITY
+                if not self.registered:
+                    atexit.register(UniqueIDGenerator.releaseLeases)
+                    self.registered = True
+            elif self.expires.get(basename, 0) < time.time() or len(self.seqs.get(basename, [])) + len(newSeqs) > MAX_LOCAL_FREE:
+                return False
+
+            seqs = self.seqs.setdefault(basename, [])
+            for seq in newSeqs:
+                bisect.insort(seqs, seq)
+            return True
+
+    def expired(self, basename=None):
+        """
+        Removes from local lists, and returns, (basename, seqs) of expired leases (or all, if basename is None)
+        """
+        res = []
+        with self.lock:
+            now = time.time()
+            for name in list(self.seqs):
+                if basename is None or (name == basename and self.expires.get(name, 0) < now):
+                    res.append((name, self.seqs.pop(name)))
+                    self.expires.pop(name, None)
+        return res
+
+
+_leases = _Leases()
+
+
 class UniqueIDGenerator(object):
+    """
+    Generator of sequences globally unique for a basename (stored on UniqueId table)
+
+    To avoid locking the table ranges on every allocation, every process leases blocks of LEASE_SIZE
+    sequences (rows assigned to LEASE_OWNER), and takes sequences from them (just an update of a row by its key).
+    Freed sequences are kept on the process lease for reuse. Leases are returned after LEASE_VALIDITY seconds,
+    and when the process exits. Leases of dead processes are released by "UniqueIDLeasesCleaner" job.
+    """
 
     def __init__(self, typeName, owner, baseName=None):
         self._owner = owner + typeName
@@ -63,49 +155,76 @@ class UniqueIDGenerator(object):
         obj = UniqueId.objects.select_for_update() if forUpdate else UniqueId.objects
         return obj.filter(basename=self._baseName, seq__gte=rangeStart, seq__lte=rangeEnd)  # @UndefinedVariable
 
+    def __lease(self, rangeStart, rangeEnd):
+        """
+        Leases a block of sequences in range for this process (reusing free ones first, creating new ones if needed)
+        Returns the number of sequences leased
+        """
+        stamp = getSqlDatetime(True)
+        lockParams = {'skip_locked': True} if connection.features.has_select_for_update_skip_locked else {}
+        with transaction.atomic():
+            # Free rows, skipping the ones being leased by other nodes right now
+            seqs = list(self.__filter(rangeStart, rangeEnd).select_for_update(**lockParams).filter(assigned=False).order_by('seq').values_list('seq', flat=True)[:LEASE_SIZE])
+            if seqs:
+                UniqueId.objects.filter(basename=self._baseName, seq__in=seqs).update(owner=LEASE_OWNER, assigned=True, stamp=stamp)  # @UndefinedVariable
+            else:
+                last = self.__filter(rangeStart, rangeEnd).aggregate(last=Max('seq'))['last']
+                first = rangeStart if last is None else last + 1
+                seqs = list(range(first, min(first + LEASE_SIZE, rangeEnd + 1)))
+                # May ocurr on some circustance that a concurrency access gives same items twice, in this case, we
+                # will get an "duplicate key error", and caller will retry
+                UniqueId.objects.bulk_create([UniqueId(owner=LEASE_OWNER, basename=self._baseName, seq=seq, assigned=True, stamp=stamp) for seq in seqs])  # @UndefinedVariable
+
+        _leases.add(self._baseName, seqs, newLease=True)
+        return len(seqs)
+
+    def __reclaim(self, rangeStart, rangeEnd):
+        """
+        Leases for this process sequences in range leased (but not used) by other processes, ignoring its expiration.
+        Used when range is exhausted, so sequences kept by other processes are not stranded.
+        Other processes notice it when they try to take them (as taking a seq is conditioned to own the lease)
+        Returns the number of sequences leased
+        """
+        stamp = getSqlDatetime(True)
+        lockParams = {'skip_locked': True} if connection.features.has_select_for_update_skip_locked else {}
+        with transaction.atomic():
+            seqs = list(
+                self.__filter(rangeStart, rangeEnd).select_for_update(**lockParams).filter(owner__startswith=LEASE_OWNER_PREFIX).exclude(owner=LEASE_OWNER).order_by('seq').values_list('seq', flat=True)[:LEASE_SIZE]
+            )
+            if seqs:
+                UniqueId.objects.filter(basename=self._baseName, seq__in=seqs, owner__startswith=LEASE_OWNER_PREFIX).update(owner=LEASE_OWNER, stamp=stamp)  # @UndefinedVariable
+
+        if seqs:
+            logger.debug('Reclaimed {} leased seqs of {} from other processes'.format(len(seqs), self._baseName))
+            _leases.add(self._baseName, seqs, newLease=True)
+        return len(seqs)
+
+    def __take(self, seq, stamp):
+        """
+        Assigns a leased seq to owner. Returns False if lease has been lost (i.e. released by house keeping)
+        """
+        return UniqueId.objects.filter(basename=self._baseName, seq=seq, owner=LEASE_OWNER).update(owner=self._owner, assigned=True, stamp=stamp) > 0  # @UndefinedVariable
+
     def get(self, rangeStart=0, rangeEnd=MAX_SEQ):
         """
         Tries to generate a new unique id in the range provided. This unique id
         is global to "unique ids' database
         """
-        # First look for a name in the range defined
         stamp = getSqlDatetime(True)
-        seq = rangeStart
-        # logger.debug(UniqueId)
+        # Expired leases of this basename are returned before looking for a new seq
+        UniqueIDGenerator.releaseLeases(self._baseName)
         counter = 0
         while True:
             counter += 1
             try:
-                # logger.debug('Creating new seq in range {}-{}'.format(rangeStart, rangeEnd))
-                with transaction.atomic():
-                    flt = self.__filter(rangeStart, rangeEnd, forUpdate=True)
-                    try:
-                        item = flt.filter(assigned=False).order_by('seq')[0]
-                        item.owner = self._owner
-                        item.assigned = True
-                        item.stamp = stamp
-                        item.save()
-                        # UniqueId.objects.filter(id=item.id).update(owner=self._owner, assigned=True, stamp=stamp)  # @UndefinedVariable
-                        seq = item.seq
-                        break
-                    except IndexError:  # No free element found
-                        item = None
-
-                    # No item was found on first instance (already created, but freed)
-                    if item is None:
-                        # logger.debug('No free found, creating new one')
-                        try:
-                            last = flt.filter(assigned=True)[0]  # DB Returns correct order so the 0 item is the last
-                            seq = last.seq + 1
-                        except IndexError:  # If there is no assigned at database
-                            seq = rangeStart
-                        # logger.debug('Found seq {0}'.format(seq))
-                        if seq > rangeEnd:
-                            return -1  # No ids free in range
-                        # May ocurr on some circustance that a concurrency access gives same item twice, in this case, we
-                        # will get an "duplicate key error",
-                        UniqueId.objects.create(owner=self._owner, basename=self._baseName, seq=seq, assigned=True, stamp=stamp)  # @UndefinedVariable
+                seq = _leases.take(self._baseName, rangeStart, rangeEnd)
+                if seq is not None:
+                    if self.__take(seq, stamp):
                         break
+                    continue  # Lost, try next one
+
+                if self.__lease(rangeStart, rangeEnd) == 0 and self.__reclaim(rangeStart, rangeEnd) == 0:
+                    return -1  # No ids free in range, nor leased by other processes
             except OperationalError:  # Locked, may ocurr for example on sqlite. We will wait a bit
                 # logger.exception('Got database locked')
                 if counter % 5 == 0:
@@ -126,10 +245,16 @@ class UniqueIDGenerator(object):
 
     def free(self, seq):
         logger.debug('Freeing seq {} from {}  ({})'.format(seq, self._owner, self._baseName))
-        with transaction.atomic():
-            flt = self.__filter(0, forUpdate=True).filter(owner=self._owner, seq=seq).update(owner='', assigned=False, stamp=getSqlDatetime(True))
-        if flt > 0:
-            self.__purge()
+        stamp = getSqlDatetime(True)
+        # If possible, keep it on this process lease, so it's reused without looking for it at database
+        # Row is leased first, so it's not given to anyone while it still belongs to previous owner
+        if _leases.canAdd(self._baseName):
+            if self.__filter(seq, seq).filter(owner=self._owner).update(owner=LEASE_OWNER, stamp=stamp) == 0:
+                return  # Was not ours
+            if not _leases.add(self._baseName, [seq]):  # Can't be kept anymore, return it
+                self.__filter(seq, seq).filter(owner=LEASE_OWNER).update(owner='', assigned=False, stamp=stamp)
+            return
+        self.__filter(seq, seq).filter(owner=self._owner).update(owner='', assigned=False, stamp=stamp)
 
     def __purge(self):
         logger.debug('Purging UniqueID database')
@@ -151,3 +276,24 @@ class UniqueIDGenerator(object):
         stamp = getSqlDatetime(True) if stamp is None else stamp
         UniqueId.objects.select_for_update().filter(owner=self._owner, stamp__lt=stamp).update(assigned=False, owner='', stamp=stamp)  # @UndefinedVariable
         self.__purge()
+
+    @staticmethod
+    def releaseLeases(baseName=None):
+        """
+        Returns to database the expired leases of baseName or, if baseName is None, all leases of this process (used at exit)
+        """
+        for name, seqs in _leases.expired(baseName):
+            if not seqs:
+                continue
+            try:
+                UniqueId.objects.filter(basename=name, seq__in=seqs, owner=LEASE_OWNER).update(owner='', assigned=False, stamp=getSqlDatetime(True))  # @UndefinedVariable
+            except Exception:
+                logger.exception('Releasing unique id leases')
+
+    @staticmethod
+    def releaseStaleLeases():
+        """
+        Releases leases of any process that should have been returned long ago (processes that died without returning them)
+        """
+        stamp = getSqlDatetime(True)
+        UniqueId.objects.filter(owner__startswith=LEASE_OWNER_PREFIX, stamp__lt=stamp - 2 * LEASE_VALIDITY).update(owner='', assigned=False, stamp=stamp)  # @UndefinedVariable
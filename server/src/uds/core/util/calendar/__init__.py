@@ -33,25 +33,96 @@
 # pylint: disable=maybe-no-member
 from __future__ import unicode_literals
 
-from uds.models.Util import NEVER
 from uds.models.Util import getSqlDatetime
 
-from uds.models.Calendar import Calendar
-
-from uds.core.util.Cache import Cache
-
 import datetime
-import time
-import six
-import bitarray
+import bisect
 import logging
 
-__updated__ = '2017-12-12'
+__updated__ = '2018-10-18'
 
 logger = logging.getLogger(__name__)
 
+EPOCH = datetime.datetime(1970, 1, 1)
+ONE_MINUTE = datetime.timedelta(minutes=1)
+ONE_DAY = datetime.timedelta(days=1)
+
+
+def _minutes(dtime):
+    """
+    Minutes since epoch of a datetime (so seconds are truncated, as calendars granularity is minute)
+    """
+    return (dtime - EPOCH) // ONE_MINUTE
+
+
+class _CompiledCalendar(object):
+    """
+    Calendar rules "expanded" on an interval of time:
+      * Active intervals, merged & sorted, as minutes since epoch, so checking if a time is active is just a binary search
+      * Start & end events of rules, sorted, for locating next events
+    """
+
+    def __init__(self, calendar, start, end):
+        self.version = calendar.modified
+        self.start = start
+        self.end = end
+
+        intervals = []
+        startEvents = []
+        endEvents = []
+        for rule in calendar.rules.all():
+            duration = rule.duration_as_minutes
+
+            startEvents.extend(rule.as_rrule().between(start, end, inc=True))
+            endEvents.extend(rule.as_rrule_end().between(start, end, inc=True))
+
+            # Skip "bogus" definitions
+            if duration == 0 or rule.frequency_as_minutes == 0:
+                continue
+
+            # Events that started before interval can be still active on it
+            for val in rule.as_rrule().between(start - datetime.timedelta(minutes=duration), end, inc=True):
+                begin = _minutes(val)
+                intervals.append((begin, begin + duration))
+
+        intervals.sort()
+        self.starts, self.ends = [], []
+        for begin, finish in intervals:
+            if self.ends and begin <= self.ends[-1]:  # Overlaps (or follows) previous one
+                if finish > self.ends[-1]:
+                    self.ends[-1] = finish
+            else:
+                self.starts.append(begin)
+                self.ends.append(finish)
+
+        self.startEvents = sorted(startEvents)
+        self.endEvents = sorted(endEvents)
+
+    def contains(self, dtime):
+        return self.start <= dtime < self.end
+
+    def isActive(self, dtime):
+        minute = _minutes(dtime)
+        pos = bisect.bisect_right(self.starts, minute) - 1
+        return pos >= 0 and minute < self.ends[pos]
+
+    def nextEvent(self, dtime, startEvent):
+        """
+        Returns the first event after dtime, or None if there is no event on compiled interval
+        """
+        events = self.startEvents if startEvent else self.endEvents
+        pos = bisect.bisect_right(events, dtime)
+        return events[pos] if pos < len(events) else None
+
 
 class CalendarChecker(object):
+    """
+    Checks calendars rules.
+
+    Calendars are compiled, for a window of compileDays days, into sorted intervals that are kept
+    on memory, so checks are resolved with a binary search, without accessing database.
+    Compiled calendars are discarded when calendar is modified (modifying rules also updates calendar)
+    """
     calendar = None
 
     # For performance checking
@@ -59,59 +130,36 @@ class CalendarChecker(object):
     cache_hit = 0
     hits = 0
 
-    cache = Cache('calChecker')
+    # Days covered by compiled calendars (starting the day before the time that caused compilation)
+    compileDays = 28
+
+    # Compiled calendars, calendar id --> _CompiledCalendar
+    _compiled = {}
 
     def __init__(self, calendar):
         self.calendar = calendar
 
-    def _updateData(self, dtime):
-        logger.debug('Updating {}'.format(dtime))
-        # Else, update the array
+    def _compile(self, start, end):
+        logger.debug('Compiling {} from {} to {}'.format(self.calendar, start, end))
         CalendarChecker.updates += 1
+        return _CompiledCalendar(self.calendar, start, end)
 
-        data = bitarray.bitarray(60 * 24)  # Granurality is minute
-        data.setall(False)
-
-        data_date = dtime.date()
-
-        start = datetime.datetime.combine(data_date, datetime.datetime.min.time())
-        end = datetime.datetime.combine(data_date, datetime.datetime.max.time())
-
-        for rule in self.calendar.rules.all():
-            rr = rule.as_rrule()
-
-            r_end = datetime.datetime.combine(rule.end, datetime.datetime.max.time()) if rule.end is not None else None
-
-            ruleDurationMinutes = rule.duration_as_minutes
-            ruleFrequencyMinutes = rule.frequency_as_minutes
-
-            # Skip "bogus" definitions
-            if ruleDurationMinutes == 0 or ruleFrequencyMinutes == 0:
-                continue
-
-            # ruleDurationMinutes = ruleDurationMinutes
-            # Relative start, rrule can "spawn" the days, so we get the start at least the ruleDurationMinutes of rule to see if it "matches"
-            # This means, we need the previous matching day to be "executed" so we can get the "actives" correctly
-            diff = ruleFrequencyMinutes if ruleFrequencyMinutes > ruleDurationMinutes else ruleDurationMinutes
-            _start = (start if start > rule.start else rule.start) - datetime.timedelta(minutes=diff)
-
-            _end = end if r_end is None or end < r_end else r_end
-
-            for val in rr.between(_start, _end, inc=True):
-                if val.date() != data_date:
-                    diff = int((start - val).total_seconds() / 60)
-                    pos = 0
-                    posdur = ruleDurationMinutes - diff
-                    if posdur <= 0:
-                        continue
-                else:
-                    pos = val.hour * 60 + val.minute
-                    posdur = pos + ruleDurationMinutes
-                if posdur > 60 * 24:
-                    posdur = 60 * 24
-                data[pos:posdur] = True
-
-        return data
+    def _compiledFor(self, dtime):
+        """
+        Returns the compiled calendar window that contains dtime, compiling it if needed.
+        Returns None if dtime is before current window (we do not move the window backwards)
+        """
+        compiled = CalendarChecker._compiled.get(self.calendar.id)
+        if compiled is not None and compiled.version == self.calendar.modified:
+            if compiled.contains(dtime):
+                return compiled
+            if dtime < compiled.start:
+                return None
+
+        start = datetime.datetime.combine(dtime.date(), datetime.time.min) - ONE_DAY
+        compiled = self._compile(start, start + ONE_DAY * (self.compileDays + 1))
+        CalendarChecker._compiled[self.calendar.id] = compiled
+        return compiled
 
     def _updateEvents(self, checkFrom, startEvent=True):
 
@@ -126,7 +174,7 @@ class CalendarChecker(object):
             else:
                 event = rule.as_rrule_end().after(checkFrom)  # At end
 
-            if next_event is None or next_event > event:
+            if event is not None and (next_event is None or next_event > event):
                 next_event = event
 
         return next_event
@@ -135,28 +183,18 @@ class CalendarChecker(object):
         """
         Checks if the given time is a valid event on calendar
         @param dtime: Datetime object to check
-        TODO: We can improve performance of this by getting from a cache first if we can
         """
         if dtime is None:
             dtime = getSqlDatetime()
 
-        # First, try to get data from cache if it is valid
-        cacheKey = six.text_type(hash(self.calendar.modified)) + six.text_type(
-            dtime.date().toordinal()) + self.calendar.uuid + 'checker'
-        cached = CalendarChecker.cache.get(cacheKey, None)
-
-        if cached is not None:
-            data = bitarray.bitarray()  # Empty bitarray
-            data.frombytes(cached)
-            CalendarChecker.cache_hit += 1
+        compiled = self._compiledFor(dtime)
+        if compiled is None:  # Before current window, compile (without keeping it) just the day requested
+            start = datetime.datetime.combine(dtime.date(), datetime.time.min)
+            compiled = self._compile(start, start + ONE_DAY)
         else:
-            data = self._updateData(dtime)
-
-            # Now data can be accessed as an array of booleans.
-            # Store data on persistent cache
-            CalendarChecker.cache.put(cacheKey, data.tobytes(), 3600 * 24)
+            CalendarChecker.cache_hit += 1
 
-        return data[dtime.hour * 60 + dtime.minute]
+        return compiled.isActive(dtime)
 
     def nextEvent(self, checkFrom=None, startEvent=True, offset=None):
         """
@@ -170,21 +208,20 @@ class CalendarChecker(object):
         if offset is None:
             offset = datetime.timedelta(minutes=0)
 
-        cacheKey = six.text_type(hash(self.calendar.modified)) + self.calendar.uuid + six.text_type(
-            offset.seconds) + six.text_type(int(time.mktime(checkFrom.timetuple()))) + 'event' + (
-                       'x' if startEvent is True else '_')
-        next_event = CalendarChecker.cache.get(cacheKey, None)
-        if next_event is None:
-            logger.debug('Regenerating cached nextEvent')
-            next_event = self._updateEvents(checkFrom + offset,
-                                            startEvent)  # We substract on checkin, so we can take into account for next execution the "offset" on start & end (just the inverse of current, so we substract it)
-            if next_event is not None:
-                next_event += offset
-            CalendarChecker.cache.put(cacheKey, next_event, 3600)
+        # We substract on checkin, so we can take into account for next execution the "offset" on start & end (just the inverse of current, so we substract it)
+        checkFrom += offset
+
+        compiled = self._compiledFor(checkFrom)
+        next_event = compiled.nextEvent(checkFrom, startEvent) if compiled is not None else None
+        if next_event is None:  # Out of compiled window, calculate it from rules
+            logger.debug('Calculating nextEvent from rules')
+            next_event = self._updateEvents(checkFrom, startEvent)
         else:
-            logger.debug('nextEvent cache hit')
             CalendarChecker.hits += 1
 
+        if next_event is not None:
+            next_event += offset
+
         return next_event
 
     def debug(self):
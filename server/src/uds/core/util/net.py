@@ -31,6 +31,8 @@
 @author: Adolfo Gómez, dkmaster at dkmon dot com
 """
 from __future__ import unicode_literals
+import functools
+import ipaddress
 import re
 import six
 import logging
@@ -46,12 +48,22 @@ re3Asterisk = re.compile(r'^([0-9]{1,3})\.\*\.?\*?\.?\*?$')
 reRange = re.compile(r'^([0-9]{1,3})\.([0-9]{1,3})\.([0-9]{1,3})\.([0-9]{1,3})-([0-9]{1,3})\.([0-9]{1,3})\.([0-9]{1,3})\.([0-9]{1,3})$')
 reHost = re.compile(r'^([0-9]{1,3})\.([0-9]{1,3})\.([0-9]{1,3})\.([0-9]{1,3})$')
 
+MAX_IPV4 = 4294967295
+# IPv6 addresses are represented as its value plus this offset, so they never overlap IPv4 ones
+IPV6_OFFSET = 1 << 128
+MAX_IPV6 = IPV6_OFFSET + (1 << 128) - 1
+
 
 def ipToLong(ip):
     """
     convert decimal dotted quad string to long integer
     """
     try:
+        if ':' in ip:  # IPv6 (IPv4 mapped addresses are treated as IPv4 ones)
+            addr = ipaddress.IPv6Address(six.text_type(ip.split('%')[0]))
+            if addr.ipv4_mapped is not None:
+                return int(addr.ipv4_mapped)
+            return int(addr) + IPV6_OFFSET
         hexn = int(''.join(["%02X" % int(i) for i in ip.split('.')]), 16)
         logger.debug('IP {} is {}'.format(ip, hexn))
         return hexn
@@ -62,9 +74,11 @@ def ipToLong(ip):
 
 def longToIp(n):
     """
-    convert long int to dotted quad string
+    convert long int to dotted quad string (or IPv6 string, for IPv6 values)
     """
     try:
+        if n > MAX_IPV4:
+            return six.text_type(ipaddress.IPv6Address(n - IPV6_OFFSET))
         d = 1 << 24
         q = []
         while d > 0:
@@ -87,6 +101,7 @@ def networksFromString(strNets, allowMultipleNetworks=True):
       - A.B.C.D netmask X.X.X.X (i.e. 192.168.0.0 netmask 255.255.255.0)
       - A.B.C.D - E.F.G.D (i.e. 192-168.0.0-192.168.0.255)
       - A.B.C.D
+      - IPv6 networks, as X:X::/N, X:X::X - X:X::X or X:X::X
     If allowMultipleNetworks is True, it allows ',' and ';' separators (and, ofc, more than 1 network)
     Returns a list of networks tuples in the form [(start1, end1), (start2, end2) ...]
     """
@@ -123,7 +138,10 @@ def networksFromString(strNets, allowMultipleNetworks=True):
     strNets = strNets.replace(' ', '')
 
     if strNets == '*':
-        return 0, 4294967295
+        return 0, MAX_IPV6
+
+    if ':' in strNets:
+        return ipv6NetworkFromString(strNets)
 
     try:
         # Test patterns
@@ -181,11 +199,38 @@ def networksFromString(strNets, allowMultipleNetworks=True):
         raise ValueError(inputString)
 
 
+def ipv6NetworkFromString(strNet):
+    """
+    Parses an IPv6 network (X:X::/N, X:X::X-X:X::X or X:X::X)
+    """
+    try:
+        if '-' in strNet:
+            start, end = (int(ipaddress.IPv6Address(six.text_type(v))) for v in strNet.split('-'))
+            if end < start:
+                raise Exception()
+        else:
+            network = ipaddress.IPv6Network(six.text_type(strNet), strict=False)
+            start, end = int(network.network_address), int(network.broadcast_address)
+        return start + IPV6_OFFSET, end + IPV6_OFFSET
+    except Exception as e:
+        logger.error('Invalid network found: {} {}'.format(strNet, e))
+        raise ValueError(strNet)
+
+
+@functools.lru_cache(maxsize=64)
+def parsedNetworks(strNets):
+    """
+    Same as networksFromString(strNets) (with multiple networks allowed), but keeps the last results parsed,
+    so strings used frequently (i.e. trusted sources) are not parsed every time
+    """
+    return tuple(networksFromString(strNets))
+
+
 def ipInNetwork(ip, network):
     if isinstance(ip, six.string_types):
         ip = ipToLong(ip)
     if isinstance(network, six.string_types):
-        network = networksFromString(network)
+        network = parsedNetworks(network)
 
     for net in network:
         if net[0] <= ip <= net[1]:
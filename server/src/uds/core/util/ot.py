@@ -32,7 +32,7 @@
 """
 from __future__ import unicode_literals
 
-__updated__ = '2018-10-01'
+__updated__ = '2018-10-18'
 
 from uds.models import (
     Provider, Service, OSManager, Transport,
@@ -64,22 +64,32 @@ PROXY_TYPE = 16
 METAPOOL_TYPE = 15
 
 
+_objectTypes = {
+    Provider: PROVIDER_TYPE,
+    Service: SERVICE_TYPE,
+    OSManager: OSMANAGER_TYPE,
+    Transport: TRANSPORT_TYPE,
+    Network: NETWORK_TYPE,
+    ServicePool: POOL_TYPE,
+    UserService: USER_SERVICE_TYPE,
+    Authenticator: AUTHENTICATOR_TYPE,
+    User: USER_TYPE,
+    Group: GROUP_TYPE,
+    StatsCounters: STATS_COUNTER_TYPE,
+    StatsEvents: STATS_EVENTS_TYPE,
+    Calendar: CALENDAR_TYPE,
+    CalendarRule: CALENDAR_RULE_TYPE,
+    Proxy: PROXY_TYPE,
+    MetaPool: METAPOOL_TYPE,
+}
+
+
 def getObjectType(obj):
-    return {
-        Provider: PROVIDER_TYPE,
-        Service: SERVICE_TYPE,
-        OSManager: OSMANAGER_TYPE,
-        Transport: TRANSPORT_TYPE,
-        Network: NETWORK_TYPE,
-        ServicePool: POOL_TYPE,
-        UserService: USER_SERVICE_TYPE,
-        Authenticator: AUTHENTICATOR_TYPE,
-        User: USER_TYPE,
-        Group: GROUP_TYPE,
-        StatsCounters: STATS_COUNTER_TYPE,
-        StatsEvents: STATS_EVENTS_TYPE,
-        Calendar: CALENDAR_TYPE,
-        CalendarRule: CALENDAR_RULE_TYPE,
-        Proxy: PROXY_TYPE,
-        MetaPool: METAPOOL_TYPE,
-    }.get(type(obj))
+    return _objectTypes.get(type(obj))
+
+
+def getModelObjectType(model):
+    """
+    Returns the object type for instances of the model class "model"
+    """
+    return _objectTypes.get(model)
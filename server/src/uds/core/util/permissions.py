@@ -32,11 +32,14 @@
 """
 from __future__ import unicode_literals
 
-__updated__ = '2015-03-09'
+__updated__ = '2018-10-18'
 
-from uds.models import Permissions
+from django.db.models import signals, Q
+
+from uds.models import Permissions, Group
 from uds.core.util import ot
 
+import itertools
 import logging
 
 logger = logging.getLogger(__name__)
@@ -55,6 +58,75 @@ def getPermissions(obj):
     return list(Permissions.enumeratePermissions(object_type=ot.getObjectType(obj), object_id=obj.pk))
 
 
+# Incremented every time a permission (or a group membership) changes, so resolved permissions are discarded
+_generation = itertools.count()
+_current = next(_generation)
+
+
+def invalidate(*args, **kwargs):
+    global _current
+    _current = next(_generation)
+
+
+class PermissionsResolver(object):
+    """
+    Effective permissions of an user over all objects of an object type, loaded with just one query.
+
+    An instance is kept on the user db object, so resolved permissions live as long as the user object
+    (that is, the request), and are reloaded if permissions or groups are changed meanwhile.
+    """
+
+    def __init__(self, user):
+        self._user = user
+        self._generation = _current
+        self._types = {}
+
+    @staticmethod
+    def resolver(user):
+        resolver = getattr(user, '_permissionsResolver', None)
+        if resolver is None or resolver._generation != _current:
+            resolver = user._permissionsResolver = PermissionsResolver(user)
+        return resolver
+
+    def __load(self, objType):
+        """
+        Returns (root permission, {object_id: permission}) for the object type.
+        A permission over an object is the greatest of the root one and the ones assigned to it
+        """
+        try:
+            return self._types[objType]
+        except KeyError:
+            pass
+
+        root, objects = PERMISSION_NONE, {}
+        for objId, perm in Permissions.objects.filter(
+            Q(user=self._user) | Q(group__in=self._user.groups.all()),
+            object_type=objType
+        ).values_list('object_id', 'permission'):  # @UndefinedVariable
+            if objId is None:
+                root = max(root, perm)
+            else:
+                objects[objId] = max(objects.get(objId, PERMISSION_NONE), perm)
+
+        self._types[objType] = (root, objects)
+        return self._types[objType]
+
+    def permission(self, objType, objId=None):
+        root, objects = self.__load(objType)
+        if objId is None:
+            return root
+        return max(root, objects.get(objId, PERMISSION_NONE))
+
+    def filter(self, queryset, permission):
+        """
+        Filters the queryset so it contains only the objects over which the user has at least "permission"
+        """
+        root, objects = self.__load(ot.getModelObjectType(queryset.model))
+        if root >= permission:
+            return queryset
+        return queryset.filter(pk__in=[objId for objId, perm in objects.items() if perm >= permission])
+
+
 def getEffectivePermission(user, obj, root=False):
     if user.is_admin is True:
         return PERMISSION_ALL
@@ -62,10 +134,7 @@ def getEffectivePermission(user, obj, root=False):
     if user.staff_member is False:
         return PERMISSION_NONE
 
-    if root is False:
-        return Permissions.getPermissions(user=user, groups=user.groups.all(), object_type=ot.getObjectType(obj), object_id=obj.pk)
-    else:
-        return Permissions.getPermissions(user=user, groups=user.groups.all(), object_type=ot.getObjectType(obj))
+    return PermissionsResolver.resolver(user).permission(ot.getObjectType(obj), None if root else obj.pk)
 
 
 def addUserPermission(user, obj, permission=PERMISSION_READ):
@@ -81,6 +150,20 @@ def checkPermissions(user, obj, permission=PERMISSION_ALL, root=False):
     return getEffectivePermission(user, obj, root) >= permission
 
 
+def filterPermitted(user, queryset, permission=PERMISSION_READ):
+    """
+    Returns the queryset filtered (on database) to the objects the user has at least "permission" over.
+    Same as checking every object with checkPermissions, but without a query per object
+    """
+    if user.is_admin is True:
+        return queryset
+
+    if user.staff_member is False:
+        return queryset.none()
+
+    return PermissionsResolver.resolver(user).filter(queryset, permission)
+
+
 def getPermissionName(perm):
     return Permissions.permissionAsString(perm)
 
@@ -90,3 +173,8 @@ def revokePermissionById(permId):
         return Permissions.objects.get(uuid=permId).delete()
     except Exception:
         return None
+
+
+signals.post_save.connect(invalidate, sender=Permissions, dispatch_uid='permissions-resolver-save')
+signals.post_delete.connect(invalidate, sender=Permissions, dispatch_uid='permissions-resolver-delete')
+signals.m2m_changed.connect(invalidate, sender=Group.users.through, dispatch_uid='permissions-resolver-groups')
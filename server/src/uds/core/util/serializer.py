@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) 2018 Virtual Cable S.L.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#    * Neither the name of Virtual Cable S.L. nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+@author: Adolfo Gómez, dkmaster at dkmon dot com
+
+Compact, versioned serialization of basic values (None, booleans, numbers, strings, bytes, lists & dicts)
+
+Serialized data starts with a header (MAGIC, format version & flags), so data stored on previous formats (pickled,
+compressed, ...) can be recognized, readed with the old code, and rewritten using this one when stored again.
+Nothing is unpickled, so data readed from database can't execute code.
+"""
+from __future__ import unicode_literals
+
+import json
+import zlib
+import base64
+import six
+import logging
+
+logger = logging.getLogger(__name__)
+
+__updated__ = '2018-10-18'
+
+# No pickle, bz2 or zlib stream starts with a 0 byte
+MAGIC = b'\x00U'
+VERSION = 1
+
+# Flags
+COMPRESSED = 1
+
+# Payloads longer than this are compressed
+COMPRESS_THRESHOLD = 1024
+
+# Bytes are stored as {BYTES_TAG: base64}
+BYTES_TAG = '\x00b'
+
+
+def _default(obj):
+    if isinstance(obj, six.binary_type):
+        return {BYTES_TAG: base64.b64encode(obj).decode('ascii')}
+    raise TypeError('{} is not serializable'.format(type(obj)))
+
+
+def _objectHook(obj):
+    if len(obj) == 1 and BYTES_TAG in obj:
+        return base64.b64decode(obj[BYTES_TAG])
+    return obj
+
+
+_encoder = json.JSONEncoder(default=_default, separators=(',', ':'), ensure_ascii=False)
+_decoder = json.JSONDecoder(object_hook=_objectHook)
+
+
+def _checkKeys(value):
+    """
+    Raises TypeError if any dictionary inside value has non text keys, as json would convert them to text
+    """
+    if isinstance(value, dict):
+        for k, v in six.iteritems(value):
+            if not isinstance(k, six.text_type):
+                raise TypeError('Dictionary key {!r} is not serializable'.format(k))
+            _checkKeys(v)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            _checkKeys(v)
+
+
+def isSerialized(data):
+    """
+    Returns True if data has been serialized with this module (any version)
+    """
+    return data[:len(MAGIC)] == MAGIC
+
+
+def dumps(value):
+    """
+    Serializes value. Raises TypeError if value contains anything that is not a basic type, or dictionaries with
+    non text keys, so callers can use other format for it.
+    Note that tuples are serialized as lists, so they are unserialized as lists
+    """
+    _checkKeys(value)
+    data = _encoder.encode(value).encode('utf8')
+    flags = 0
+    if len(data) > COMPRESS_THRESHOLD:
+        data = zlib.compress(data, 1)
+        flags |= COMPRESSED
+    return MAGIC + six.int2byte(VERSION) + six.int2byte(flags) + data
+
+
+def loads(data):
+    """
+    Unserializes data returned by "dumps". Raises ValueError if data is not on a known format
+    """
+    data = bytes(data)
+    if not isSerialized(data) or len(data) < len(MAGIC) + 2:
+        raise ValueError('Not serialized data')
+    version, flags = six.indexbytes(data, len(MAGIC)), six.indexbytes(data, len(MAGIC) + 1)
+    if version > VERSION:
+        raise ValueError('Unknown serialization version {}'.format(version))
+    data = data[len(MAGIC) + 2:]
+    if flags & COMPRESSED:
+        data = zlib.decompress(data)
+    return _decoder.decode(data.decode('utf8'))
@@ -53,7 +53,7 @@ class PublicationInfoItemsCleaner(Job):
         super(PublicationInfoItemsCleaner, self).__init__(environment)
 
     def run(self):
-        removeFrom = getSqlDatetime() - timedelta(seconds=GlobalConfig.KEEP_INFO_TIME.getInt(True))
+        removeFrom = getSqlDatetime() - timedelta(seconds=GlobalConfig.KEEP_INFO_TIME.getInt())
         DeployedServicePublication.objects.filter(state__in=State.INFO_STATES, state_date__lt=removeFrom).delete()
 
 
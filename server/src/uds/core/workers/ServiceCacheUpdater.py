@@ -33,15 +33,19 @@
 from __future__ import unicode_literals
 
 from django.db import transaction
-from django.db.models import Q
+from django.db.models import Q, Count
 from uds.core.util.Config import GlobalConfig
 from uds.core.util.State import State
 from uds.core.managers.UserServiceManager import UserServiceManager
 from uds.core.services.Exceptions import MaxServicesReachedError
-from uds.models import DeployedService
+from uds.models import DeployedService, UserService, getSqlDatetime
 from uds.core import services
 from uds.core.util import log
 from uds.core.jobs.Job import Job
+from uds.core.jobs.ExecutionPool import ExecutionPool
+from datetime import timedelta
+import collections
+import six
 import logging
 
 logger = logging.getLogger(__name__)
@@ -59,6 +63,9 @@ class ServiceCacheUpdater(Job):
 
     friendly_name = 'Service Cache Updater'
 
+    # Max number of providers whose caches are updated concurrently
+    maxProvidersAtOnce = 4
+
     def __init__(self, environment):
         super(ServiceCacheUpdater, self).__init__(environment)
 
@@ -72,36 +79,76 @@ class ServiceCacheUpdater(Job):
         logger.info(' {0} is restrained, will check this later'.format(deployedService.name))
 
     def servicesPoolsNeedingCacheUpdate(self):
-        # State filter for cached and inAssigned objects
+        """
+        Returns a list of (servicePool, inCacheL1, inCacheL2, inAssigned) of the service pools that needs its cache updated,
+        sorted by priority (reductions first, because they free resources on providers, then L1 growths of the pools that
+        proportionally needs more cache, and then L2 growths).
+
+        Counters of all pools are obtained with a single grouped query, and growths are limited by
+        the max preparing services of each provider.
+        """
         # First we get all deployed services that could need cache generation
-        DeployedService.objects.update()
         # We start filtering out the deployed services that do not need caching at all.
-        whichNeedsCaching = DeployedService.objects.filter(Q(initial_srvs__gte=0) | Q(cache_l1_srvs__gte=0)).filter(max_srvs__gt=0, state=State.ACTIVE,
-                                                                                                                    service__provider__maintenance_mode=False)[:]
+        whichNeedsCaching = DeployedService.objects.filter(Q(initial_srvs__gte=0) | Q(cache_l1_srvs__gte=0)).filter(
+            max_srvs__gt=0, state=State.ACTIVE, service__provider__maintenance_mode=False
+        ).select_related('service', 'service__provider').annotate(
+            usablePublications=Count('publications', filter=Q(publications__state=State.USABLE)),
+            preparingPublications=Count('publications', filter=Q(publications__state=State.PREPARING))
+        )
+        whichNeedsCaching = list(whichNeedsCaching)
+        if not whichNeedsCaching:
+            return []
+
+        # Get data related to actual state of cache of all pools at once
+        stateFilter = UserServiceManager.getStateFilter()
+        restraintTime = GlobalConfig.RESTRAINT_TIME.getInt()
+        restraintDate = getSqlDatetime() - timedelta(seconds=max(restraintTime, 0))
+        counters = {
+            v['deployed_service']: v for v in UserService.objects.filter(deployed_service__in=whichNeedsCaching).values('deployed_service').annotate(
+                l1=Count('id', filter=UserServiceManager.getCacheStateFilter(services.UserDeployment.L1_CACHE)),
+                l2=Count('id', filter=UserServiceManager.getCacheStateFilter(services.UserDeployment.L2_CACHE)),
+                assigned=Count('id', filter=Q(cache_level=0) & stateFilter),
+                errors=Count('id', filter=Q(state=State.ERROR, state_date__gt=restraintDate)),
+            ).order_by()
+        }
+
+        # Services that each provider can still start
+        preparing = {
+            v['deployed_service__service__provider']: v['count'] for v in UserService.objects.filter(
+                state=State.PREPARING, deployed_service__service__provider__in={sp.service.provider_id for sp in whichNeedsCaching}
+            ).values('deployed_service__service__provider').annotate(count=Count('id')).order_by()
+        }
+        canStart = {}
+
+        def providerCanStart(sp):
+            provider = sp.service.provider
+            if provider.id not in canStart:
+                providerInstance = provider.getInstance()
+                if providerInstance.getIgnoreLimits():
+                    canStart[provider.id] = -1  # Unlimited
+                else:
+                    canStart[provider.id] = max(providerInstance.getMaxPreparingServices() - preparing.get(provider.id, 0), 0)
+            return canStart[provider.id]
 
-        # We will get the one that proportionally needs more cache
-        servicesPools = []
+        # Priority, proportion (lower first) & values
+        candidates = []
         for sp in whichNeedsCaching:
-            sp.userServices.update()  # Cleans cached queries
             # If this deployedService don't have a publication active and needs it, ignore it
-            spServiceInstance = sp.service.getInstance()
-
-            if sp.activePublication() is None and spServiceInstance.publicationType is not None:
+            if sp.usablePublications == 0 and sp.service.getType().publicationType is not None:
                 logger.debug('{} Needs publication but do not have one, cache test ignored'.format(sp))
                 continue
             # If it has any running publication, do not generate cache anymore
-            if sp.publications.filter(state=State.PREPARING).count() > 0:
+            if sp.preparingPublications > 0:
                 logger.debug('Stopped cache generation for deployed service with publication running: {0}'.format(sp))
                 continue
 
-            if sp.isRestrained():
+            count = counters.get(sp.id, {'l1': 0, 'l2': 0, 'assigned': 0, 'errors': 0})
+            if restraintTime > 0 and count['errors'] >= GlobalConfig.RESTRAINT_COUNT.getInt():
                 ServiceCacheUpdater.__notifyRestrain(sp)
                 continue
 
-            # Get data related to actual state of cache
-            inCacheL1 = sp.cachedUserServices().filter(UserServiceManager.getCacheStateFilter(services.UserDeployment.L1_CACHE)).count()
-            inCacheL2 = sp.cachedUserServices().filter(UserServiceManager.getCacheStateFilter(services.UserDeployment.L2_CACHE)).count()
-            inAssigned = sp.assignedUserServices().filter(UserServiceManager.getStateFilter()).count()
+            inCacheL1, inCacheL2, inAssigned = count['l1'], count['l2'], count['assigned']
+            values = (sp, inCacheL1, inCacheL2, inAssigned)
             # if we bypasses max cache, we will reduce it in first place. This is so because this will free resources on service provider
             logger.debug("Examining {0} with {1} in cache L1 and {2} in cache L2, {3} inAssigned".format(
                          sp, inCacheL1, inCacheL2, inAssigned))
@@ -109,48 +156,44 @@ class ServiceCacheUpdater(Job):
             # We have more than we want
             if totalL1Assigned > sp.max_srvs:
                 logger.debug('We have more services than max configured')
-                servicesPools.append((sp, inCacheL1, inCacheL2, inAssigned))
-                continue
+                candidates.append((0, 0, values))
             # We have more in L1 cache than needed
-            if totalL1Assigned > sp.initial_srvs and inCacheL1 > sp.cache_l1_srvs:
+            elif totalL1Assigned > sp.initial_srvs and inCacheL1 > sp.cache_l1_srvs:
                 logger.debug('We have more services in cache L1 than configured')
-                servicesPools.append((sp, inCacheL1, inCacheL2, inAssigned))
-                continue
-
-            # If we have more in L2 cache than needed, decrease L2 cache, but int this case, we continue checking cause L2 cache removal
-            # has less priority than l1 creations or removals, but higher. In this case, we will simply take last l2 oversized found and reduce it
-            if inCacheL2 > sp.cache_l2_srvs:
+                candidates.append((1, 0, values))
+            # If we have more in L2 cache than needed, decrease L2 cache
+            elif inCacheL2 > sp.cache_l2_srvs:
                 logger.debug('We have more services in L2 cache than configured, decreasing it')
-                servicesPools.append((sp, inCacheL1, inCacheL2, inAssigned))
-                continue
-
-            # If this service don't allows more starting user services, continue
-            if UserServiceManager.manager().canInitiateServiceFromDeployedService(sp) is False:
-                logger.debug('This provider has the max allowed starting services running: {0}'.format(sp))
-                continue
-
+                candidates.append((2, 0, values))
             # If wee need to grow l2 cache, annotate it
             # Whe check this before checking the total, because the l2 cache is independent of max services or l1 cache.
             # It reflects a value that must be keeped in cache for futre fast use.
-            if inCacheL2 < sp.cache_l2_srvs:
+            elif inCacheL2 < sp.cache_l2_srvs:
                 logger.debug('Needs to grow L2 cache for {}'.format(sp))
-                servicesPools.append((sp, inCacheL1, inCacheL2, inAssigned))
-                continue
-
+                candidates.append((4, self.calcProportion(sp.cache_l2_srvs, inCacheL2), values))
             # We skip it if already at max
-            if totalL1Assigned == sp.max_srvs:
-                continue
-
-            if totalL1Assigned < sp.initial_srvs or inCacheL1 < sp.cache_l1_srvs:
+            elif totalL1Assigned < sp.max_srvs and (totalL1Assigned < sp.initial_srvs or inCacheL1 < sp.cache_l1_srvs):
                 logger.debug('Needs to grow L1 cache for {}'.format(sp))
-                servicesPools.append((sp, inCacheL1, inCacheL2, inAssigned))
+                candidates.append((3, self.calcProportion(max(sp.initial_srvs - inAssigned, sp.cache_l1_srvs), inCacheL1), values))
+
+        servicesPools = []
+        for priority, _, values in sorted(candidates, key=lambda x: x[:2]):
+            if priority >= 3:  # Growths needs to start a new service on provider
+                sp = values[0]
+                available = providerCanStart(sp)
+                if available == 0:
+                    logger.debug('This provider has the max allowed starting services running: {0}'.format(sp))
+                    continue
+                if available > 0:
+                    canStart[sp.service.provider_id] = available - 1
+            servicesPools.append(values)
 
         # We also return calculated values so we can reuse then
         return servicesPools
 
     def growL1Cache(self, sp, cacheL1, cacheL2, assigned):
         """
-        This method tries to enlarge L1 cache.
+        This method tries to enlarge L1 cache, creating at once all services needed
 
         If for some reason the number of deployed services (Counting all, ACTIVE
         and PREPARING, assigned, L1 and L2) is over max allowed service deployments,
@@ -173,8 +216,11 @@ class ServiceCacheUpdater(Job):
             if valid is not None:
                 valid.moveToLevel(services.UserDeployment.L1_CACHE)
                 return
+        # All needed elements are requested at once (createCacheForMany limits them to provider max preparing services)
+        totalL1Assigned = cacheL1 + assigned
+        needed = min(max(sp.initial_srvs - totalL1Assigned, sp.cache_l1_srvs - cacheL1, 1), sp.max_srvs - totalL1Assigned)
         try:
-            UserServiceManager.manager().createCacheFor(sp.activePublication(), services.UserDeployment.L1_CACHE)
+            UserServiceManager.manager().createCacheForMany(sp.activePublication(), services.UserDeployment.L1_CACHE, needed)
         except MaxServicesReachedError as e:
             log.doLog(sp, log.ERROR, 'Max number of services reached for this service', log.INTERNAL)
             logger.error(str(e))
@@ -183,7 +229,7 @@ class ServiceCacheUpdater(Job):
 
     def growL2Cache(self, sp, cacheL1, cacheL2, assigned):
         """
-        Tries to grow L2 cache of service.
+        Tries to grow L2 cache of service, creating at once all services needed
 
         If for some reason the number of deployed services (Counting all, ACTIVE
         and PREPARING, assigned, L1 and L2) is over max allowed service deployments,
@@ -191,7 +237,7 @@ class ServiceCacheUpdater(Job):
         """
         logger.debug("Growing L2 cache creating a new service for {0}".format(sp))
         try:
-            UserServiceManager.manager().createCacheFor(sp.activePublication(), services.UserDeployment.L2_CACHE)
+            UserServiceManager.manager().createCacheForMany(sp.activePublication(), services.UserDeployment.L2_CACHE, sp.cache_l2_srvs - cacheL2)
         except MaxServicesReachedError as e:
             logger.error(str(e))
             # TODO: When alerts are ready, notify this
@@ -230,30 +276,60 @@ class ServiceCacheUpdater(Job):
             cache = cacheItems[0]
             cache.removeOrCancel()
 
+    def updateCache(self, sp, cacheL1, cacheL2, assigned):
+        """
+        Executes the action needed by a service pool cache
+        """
+        # We have cache to update??
+        logger.debug("Updating cache for {0}".format(sp))
+        totalL1Assigned = cacheL1 + assigned
+
+        # We try first to reduce cache before tring to increase it.
+        # This means that if there is excesive number of user deployments
+        # for L1 or L2 cache, this will be reduced untill they have good numbers.
+        # This is so because service can have limited the number of services and,
+        # if we try to increase cache before having reduced whatever needed
+        # first, the service will get lock until someone removes something.
+        if totalL1Assigned > sp.max_srvs:
+            self.reduceL1Cache(sp, cacheL1, cacheL2, assigned)
+        elif totalL1Assigned > sp.initial_srvs and cacheL1 > sp.cache_l1_srvs:
+            self.reduceL1Cache(sp, cacheL1, cacheL2, assigned)
+        elif cacheL2 > sp.cache_l2_srvs:  # We have excesives L2 items
+            self.reduceL2Cache(sp, cacheL1, cacheL2, assigned)
+        elif totalL1Assigned < sp.max_srvs and (totalL1Assigned < sp.initial_srvs or cacheL1 < sp.cache_l1_srvs):  # We need more services
+            self.growL1Cache(sp, cacheL1, cacheL2, assigned)
+        elif cacheL2 < sp.cache_l2_srvs:  # We need more L2 items
+            self.growL2Cache(sp, cacheL1, cacheL2, assigned)
+        else:
+            logger.info("We have more services than max requested for {0}, but can't erase any of then cause all of them are already assigned".format(sp))
+
+    def updateProviderCaches(self, servicesPools):
+        """
+        Executes, in order, the actions needed by service pools of a provider
+        """
+        for values in servicesPools:
+            try:
+                self.updateCache(*values)
+            except Exception:
+                logger.exception('Updating cache for {}'.format(values[0]))
+
     def run(self):
         logger.debug('Starting cache checking')
         # We need to get
         servicesThatNeedsUpdate = self.servicesPoolsNeedingCacheUpdate()
-        for sp, cacheL1, cacheL2, assigned in servicesThatNeedsUpdate:
-            # We have cache to update??
-            logger.debug("Updating cache for {0}".format(sp))
-            totalL1Assigned = cacheL1 + assigned
-
-            # We try first to reduce cache before tring to increase it.
-            # This means that if there is excesive number of user deployments
-            # for L1 or L2 cache, this will be reduced untill they have good numbers.
-            # This is so because service can have limited the number of services and,
-            # if we try to increase cache before having reduced whatever needed
-            # first, the service will get lock until someone removes something.
-            if totalL1Assigned > sp.max_srvs:
-                self.reduceL1Cache(sp, cacheL1, cacheL2, assigned)
-            elif totalL1Assigned > sp.initial_srvs and cacheL1 > sp.cache_l1_srvs:
-                self.reduceL1Cache(sp, cacheL1, cacheL2, assigned)
-            elif cacheL2 > sp.cache_l2_srvs:  # We have excesives L2 items
-                self.reduceL2Cache(sp, cacheL1, cacheL2, assigned)
-            elif totalL1Assigned < sp.max_srvs and (totalL1Assigned < sp.initial_srvs or cacheL1 < sp.cache_l1_srvs):  # We need more services
-                self.growL1Cache(sp, cacheL1, cacheL2, assigned)
-            elif cacheL2 < sp.cache_l2_srvs:  # We need more L2 items
-                self.growL2Cache(sp, cacheL1, cacheL2, assigned)
-            else:
-                logger.info("We have more services than max requested for {0}, but can't erase any of then cause all of them are already assigned".format(sp))
+        if not servicesThatNeedsUpdate:
+            return
+
+        # Actions of each provider are executed in priority order, but different providers are updated concurrently
+        byProvider = collections.OrderedDict()
+        for values in servicesThatNeedsUpdate:
+            byProvider.setdefault(values[0].service.provider_id, []).append(values)
+
+        if len(byProvider) == 1:
+            self.updateProviderCaches(servicesThatNeedsUpdate)
+            return
+
+        pool = ExecutionPool('CacheUpdater', min(len(byProvider), self.maxProvidersAtOnce), queueSize=len(byProvider))
+        for providerId, servicesPools in six.iteritems(byProvider):
+            pool.submit(providerId, 1, self.updateProviderCaches, servicesPools)
+        pool.shutdown()
@@ -33,6 +33,8 @@
 from __future__ import unicode_literals
 
 from uds.core.util.Cache import Cache
+from uds.core.util.UniqueIDGenerator import UniqueIDGenerator
+from uds.core.managers import reportsManager
 from uds.core.jobs.Job import Job
 from uds.models import TicketStore
 from django.conf import settings
@@ -93,3 +95,31 @@ class SessionsCleaner(Job):
             pass  # No problem if no cleanup
 
         logger.debug('Done session cleanup')
+
+
+class UniqueIDLeasesCleaner(Job):
+
+    frecuency = 3607  # Once an hour
+    friendly_name = 'Unique IDs leases cleaner'
+
+    def __init__(self, environment):
+        super(UniqueIDLeasesCleaner, self).__init__(environment)
+
+    def run(self):
+        logger.debug('Starting unique ids leases cleanup')
+        UniqueIDGenerator.releaseStaleLeases()
+        logger.debug('Done unique ids leases cleanup')
+
+
+class ReportsCacheCleaner(Job):
+
+    frecuency = 601  # Every ten minutes
+    friendly_name = 'Generated reports cleaner'
+
+    def __init__(self, environment):
+        super(ReportsCacheCleaner, self).__init__(environment)
+
+    def run(self):
+        logger.debug('Starting generated reports cleanup')
+        reportsManager().cleanup()
+        logger.debug('Done generated reports cleanup')
@@ -58,7 +58,7 @@ class UserServiceInfoItemsCleaner(Job):
         super(UserServiceInfoItemsCleaner, self).__init__(environment)
 
     def run(self):
-        removeFrom = getSqlDatetime() - timedelta(seconds=GlobalConfig.KEEP_INFO_TIME.getInt(True))
+        removeFrom = getSqlDatetime() - timedelta(seconds=GlobalConfig.KEEP_INFO_TIME.getInt())
         logger.debug('Removing information user services from {0}'.format(removeFrom))
         with transaction.atomic():
             UserService.objects.select_for_update().filter(state__in=State.INFO_STATES, state_date__lt=removeFrom).delete()
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) 2018 Virtual Cable S.L.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#    * Neither the name of Virtual Cable S.L. nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+@author: Adolfo Gómez, dkmaster at dkmon dot com
+"""
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.utils.translation import ugettext_lazy as _
+
+from uds.REST import processors
+from uds.core.util.State import State
+
+import datetime
+import json
+import timeit
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def servicePoolItem(n):
+    """
+    Something like ServicesPools.item_as_dict returns
+    """
+    return {
+        'id': 'c6f8ddb5-7c0f-5b4c-8b1b-{:012d}'.format(n),
+        'name': 'Service pool {}'.format(n),
+        'short_name': 'Pool {}'.format(n),
+        'tags': ['tag1', 'tag{}'.format(n % 10)],
+        'parent': 'Base service',
+        'parent_type': 'oVirtLinkedService',
+        'comments': 'Service pool used for benchmarking rendering',
+        'state': State.ACTIVE,
+        'thumb': 'iVBORw0KGgoAAAANSUhEUgAAACAAAAAgCAYAAABzenr0AAAA' * 20,
+        'account': '',
+        'account_id': None,
+        'service_id': '7a6a2e1c-0b2f-5b8e-9a1b-{:012d}'.format(n),
+        'provider_id': '4b27a6b1-0c1f-5d3c-8e2a-{:012d}'.format(n),
+        'image_id': None,
+        'initial_srvs': 2,
+        'cache_l1_srvs': 4,
+        'cache_l2_srvs': 0,
+        'max_srvs': 100,
+        'show_transports': True,
+        'visible': True,
+        'allow_users_remove': False,
+        'allow_users_reset': False,
+        'ignores_unused': False,
+        'fallbackAccess': 'ALLOW',
+        'user_services_count': n % 100,
+        'user_services_in_preparation': n % 3,
+        'restrained': False,
+        'permission': 96,
+        'info': {
+            'icon': 'iVBORw0KGgoAAAANSUhEUgAAABAAAAAQ' * 10,
+            'needs_publication': True,
+            'max_deployed': -1,
+            'uses_cache': True,
+            'uses_cache_l2': True,
+            'cache_tooltip': _('Number of desired machines to keep running waiting for a user'),
+            'cache_tooltip_l2': _('Number of desired machines to keep suspended waiting for use'),
+            'needs_manager': True,
+            'allowedProtocols': ('rdp', 'spice'),
+            'servicesTypeProvided': ['vdi'],
+            'must_assign_manually': False,
+            'can_reset': True,
+        },
+        'servicesPoolGroup_id': None,
+        'pool_group_name': _('Default'),
+        'pool_group_thumb': 'iVBORw0KGgoAAAANSUhEUgAAACAAAAAg' * 20,
+    }
+
+
+def userServiceItem(n):
+    """
+    Something like AssignedService.itemToDict returns
+    """
+    now = datetime.datetime.now()
+    return {
+        'id': 'f1e2d3c4-b5a6-5978-8a9b-{:012d}'.format(n),
+        'id_deployed_service': 'c6f8ddb5-7c0f-5b4c-8b1b-000000000001',
+        'unique_id': '00:1a:4a:16:{:02x}:{:02x}'.format(n // 256 % 256, n % 256),
+        'friendly_name': 'vm-{}'.format(n),
+        'state': State.USABLE,
+        'os_state': State.USABLE,
+        'state_date': now,
+        'creation_date': now,
+        'revision': 3,
+        'ip': '10.0.{}.{}'.format(n // 256 % 256, n % 256),
+        'actor_version': '2.2.0',
+        'owner': 'user{}@Internal'.format(n),
+        'owner_info': {'auth_id': 'a1b2c3d4-0000-5000-8000-000000000001', 'user_id': 'u{}'.format(n)},
+        'in_use': n % 2 == 0,
+        'in_use_date': now,
+        'source_host': 'client-{}'.format(n),
+        'source_ip': '192.168.{}.{}'.format(n // 256 % 256, n % 256),
+    }
+
+
+class Command(BaseCommand):
+    help = "Measures the time needed to render REST listings (service pools and user services) to json"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=1000, help='Number of items on each listing')
+        parser.add_argument('--repeat', type=int, default=10, help='Times each listing is rendered')
+
+    def handle(self, *args, **options):
+        items, repeat = options['items'], options['repeat']
+        processor = processors.JsonProcessor(None)
+
+        for name, builder in (('service pools', servicePoolItem), ('user services', userServiceItem)):
+            data = [builder(i) for i in range(items)]
+
+            # Both must render the same contents
+            if json.loads(processor.render(data)) != json.loads(json.dumps(processors.ContentProcessor.procesForRender(data))):
+                self.stderr.write('Rendered contents of {} differ!'.format(name))
+
+            results = (
+                ('previous (procesForRender + dumps)', lambda: json.dumps(processors.ContentProcessor.procesForRender(data))),
+                ('single pass{}'.format(' (orjson)' if processors.orjson is not None else ''), lambda: processor.render(data)),
+                ('streamed', lambda: ''.join(processor.renderStream(iter(data)))),
+            )
+            self.stdout.write('Rendering {} {} {} times'.format(items, name, repeat))
+            for desc, fnc in results:
+                elapsed = timeit.timeit(fnc, number=repeat)
+                self.stdout.write('  {:40} {:8.2f} ms per listing'.format(desc, elapsed * 1000 / repeat))
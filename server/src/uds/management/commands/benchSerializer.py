@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) 2018 Virtual Cable S.L.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#    * Neither the name of Virtual Cable S.L. nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+@author: Adolfo Gómez, dkmaster at dkmon dot com
+"""
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from uds.core.Environment import Environment
+from uds.core.ui.UserInterface import gui, UserInterface
+from uds.core.util import encoders
+from uds.services.PhysicalMachines.IPMachineDeployed import IPMachineDeployed
+
+import pickle
+import timeit
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class BenchForm(UserInterface):
+    """
+    Something like a service provider form
+    """
+    host = gui.TextField(order=1, label='Host')
+    port = gui.NumericField(order=2, label='Port', defvalue='443')
+    username = gui.TextField(order=3, label='Username')
+    password = gui.PasswordField(order=4, label='Password')
+    secure = gui.CheckBoxField(order=5, label='Secure')
+    groups = gui.MultiChoiceField(order=6, label='Groups')
+    macs = gui.EditableList(order=7, label='Macs')
+
+
+def legacyMarshal(deployment):
+    """
+    Previous AutoAttributes marshal (pickled attributes + bz2)
+    """
+    return encoders.encode(b'\2'.join([b'%s\1%s' % (k.encode('utf8'), pickle.dumps(v)) for k, v in deployment.dict.items()]), 'bz2')
+
+
+def legacySerializeForm(form):
+    """
+    Previous UserInterface.serializeForm (pickled lists + zlib)
+    """
+    arr = []
+    for k, v in form._gui.items():
+        if v.isType(gui.InputField.EDITABLE_LIST) or v.isType(gui.InputField.MULTI_CHOICE_TYPE):
+            val = b'\001' + pickle.dumps(v.value, protocol=0)
+        else:
+            val = (gui.TRUE if v.value is True else gui.FALSE if v.value is False else v.value).encode('utf8')
+        arr.append(k.encode('utf8') + b'\003' + val)
+    return encoders.encode(b'\002'.join(arr), 'zip')
+
+
+class Command(BaseCommand):
+    help = "Measures marshal & unmarshal cost of user deployments and modules forms, with previous and current formats"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=10000, help='Times each payload is marshaled & unmarshaled')
+
+    def measure(self, name, data, marshal, unmarshal, repeat):
+        self.stdout.write('  {:25} {:5d} bytes, marshal {:8.2f} us, unmarshal {:8.2f} us'.format(
+            name,
+            len(data),
+            timeit.timeit(marshal, number=repeat) * 1000000 / repeat,
+            timeit.timeit(lambda: unmarshal(data), number=repeat) * 1000000 / repeat
+        ))
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+
+        deployment = IPMachineDeployed(Environment.getTempEnv(), service=None)
+        deployment._ip, deployment._reason, deployment._state = '172.27.0.101~3389', '', 'U'
+        target = IPMachineDeployed(Environment.getTempEnv(), service=None)
+
+        self.stdout.write('User deployment (IPMachineDeployed)')
+        self.measure('previous (pickle + bz2)', legacyMarshal(deployment), lambda: legacyMarshal(deployment), target.unmarshal, repeat)
+        self.measure('current', deployment.marshal(), deployment.marshal, target.unmarshal, repeat)
+        target.unmarshal(deployment.marshal())
+        if target._ip != deployment._ip:
+            self.stderr.write('Unmarshaled deployment differs!')
+
+        form = BenchForm({
+            'host': 'ovirt.domain.local', 'port': '443', 'username': 'admin@internal', 'password': 'secret', 'secure': True,
+            'groups': ['Administrators', 'Operators', 'Users'], 'macs': ['00:1a:4a:16:01:{:02x}'.format(i) for i in range(16)]
+        })
+        targetForm = BenchForm()
+
+        self.stdout.write('Module form')
+        self.measure('previous (pickle + zlib)', legacySerializeForm(form), lambda: legacySerializeForm(form), targetForm.unserializeForm, repeat)
+        self.measure('current', form.serializeForm(), form.serializeForm, targetForm.unserializeForm, repeat)
+        targetForm.unserializeForm(form.serializeForm())
+        if targetForm.valuesDict() != form.valuesDict():
+            self.stderr.write('Unserialized form differs!')
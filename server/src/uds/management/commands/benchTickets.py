@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) 2018 Virtual Cable S.L.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#    * Neither the name of Virtual Cable S.L. nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+@author: Adolfo Gómez, dkmaster at dkmon dot com
+"""
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from uds.models import TicketStore
+
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def ticketData(n):
+    """
+    Something like an html5 transport ticket
+    """
+    return {
+        'protocol': 'rdp',
+        'hostname': '10.0.{}.{}'.format(n // 256 % 256, n % 256),
+        'username': 'user{}'.format(n),
+        'password': 'Zm9vYmFyYmF6{}'.format(n),
+        'domain': 'domain.local',
+        'security': 'any',
+        'enable-drive': 'true',
+        'create-drive-path': 'true',
+        'ignore-cert': 'true',
+        'resize-method': 'display-update',
+    }
+
+
+class Command(BaseCommand):
+    help = "Measures tickets issued, consumed and cleaned up per second (creates and removes benchmark tickets)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tickets', type=int, default=10000, help='Number of tickets issued')
+        parser.add_argument('--target', type=int, default=10000, help='Desired tickets issued per second')
+
+    def rate(self, desc, number, elapsed):
+        self.stdout.write('  {:30} {:10.0f} per second ({:.2f} ms each)'.format(desc, number / elapsed, elapsed * 1000 / number))
+        return number / elapsed
+
+    def handle(self, *args, **options):
+        number = options['tickets']
+        data = [ticketData(i) for i in range(number)]
+
+        self.stdout.write('{} tickets, shared cache: {}'.format(number, 'yes' if TicketStore.sharedCache() is not None else 'no'))
+
+        start = time.time()
+        tickets = [TicketStore.create(d, validity=1) for d in data]
+        issued = self.rate('issued', number, time.time() - start)
+
+        start = time.time()
+        for t in tickets[:number // 2]:
+            TicketStore.get(t, invalidate=False)
+        self.rate('readed', number // 2, time.time() - start)
+
+        start = time.time()
+        for t in tickets[number // 2:]:
+            TicketStore.get(t)
+        self.rate('consumed', number - number // 2, time.time() - start)
+
+        # Let them expire, and measure the cleanup of database ones
+        time.sleep(1.1)
+        start = time.time()
+        TicketStore.cleanup()
+        self.stdout.write('  {:30} {:10.2f} ms'.format('cleanup', (time.time() - start) * 1000))
+
+        if issued < options['target']:
+            self.stderr.write('Tickets issued per second ({:.0f}) below target ({})'.format(issued, options['target']))
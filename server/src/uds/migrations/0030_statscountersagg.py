@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+INTERVALS = ((0, 3600), (1, 86400))  # Hourly and daily rollups
+
+
+# noinspection PyUnusedLocal
+def create_rollups(apps, schema_editor):
+    """
+    Computes rollups of already stored counters
+    """
+    StatsCounters = apps.get_model('uds', 'StatsCounters')
+    StatsCountersAgg = apps.get_model('uds', 'StatsCountersAgg')
+
+    pending = []
+    rollups = {}
+    series = None
+
+    def store(rollups):
+        pending.extend(StatsCountersAgg(owner_type=k[0], owner_id=k[1], counter_type=k[2], interval_type=k[3], stamp=k[4], **v) for k, v in rollups.items())
+        if len(pending) >= 1000:
+            StatsCountersAgg.objects.bulk_create(pending)
+            del pending[:]
+
+    counters = StatsCounters.objects.order_by('owner_type', 'owner_id', 'counter_type', 'stamp').values_list('owner_type', 'owner_id', 'counter_type', 'stamp', 'value')
+    for ownerType, ownerId, counterType, stamp, value in counters.iterator():
+        if series != (ownerType, ownerId, counterType):  # Counters are sorted, so previous series is complete
+            store(rollups)
+            rollups = {}
+            series = (ownerType, ownerId, counterType)
+
+        for intervalType, length in INTERVALS:
+            key = (ownerType, ownerId, counterType, intervalType, stamp - stamp % length)
+            agg = rollups.get(key)
+            if agg is None:
+                rollups[key] = {'samples': 1, 'total': value, 'value_min': value, 'value_max': value, 'value_last': value, 'last_stamp': stamp}
+            else:
+                agg['samples'] += 1
+                agg['total'] += value
+                agg['value_min'] = min(agg['value_min'], value)
+                agg['value_max'] = max(agg['value_max'], value)
+                agg['value_last'], agg['last_stamp'] = value, stamp
+
+    store(rollups)
+    StatsCountersAgg.objects.bulk_create(pending)
+
+
+# noinspection PyUnusedLocal
+def remove_rollups(apps, schema_editor):
+    """
+    Dummy function. Rollups table will be dropped on reverse migration
+    """
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uds', '0029_auto_20181003_1049'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatsCountersAgg',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('owner_id', models.IntegerField(default=0)),
+                ('owner_type', models.SmallIntegerField(default=0)),
+                ('counter_type', models.SmallIntegerField(default=0)),
+                ('interval_type', models.SmallIntegerField(default=0)),
+                ('stamp', models.IntegerField(db_index=True, default=0)),
+                ('samples', models.IntegerField(default=0)),
+                ('total', models.BigIntegerField(default=0)),
+                ('value_min', models.IntegerField(default=0)),
+                ('value_max', models.IntegerField(default=0)),
+                ('value_last', models.IntegerField(default=0)),
+                ('last_stamp', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'uds_stats_c_agg',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='statscountersagg',
+            unique_together={('owner_type', 'counter_type', 'interval_type', 'owner_id', 'stamp')},
+        ),
+        migrations.RunPython(
+            create_rollups,
+            remove_rollups
+        ),
+    ]
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+import datetime
+
+
+# noinspection PyUnusedLocal
+def fill_expiration(apps, schema_editor):
+    """
+    Sets expiration of already stored tickets
+    """
+    TicketStore = apps.get_model('uds', 'TicketStore')
+    for t in TicketStore.objects.only('id', 'stamp', 'validity'):
+        TicketStore.objects.filter(pk=t.pk).update(expires_at=t.stamp + datetime.timedelta(seconds=t.validity))
+
+
+# noinspection PyUnusedLocal
+def remove_expiration(apps, schema_editor):
+    """
+    Dummy function. Column will be dropped on reverse migration
+    """
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uds', '0030_statscountersagg'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticketstore',
+            name='expires_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(
+            fill_expiration,
+            remove_expiration
+        ),
+        migrations.AlterField(
+            model_name='ticketstore',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
@@ -35,11 +35,12 @@ from __future__ import unicode_literals
 
 from django.db import models
 from uds.core.Environment import Environment
+from uds.core.util.InstanceCache import InstanceCache
 from uds.models.UUIDModel import UUIDModel
 
 import logging
 
-__updated__ = '2018-06-12'
+__updated__ = '2018-10-18'
 
 logger = logging.getLogger(__name__)
 
@@ -80,7 +81,14 @@ class ManagedObjectModel(UUIDModel):
 
         self._cachedInstance = None  # Ensures returns correct value on getInstance
 
-    def getInstance(self, values=None):
+    def instanceVersion(self):
+        """
+        Returns what the instance is built from, so a (shared) cached instance is used only while it does not change
+        Must be extended if the instance depends on other objects
+        """
+        return (self.data_type, self.data)
+
+    def getInstance(self, values=None, shared=False):
         """
         Instantiates the object this record contains.
 
@@ -89,6 +97,9 @@ class ManagedObjectModel(UUIDModel):
         Args:
            values (list): Values to pass to constructor. If no values are especified,
                           the object is instantiated empty and them de-serialized from stored data.
+           shared: If True (and no values are especified), the instance is shared with other readers of this record on
+                   this process, on any thread (see InstanceCache). Only for read only uses (configuration values, flags, ...),
+                   never to modify it nor to access services/providers apis, as their clients are not shared safely.
 
         Returns:
             The instance Instance of the class this provider represents
@@ -99,15 +110,29 @@ class ManagedObjectModel(UUIDModel):
             # logger.debug('Got cached instance instead of deserializing a new one for {}'.format(self.name))
             return self._cachedInstance
 
-        klass = self.getType()
-        env = self.getEnvironment()
-        obj = klass(env, values)
+        if shared and values is None:
+            version = self.instanceVersion()
+            obj = InstanceCache.get(self, version)
+            if obj is None:
+                obj = self.newInstance(None, True)
+                self.deserialize(obj, None)
+                InstanceCache.put(self, version, obj)
+            return obj
+
+        obj = self.newInstance(values)
         self.deserialize(obj, values)
 
         self._cachedInstance = obj
 
         return obj
 
+    def newInstance(self, values, shared=False):
+        """
+        Creates (not unserialized yet) the instance of the object this record contains
+        shared indicates that instances it depends on can be shared ones
+        """
+        return self.getType()(self.getEnvironment(), values)
+
     def getType(self):
         """
         Returns the type of self (as python type)
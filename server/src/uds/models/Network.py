@@ -33,7 +33,7 @@
 
 from __future__ import unicode_literals
 
-__updated__ = '2016-02-10'
+__updated__ = '2018-10-18'
 
 from django.db import models
 from django.db.models import signals
@@ -41,6 +41,7 @@ from django.utils.encoding import python_2_unicode_compatible
 
 from uds.models.Transport import Transport
 from uds.core.util import net
+from uds.core.util.NetworksIndex import NetworksIndex
 from uds.models.UUIDModel import UUIDModel
 from uds.models.Tag import TaggingMixin
 
@@ -71,10 +72,20 @@ class Network(UUIDModel, TaggingMixin):
     @staticmethod
     def networksFor(ip):
         """
-        Returns the networks that are valid for specified ip in dotted quad (xxx.xxx.xxx.xxx)
+        Returns the networks that are valid for specified ip in dotted quad (xxx.xxx.xxx.xxx) or IPv6 format
         """
-        ip = net.ipToLong(ip)
-        return Network.objects.filter(net_start__lte=ip, net_end__gte=ip)
+        return Network.objects.filter(id__in=NetworksIndex.index().networksFor(ip))
+
+    @staticmethod
+    def dbRange(netRange):
+        """
+        Returns the (start, end) of a network range (as returned by net.networksFromString) that will be stored on database.
+        Only IPv4 values fits on database fields, IPv6 networks are resolved from net_string (look at NetworksIndex)
+        """
+        start, end = netRange
+        if start > net.MAX_IPV4:
+            return -1, -1
+        return start, min(end, net.MAX_IPV4)
 
     @staticmethod
     def create(name, netRange):
@@ -86,9 +97,20 @@ class Network(UUIDModel, TaggingMixin):
 
             netEnd: Network end
         """
-        nr = net.networksFromString(netRange, False)
+        nr = Network.dbRange(net.networksFromString(netRange, False))
         return Network.objects.create(name=name, net_start=nr[0], net_end=nr[1], net_string=netRange)
 
+    def range(self):
+        """
+        Returns the (start, end) of this network, IPv6 networks included
+        """
+        if self.net_string:
+            try:
+                return net.networksFromString(self.net_string, False)
+            except ValueError:
+                pass
+        return self.net_start, self.net_end
+
     @property
     def netStart(self):
         """
@@ -97,7 +119,7 @@ class Network(UUIDModel, TaggingMixin):
         Returns:
             string representing the dotted quad of this network start
         """
-        return net.longToIp(self.net_start)
+        return net.longToIp(self.range()[0])
 
     @property
     def netEnd(self):
@@ -107,7 +129,7 @@ class Network(UUIDModel, TaggingMixin):
         Returns:
             string representing the dotted quad of this network end
         """
-        return net.longToIp(self.net_end)
+        return net.longToIp(self.range()[1])
 
     def update(self, name, netRange):
         """
@@ -121,14 +143,14 @@ class Network(UUIDModel, TaggingMixin):
             netEnd: new Network end (quad dotted)
         """
         self.name = name
-        nr = net.networksFromString(netRange, False)
+        nr = Network.dbRange(net.networksFromString(netRange, False))
         self.net_start = nr[0]
         self.net_end = nr[1]
         self.net_string = netRange
         self.save()
 
     def __str__(self):
-        return u'Network {0} ({1}) from {2} to {3}'.format(self.name, self.net_string, net.longToIp(self.net_start), net.longToIp(self.net_end))
+        return u'Network {0} ({1}) from {2} to {3}'.format(self.name, self.net_string, self.netStart, self.netEnd)
 
     @staticmethod
     def beforeDelete(sender, **kwargs):
@@ -142,3 +164,8 @@ class Network(UUIDModel, TaggingMixin):
 
 # Connects a pre deletion signal to Authenticator
 signals.pre_delete.connect(Network.beforeDelete, sender=Network)
+
+# Networks index must be rebuilt on any change
+signals.post_save.connect(NetworksIndex.invalidate, sender=Network)
+signals.post_delete.connect(NetworksIndex.invalidate, sender=Network)
+signals.m2m_changed.connect(NetworksIndex.invalidate, sender=Network.transports.through)
@@ -50,7 +50,7 @@ from uds.models.Provider import Provider
 import logging
 import six
 
-__updated__ = '2018-06-12'
+__updated__ = '2018-10-18'
 
 logger = logging.getLogger(__name__)
 
@@ -93,34 +93,16 @@ class Service(ManagedObjectModel, TaggingMixin):
             }
         )
 
-    def getInstance(self, values=None):
+    def instanceVersion(self):
         """
-        Instantiates the object this record contains.
-
-        Every single record of Provider model, represents an object.
-
-        Args:
-           values (list): Values to pass to constructor. If no values are especified,
-                          the object is instantiated empty and them de-serialized from stored data.
-
-        Returns:
-            The instance Instance of the class this provider represents
-
-        Raises:
+        Service instances are built using provider instance, so they are valid while provider is the same too
         """
-        if self._cachedInstance is not None and values is None:
-            # logger.debug('Got cached instance instead of deserializing a new one for {}'.format(self.name))
-            return self._cachedInstance
+        return super(Service, self).instanceVersion() + self.provider.instanceVersion()
 
-        prov = self.provider.getInstance()
+    def newInstance(self, values, shared=False):
+        prov = self.provider.getInstance(shared=shared)
         sType = prov.getServiceByType(self.data_type)
-        env = self.getEnvironment()
-        obj = sType(env, prov, values)
-        self.deserialize(obj, values)
-
-        self._cachedInstance = obj
-
-        return obj
+        return sType(self.getEnvironment(), prov, values)
 
     def getType(self):
         """
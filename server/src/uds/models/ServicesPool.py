@@ -63,7 +63,7 @@ import logging
 import pickle
 import six
 
-__updated__ = '2018-10-01'
+__updated__ = '2018-10-18'
 
 logger = logging.getLogger(__name__)
 
@@ -200,12 +200,27 @@ class DeployedService(UUIDModel, TaggingMixin):
         if GlobalConfig.RESTRAINT_TIME.getInt() <= 0:
             return False  # Do not perform any restraint check if we set the globalconfig to 0 (or less)
 
-        date = getSqlDatetime() - timedelta(seconds=GlobalConfig.RESTRAINT_TIME.getInt())
-        if self.userServices.filter(state=states.userService.ERROR, state_date__gt=date).count() >= GlobalConfig.RESTRAINT_COUNT.getInt():
+        errors = getattr(self, 'restrained_errors', None)  # If annotated with restrainedErrorsAnnotation
+        if errors is None:
+            date = getSqlDatetime() - timedelta(seconds=GlobalConfig.RESTRAINT_TIME.getInt())
+            errors = self.userServices.filter(state=states.userService.ERROR, state_date__gt=date).count()
+
+        if errors >= GlobalConfig.RESTRAINT_COUNT.getInt():
             return True
 
         return False
 
+    @staticmethod
+    def restrainedErrorsAnnotation():
+        """
+        Returns an expression that, annotated as "restrained_errors" on a queryset, allows isRestrained
+        to be checked without an additional query per service pool
+        """
+        from uds.core.util.Config import GlobalConfig
+
+        date = getSqlDatetime() - timedelta(seconds=max(GlobalConfig.RESTRAINT_TIME.getInt(), 0))
+        return models.Count('userServices', filter=models.Q(userServices__state=states.userService.ERROR, userServices__state_date__gt=date))
+
     def isInMaintenance(self) -> bool:
         return self.service is not None and self.service.isInMaintenance()
 
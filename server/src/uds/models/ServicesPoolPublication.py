@@ -40,6 +40,7 @@ from django.utils.encoding import python_2_unicode_compatible
 from uds.core.util.State import State
 from uds.core.Environment import Environment
 from uds.core.util import log
+from uds.core.util.InstanceCache import InstanceCache
 
 from uds.models.ServicesPool import DeployedService
 from uds.models.Util import getSqlDatetime
@@ -47,7 +48,7 @@ from uds.models.UUIDModel import UUIDModel
 
 import logging
 
-__updated__ = '2018-06-07'
+__updated__ = '2018-10-18'
 
 logger = logging.getLogger(__name__)
 
@@ -105,25 +106,39 @@ class DeployedServicePublication(UUIDModel):
         """
         return Environment.getEnvForTableElement(self._meta.verbose_name, self.id)
 
-    def getInstance(self):
+    def instanceVersion(self):
+        """
+        Returns what the instance is built from (including service & os manager), see InstanceCache
+        """
+        ds = self.deployed_service
+        osManager = ds.osmanager
+        return (self.data, self.revision, ds.name) + ds.service.instanceVersion() + (osManager.instanceVersion() if osManager is not None else ())
+
+    def getInstance(self, shared=False):
         """
         Instantiates the object this record contains.
 
         Every single record of Provider model, represents an object.
 
         Args:
-           values (list): Values to pass to constructor. If no values are especified,
-                          the object is instantiated empty and them de-serialized from stored data.
+           shared: If True, instance can be shared with other readers of this publication (see InstanceCache),
+                   so it must not be modified. Used where publication is only readed, as on user services instances
 
         Returns:
             The instance Instance of the class this provider represents
 
         Raises:
         """
-        serviceInstance = self.deployed_service.service.getInstance()
+        if shared:
+            version = self.instanceVersion()
+            dpl = InstanceCache.get(self, version)
+            if dpl is not None:
+                return dpl
+
+        serviceInstance = self.deployed_service.service.getInstance(shared=shared)
         osManagerInstance = self.deployed_service.osmanager
         if osManagerInstance is not None:
-            osManagerInstance = osManagerInstance.getInstance()
+            osManagerInstance = osManagerInstance.getInstance(shared=shared)
         # Sanity check, so it's easier to find when we have created
         # a service that needs publication but do not have
 
@@ -137,6 +152,9 @@ class DeployedServicePublication(UUIDModel):
         # Only invokes deserialization if data has something. '' is nothing
         if self.data != '' and self.data is not None:
             dpl.unserialize(self.data)
+
+        if shared:
+            InstanceCache.put(self, version, dpl)
         return dpl
 
     def updateData(self, dsp):
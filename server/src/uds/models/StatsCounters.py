@@ -38,10 +38,11 @@ from django.db import models
 from uds.models.Util import NEVER_UNIX
 from uds.models.Util import getSqlDatetime
 from uds.models.Util import getSqlFnc
+from uds.models.StatsCountersAgg import StatsCountersAgg
 
 import logging
 
-__updated__ = '2018-02-16'
+__updated__ = '2018-10-18'
 
 logger = logging.getLogger(__name__)
 
@@ -69,23 +70,20 @@ class StatsCounters(models.Model):
         """
         Returns the average stats grouped by interval for owner_type and owner_id (optional)
 
-        Note: if someone cant get this more optimized, please, contribute it!
+        If the interval needed to return "limit" elements is at least an hour, values are computed
+        from the coarsest rollup (StatsCountersAgg) that fits, instead of from the counters table
         """
-
         filt = 'owner_type'
         if type(owner_type) in (list, tuple):
             filt += ' in (' + ','.join((str(x) for x in owner_type)) + ')'
         else:
             filt += '=' + str(owner_type)
 
-        owner_id = None
-        if kwargs.get('owner_id', None) is not None:
-            filt += ' AND OWNER_ID'
-            oid = kwargs['owner_id']
-            if type(oid) in (list, tuple):
-                filt += ' in (' + ','.join(str(x) for x in oid) + ')'
-            else:
-                filt += '=' + str(oid)
+        owner_id = kwargs.get('owner_id', None)
+        if owner_id is not None:
+            if type(owner_id) not in (list, tuple):
+                owner_id = tuple(owner_id) if hasattr(owner_id, '__iter__') else (owner_id,)
+            filt += ' AND owner_id in (' + ','.join(str(x) for x in owner_id) + ')' if owner_id else ' AND 1=0'
 
         filt += ' AND counter_type=' + str(counter_type)
 
@@ -96,40 +94,51 @@ class StatsCounters(models.Model):
         to = to and int(to) or getSqlDatetime(True)
 
         interval = 600  # By default, group items in ten minutes interval (600 seconds)
+        intervalType, length = None, 1  # Counters table by default
 
         limit = kwargs.get('limit', None)
 
         if limit is not None:
-            limit = int(limit)
-            elements = kwargs['limit']
+            elements = int(limit)
 
             # Protect for division a few lines below... :-)
             if elements < 2:
                 elements = 2
 
-            if owner_id is None:
-                q = StatsCounters.objects.filter(stamp__gte=since, stamp__lte=to)
-            else:
-                q = StatsCounters.objects.filter(owner_id=owner_id, stamp__gte=since, stamp__lte=to)
-
+            # Hourly rollup is far smaller than counters table, and has enough info to compute the interval
+            q = StatsCountersAgg.objects.filter(interval_type=StatsCountersAgg.HOUR, counter_type=counter_type, stamp__gte=since - since % 3600, stamp__lte=to)
             if type(owner_type) in (list, tuple):
                 q = q.filter(owner_type__in=owner_type)
             else:
                 q = q.filter(owner_type=owner_type)
+            if owner_id is not None:
+                q = q.filter(owner_id__in=owner_id)
 
-            if q.count() > elements:
-                first = q.order_by('stamp')[0].stamp
-                last = q.order_by('stamp').reverse()[0].stamp
-                interval = int((last - first) / (elements - 1))
+            limits = q.aggregate(samples=models.Sum('samples'), first=models.Min('stamp'), last=models.Max('last_stamp'))
 
-        stampValue = '{ceil}(stamp/{interval})'.format(ceil=getSqlFnc('CEIL'), interval=interval)
-        filt += ' AND stamp>={0} AND stamp<={1} GROUP BY {2} ORDER BY stamp'.format(since, to, stampValue)
+            if limits['samples'] is not None and limits['samples'] > elements:
+                interval = int((min(to, limits['last']) - max(since, limits['first'])) / (elements - 1))
 
-        fnc = getSqlFnc('MAX' if kwargs.get('use_max', False) else 'AVG')
+            for iType, iLength in reversed(StatsCountersAgg.INTERVALS):
+                if interval >= iLength:
+                    intervalType, length = iType, iLength
+                    interval -= interval % iLength  # Groups must contain whole rollups
+                    break
+
+        if intervalType is None:
+            table = StatsCounters._meta.db_table
+            fnc = getSqlFnc('MAX') + '(value)' if kwargs.get('use_max', False) else getSqlFnc('AVG') + '(value)'
+        else:
+            table = StatsCountersAgg._meta.db_table
+            filt += ' AND interval_type={}'.format(intervalType)
+            fnc = getSqlFnc('MAX') + '(value_max)' if kwargs.get('use_max', False) else getSqlFnc('SUM') + '(total)*1.0/' + getSqlFnc('SUM') + '(samples)'
+
+        stampValue = '{ceil}(stamp/{interval})'.format(ceil=getSqlFnc('CEIL'), interval=interval)
+        filt += ' AND stamp>={0} AND stamp<={1} GROUP BY {2} ORDER BY stamp'.format(since - since % length, to, stampValue)
 
         query = ('SELECT -1 as id,-1 as owner_id,-1 as owner_type,-1 as counter_type, ' + stampValue + '*{}'.format(interval) + ' AS stamp,' +
-                        getSqlFnc('CEIL') + '({0}(value)) AS value '
-                 'FROM {1} WHERE {2}').format(fnc, StatsCounters._meta.db_table, filt)
+                        getSqlFnc('CEIL') + '({0}) AS value '
+                 'FROM {1} WHERE {2}').format(fnc, table, filt)
 
         logger.debug('Stats query: {0}'.format(query))
 
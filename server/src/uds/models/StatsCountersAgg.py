@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) 2012 Virtual Cable S.L.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#    * Neither the name of Virtual Cable S.L. nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+.. moduleauthor:: Adolfo Gómez, dkmaster at dkmon dot com
+"""
+
+from __future__ import unicode_literals
+
+from django.db import models, connection, transaction, IntegrityError
+
+import logging
+
+__updated__ = '2018-10-18'
+
+logger = logging.getLogger(__name__)
+
+
+class StatsCountersAgg(models.Model):
+    """
+    Rollups (hourly and daily) of counter statistics, so long periods can be obtained without reading every counter.
+
+    Every record holds the aggregated values of a counter (owner_type, owner_id, counter_type) along the interval that starts
+    at "stamp", and is updated as counters are stored.
+    """
+    HOUR, DAY = range(2)
+    # Rollups and their lengths in seconds, from finer to coarser
+    INTERVALS = ((HOUR, 3600), (DAY, 86400))
+
+    owner_id = models.IntegerField(default=0)
+    owner_type = models.SmallIntegerField(default=0)
+    counter_type = models.SmallIntegerField(default=0)
+    interval_type = models.SmallIntegerField(default=HOUR)
+    stamp = models.IntegerField(db_index=True, default=0)  # Start of interval
+    samples = models.IntegerField(default=0)
+    total = models.BigIntegerField(default=0)
+    value_min = models.IntegerField(default=0)
+    value_max = models.IntegerField(default=0)
+    value_last = models.IntegerField(default=0)
+    last_stamp = models.IntegerField(default=0)  # Stamp of last counter
+
+    class Meta:
+        """
+        Meta class to declare db table
+        """
+        db_table = 'uds_stats_c_agg'
+        app_label = 'uds'
+        unique_together = (('owner_type', 'counter_type', 'interval_type', 'owner_id', 'stamp'),)
+
+    @staticmethod
+    def rollup(counters):
+        """
+        Aggregates an iterable of counters (dicts or objects with owner_type, owner_id, counter_type, stamp and value)
+
+        Returns:
+            dict of (owner_type, owner_id, counter_type, interval_type, stamp) -> unsaved StatsCountersAgg
+        """
+        result = {}
+        for c in counters:
+            if isinstance(c, dict):
+                ownerType, ownerId, counterType, stamp, value = c['owner_type'], c['owner_id'], c['counter_type'], c['stamp'], c['value']
+            else:
+                ownerType, ownerId, counterType, stamp, value = c.owner_type, c.owner_id, c.counter_type, c.stamp, c.value
+            for intervalType, length in StatsCountersAgg.INTERVALS:
+                key = (ownerType, ownerId, counterType, intervalType, stamp - stamp % length)
+                agg = result.get(key)
+                if agg is None:
+                    result[key] = StatsCountersAgg(
+                        owner_type=ownerType, owner_id=ownerId, counter_type=counterType, interval_type=intervalType, stamp=key[4],
+                        samples=1, total=value, value_min=value, value_max=value, value_last=value, last_stamp=stamp
+                    )
+                else:
+                    agg.merge(samples=1, total=value, value_min=value, value_max=value, value_last=value, last_stamp=stamp)
+        return result
+
+    def merge(self, samples, total, value_min, value_max, value_last, last_stamp):
+        self.samples += samples
+        self.total += total
+        self.value_min = min(self.value_min, value_min)
+        self.value_max = max(self.value_max, value_max)
+        if last_stamp >= self.last_stamp:
+            self.value_last, self.last_stamp = value_last, last_stamp
+
+    @staticmethod
+    def __upsert(rollups):
+        """
+        Inserts rollups or merges them with existing ones, with just one database operation.
+        Concurrent creation of same rollup is resolved by database, so no unique violation is possible
+        """
+        qn = connection.ops.quote_name
+        table = qn(StatsCountersAgg._meta.db_table)
+        keys = ('owner_type', 'owner_id', 'counter_type', 'interval_type', 'stamp')
+        values = ('samples', 'total', 'value_min', 'value_max', 'value_last', 'last_stamp')
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(table, ', '.join(qn(c) for c in keys + values), ', '.join(['%s'] * len(keys + values)))
+        if connection.vendor == 'mysql':
+            new = 'VALUES({})'.format
+            least, greatest = 'LEAST', 'GREATEST'
+            sql += ' ON DUPLICATE KEY UPDATE '
+        else:
+            new = 'excluded.{}'.format
+            least, greatest = ('MIN', 'MAX') if connection.vendor == 'sqlite' else ('LEAST', 'GREATEST')
+            sql += ' ON CONFLICT ({}) DO UPDATE SET '.format(', '.join(qn(c) for c in keys))
+        old = lambda c: '{}.{}'.format(table, qn(c))
+        # On mysql assignments are evaluated in order, so value_last must be updated before last_stamp
+        sql += ', '.join((
+            '{0}={1}+{2}'.format(qn('samples'), old('samples'), new(qn('samples'))),
+            '{0}={1}+{2}'.format(qn('total'), old('total'), new(qn('total'))),
+            '{0}={1}({2}, {3})'.format(qn('value_min'), least, old('value_min'), new(qn('value_min'))),
+            '{0}={1}({2}, {3})'.format(qn('value_max'), greatest, old('value_max'), new(qn('value_max'))),
+            '{0}=CASE WHEN {1} >= {2} THEN {3} ELSE {4} END'.format(qn('value_last'), new(qn('last_stamp')), old('last_stamp'), new(qn('value_last')), old('value_last')),
+            '{0}={1}({2}, {3})'.format(qn('last_stamp'), greatest, old('last_stamp'), new(qn('last_stamp'))),
+        ))
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, [[getattr(agg, c) for c in keys + values] for agg in rollups])
+
+    @staticmethod
+    def __merge(rollups):
+        """
+        Merges rollups (dict, as returned by rollup) with existing ones, creating the missing ones
+        """
+        existing = StatsCountersAgg.objects.select_for_update().filter(
+            owner_type__in=set(k[0] for k in rollups),
+            counter_type__in=set(k[2] for k in rollups),
+            stamp__in=set(k[4] for k in rollups)
+        )
+        for agg in existing:
+            new = rollups.pop((agg.owner_type, agg.owner_id, agg.counter_type, agg.interval_type, agg.stamp), None)
+            if new is None:  # Not related to this counters, just fetched because of the filter
+                continue
+            agg.merge(new.samples, new.total, new.value_min, new.value_max, new.value_last, new.last_stamp)
+            agg.save(update_fields=['samples', 'total', 'value_min', 'value_max', 'value_last', 'last_stamp'])
+
+        StatsCountersAgg.objects.bulk_create(rollups.values())
+
+    @staticmethod
+    def accumulate(counters):
+        """
+        Adds counters (dicts with owner_type, owner_id, counter_type, stamp and value) to their rollups.
+        Should be invoked inside the transaction that stores the counters, so both are always in sync.
+        """
+        rollups = StatsCountersAgg.rollup(counters)
+        if not rollups:
+            return
+
+        if connection.vendor in ('mysql', 'sqlite', 'postgresql'):
+            StatsCountersAgg.__upsert(rollups.values())
+            return
+
+        # select_for_update only locks existing rows, so some of the new ones can be created meanwhile by others.
+        # If so, retry (new ones will be existing ones now)
+        try:
+            with transaction.atomic():
+                StatsCountersAgg.__merge(dict(rollups))
+        except IntegrityError:
+            logger.debug('Rollups created concurrently, merging them again')
+            StatsCountersAgg.__merge(rollups)
+
+    def __unicode__(self):
+        return u"Counter rollup of {0}({1}): {2} - {3} - {4}/{5}".format(self.owner_type, self.owner_id, self.stamp, self.counter_type, self.interval_type, self.samples)
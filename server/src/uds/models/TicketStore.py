@@ -31,6 +31,7 @@
 
 from __future__ import unicode_literals
 
+from django.conf import settings
 from django.db import models
 
 from uds.models.UUIDModel import UUIDModel
@@ -39,30 +40,68 @@ from uds.core.managers import cryptoManager
 
 import datetime
 import pickle
-import string
-import random
+import json
+import time
 import logging
 
 logger = logging.getLogger(__name__)
 
-__updated__ = '2018-07-19'
+__updated__ = '2018-10-18'
+
+# Prefix of json encoded values. Pickled values never starts with a 0 byte
+JSON_MARK = b'\x00J'
+
+
+def dumps(value):
+    """
+    Encodes a ticket value, as json if it survives the round trip unchanged (dicts, lists, strings, numbers, ...),
+    or pickled if not (tuples, bytes, objects, ...)
+    """
+    try:
+        data = json.dumps(value, separators=(',', ':'))
+        if json.loads(data) == value:
+            return JSON_MARK + data.encode('utf8')
+    except (TypeError, ValueError):
+        pass
+    return pickle.dumps(value)
+
+
+def loads(data):
+    """
+    Decodes a value encoded by "dumps" (or just pickled, as tickets stored by previous versions)
+    """
+    data = bytes(data)  # Binary fields can be readed as memoryview
+    if data[:2] == JSON_MARK:
+        return json.loads(data[2:].decode('utf8'))
+    return pickle.loads(data)
 
 
 class TicketStore(UUIDModel):
     """
     Tickets storing on DB
+
+    Short lived tickets, without owner nor validator, are stored on the django cache named on UDS_TICKETS_CACHE
+    setting (i.e. memcached) if it is set, instead of database
     """
     DEFAULT_VALIDITY = 60
     MAX_VALIDITY = 60 * 60 * 12
-    # Cleanup will purge all elements that have been created MAX_VALIDITY ago
+    # Tickets are never valid for more than MAX_VALIDITY, and cleanup purges all elements expired
+
+    # Tickets with validity up to this are "short lived"
+    SHARED_MAX_VALIDITY = 600
+    # Shared tickets are kept this time after expiration, so they can be revalidated (as database ones until cleanup)
+    SHARED_GRACE = 60
 
     owner = models.CharField(null=True, blank=True, default=None, max_length=8)
     stamp = models.DateTimeField()  # Date creation or validation of this entry
     validity = models.IntegerField(default=60)  # Duration allowed for this ticket to be valid, in seconds
+    expires_at = models.DateTimeField(db_index=True)  # stamp + validity, kept by save
 
     data = models.BinaryField()  # Associated ticket data
     validator = models.BinaryField(null=True, blank=True, default=None)  # Associated validator for this ticket
 
+    _shared = None
+
     class InvalidTicket(Exception):
         pass
 
@@ -76,60 +115,132 @@ class TicketStore(UUIDModel):
     def genUuid(self):
         return TicketStore.generateUuid()
 
+    def save(self, *args, **kwargs):
+        self.expires_at = self.stamp + datetime.timedelta(seconds=self.validity)
+        return UUIDModel.save(self, *args, **kwargs)
+
     @staticmethod
     def generateUuid():
         # more secure is this:
         # ''.join(random.SystemRandom().choice(string.ascii_lowercase + string.digits) for _ in range(40))
         return cryptoManager().randomString(40)
 
+    @staticmethod
+    def sharedCache():
+        """
+        Returns the django cache used for short lived tickets, or None if tickets are stored only on database
+        """
+        if TicketStore._shared is None:
+            TicketStore._shared = False
+            cacheName = getattr(settings, 'UDS_TICKETS_CACHE', None)
+            if cacheName is not None:
+                try:
+                    from django.core.cache import caches
+                    TicketStore._shared = caches[cacheName]
+                except Exception:
+                    logger.error('Cache {} not available, tickets will be stored on database'.format(cacheName))
+        return TicketStore._shared or None
+
+    @staticmethod
+    def __putShared(uuid, data, validity):
+        """
+        Stores a ticket on shared cache, if it is a "short lived" one. Returns True if stored
+        """
+        cache = TicketStore.sharedCache()
+        if cache is None or validity > TicketStore.SHARED_MAX_VALIDITY:
+            return False
+        try:
+            cache.set('udst' + uuid, (time.time() + validity, validity, data), validity + TicketStore.SHARED_GRACE)
+            cache.delete('udstc' + uuid)  # Not consumed
+            return True
+        except Exception as e:
+            logger.warning('Could not store ticket on shared cache: {}'.format(e))
+            return False
+
+    @staticmethod
+    def __getShared(uuid, invalidate):
+        """
+        Returns ticket data from shared cache, or None if it is not there (so it may be on database)
+        """
+        cache = TicketStore.sharedCache()
+        if cache is None:
+            return None
+        try:
+            values = cache.get_many(['udst' + uuid, 'udstc' + uuid])
+        except Exception as e:
+            logger.warning('Could not access shared tickets cache: {}'.format(e))
+            return None
+
+        if 'udst' + uuid not in values:
+            return None
+        expiration, _, data = values['udst' + uuid]
+        if expiration < time.time() or 'udstc' + uuid in values:
+            raise TicketStore.InvalidTicket('Not valid anymore')
+        # "add" only succeeds once, so a ticket is never used twice, even if requested at same time
+        if invalidate is True and not cache.add('udstc' + uuid, True, int(expiration - time.time()) + TicketStore.SHARED_GRACE + 1):
+            raise TicketStore.InvalidTicket('Not valid anymore')
+        return data
+
     @staticmethod
     def create(data, validator=None, validity=DEFAULT_VALIDITY, owner=None, secure=False):
         """
         validity is in seconds
         """
-        if validator is not None:
-            validator = pickle.dumps(validator)
-        data = pickle.dumps(data)
+        validity = min(validity, TicketStore.MAX_VALIDITY)
+        data = dumps(data)
         if secure:
             pass
 
+        if validator is None and owner is None:
+            uuid = TicketStore.generateUuid()
+            if TicketStore.__putShared(uuid, data, validity):
+                return uuid
+
+        if validator is not None:
+            validator = pickle.dumps(validator)
+
         return TicketStore.objects.create(stamp=getSqlDatetime(), data=data, validator=validator, validity=validity, owner=owner).uuid
 
     @staticmethod
-    def store(uuid, data, validator=None, validity=DEFAULT_VALIDITY, owner=owner, secure=False):
+    def store(uuid, data, validator=None, validity=DEFAULT_VALIDITY, owner=None, secure=False):
         """
         Stores an ticketstore. If one with this uuid already exists, replaces it. Else, creates a new one
         validity is in seconds
         """
-        if validator is not None:
-            validator = pickle.dumps(validator)
-
-        data = pickle.dumps(data)
+        validity = min(validity, TicketStore.MAX_VALIDITY)
+        data = dumps(data)
         if secure:
             pass
 
+        if validator is not None:
+            validator = pickle.dumps(validator)
+
         try:
             t = TicketStore.objects.get(uuid=uuid)
-            t.data = pickle.dumps(data)
+            t.data, t.validator, t.owner = data, validator, owner
             t.stamp = getSqlDatetime()
             t.validity = validity
             t.save()
         except TicketStore.DoesNotExist:
-            t = TicketStore.objects.create(uuid=uuid, stamp=getSqlDatetime(), data=pickle.dumps(data), validator=validator, validity=validity)
+            TicketStore.objects.create(uuid=uuid, stamp=getSqlDatetime(), data=data, validator=validator, validity=validity, owner=owner)
 
     @staticmethod
     def get(uuid, invalidate=True, owner=None, secure=False):
+        if owner is None:
+            data = TicketStore.__getShared(uuid, invalidate)
+            if data is not None:
+                return loads(data)
+
         try:
             t = TicketStore.objects.get(uuid=uuid, owner=owner)
-            validity = datetime.timedelta(seconds=t.validity)
             now = getSqlDatetime()
 
-            logger.debug('Ticket validity: {} {}'.format(t.stamp + validity, now))
-            if t.stamp + validity < now:
+            logger.debug('Ticket validity: {} {}'.format(t.expires_at, now))
+            if t.expires_at < now:
                 raise TicketStore.InvalidTicket('Not valid anymore')
 
             # if secure: TODO
-            data = pickle.loads(t.data)
+            data = loads(t.data)
 
             # If has validator, execute it
             if t.validator is not None:
@@ -139,8 +250,10 @@ class TicketStore(UUIDModel):
                     raise TicketStore.InvalidTicket('Validation failed')
 
             if invalidate is True:
-                t.stamp = now - validity - datetime.timedelta(seconds=1)
-                t.save()
+                expired = now - datetime.timedelta(seconds=1)
+                # Only if not invalidated meanwhile, so a ticket is never used twice
+                if TicketStore.objects.filter(pk=t.pk, expires_at=t.expires_at).update(stamp=expired - datetime.timedelta(seconds=t.validity), expires_at=expired) == 0:
+                    raise TicketStore.InvalidTicket('Not valid anymore')
 
             return data
         except TicketStore.DoesNotExist:
@@ -148,24 +261,31 @@ class TicketStore(UUIDModel):
 
     @staticmethod
     def revalidate(uuid, validity=None, owner=None):
+        if owner is None:
+            cache = TicketStore.sharedCache()
+            if cache is not None:
+                try:
+                    value = cache.get('udst' + uuid)
+                except Exception:
+                    value = None
+                if value is not None and TicketStore.__putShared(uuid, value[2], min(validity or value[1], TicketStore.SHARED_MAX_VALIDITY)):
+                    return
+
         try:
             t = TicketStore.objects.get(uuid=uuid, owner=owner)
             t.stamp = getSqlDatetime()
             if validity is not None:
-                t.validity = validity
+                t.validity = min(validity, TicketStore.MAX_VALIDITY)
             t.save()
         except TicketStore.DoesNotExist:
             raise Exception('Does not exists')
 
     @staticmethod
     def cleanup():
-        from datetime import timedelta
-        now = getSqlDatetime()
-        for v in TicketStore.objects.all():
-            if now > v.stamp + timedelta(seconds=v.validity):
-                v.delete()
-        cleanSince = now - datetime.timedelta(seconds=TicketStore.MAX_VALIDITY)
-        number = TicketStore.objects.filter(stamp__lt=cleanSince).delete()
+        """
+        Removes expired tickets (shared ones are expired by the cache itself)
+        """
+        TicketStore.objects.filter(expires_at__lt=getSqlDatetime()).delete()
 
     def __unicode__(self):
         if self.validator is not None:
@@ -173,4 +293,4 @@ class TicketStore(UUIDModel):
         else:
             validator = None
 
-        return 'Ticket id: {}, Secure: {}, Stamp: {}, Validity: {}, Validator: {}, Data: {}'.format(self.uuid, self.owner, self.stamp, self.validity, validator, pickle.loads(self.data))
+        return 'Ticket id: {}, Secure: {}, Stamp: {}, Validity: {}, Validator: {}, Data: {}'.format(self.uuid, self.owner, self.stamp, self.validity, validator, loads(self.data))
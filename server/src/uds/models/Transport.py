@@ -33,13 +33,13 @@
 
 from __future__ import unicode_literals
 
-__updated__ = '2016-08-24'
+__updated__ = '2018-10-18'
 
 from django.db import models
 from django.db.models import signals
 from django.utils.encoding import python_2_unicode_compatible
 
-from uds.core.util import net
+from uds.core.util.NetworksIndex import NetworksIndex
 
 from uds.models.ManagedObjectModel import ManagedObjectModel
 from uds.models.Tag import TaggingMixin
@@ -106,15 +106,9 @@ class Transport(ManagedObjectModel, TaggingMixin):
 
         Raises:
 
-        :note: Ip addresses has been only tested with IPv4 addresses
+        :note: Networks are resolved from an in memory index (works with IPv4 and IPv6 addresses)
         """
-        if self.networks.count() == 0:
-            return True
-        ip = net.ipToLong(ip)
-        if self.nets_positive:
-            return self.networks.filter(net_start__lte=ip, net_end__gte=ip).count() > 0
-        else:
-            return self.networks.filter(net_start__lte=ip, net_end__gte=ip).count() == 0
+        return NetworksIndex.index().transportValidForIp(self.id, ip)
 
     def validForOs(self, os):
         logger.debug('Checkin if os "{}" is in "{}"'.format(os, self.allowed_oss))
@@ -150,3 +144,7 @@ class Transport(ManagedObjectModel, TaggingMixin):
 
 # : Connects a pre deletion signal to OS Manager
 signals.pre_delete.connect(Transport.beforeDelete, sender=Transport)
+
+# Networks index keeps the nets_positive of transports
+signals.post_save.connect(NetworksIndex.invalidate, sender=Transport)
+signals.post_delete.connect(NetworksIndex.invalidate, sender=Transport)
@@ -57,7 +57,7 @@ from uds.core.services import UserDeployment
 
 import logging
 
-__updated__ = '2018-09-26'
+__updated__ = '2018-10-18'
 
 logger = logging.getLogger(__name__)
 
@@ -145,6 +145,8 @@ class UserService(UUIDModel):
         the os manager and the publication, so we also instantiate those here.
 
         Every single record of UserService model, represents an object.
+        Publication instance, that is only readed, is shared with other readers (see InstanceCache). Service and os manager
+        ones are not, as user deployment uses their apis.
 
         Args:
            values (list): Values to pass to constructor. If no values are especified,
@@ -166,7 +168,7 @@ class UserService(UUIDModel):
         publicationInstance = None
         try:  # We may have deleted publication...
             if self.publication is not None:
-                publicationInstance = self.publication.getInstance()
+                publicationInstance = self.publication.getInstance(shared=True)  # Only readed by user service
         except Exception as e:
             # The publication to witch this item points to, does not exists
             self.publication = None
@@ -303,7 +305,7 @@ class UserService(UUIDModel):
         :note: This method MUST be invoked by transport before using credentials passed to getJavascript.
         """
         ds = self.deployed_service
-        serviceInstance = ds.service.getInstance()
+        serviceInstance = ds.service.getInstance(shared=True)
         if serviceInstance.needsManager is False:
             return [username, password]
 
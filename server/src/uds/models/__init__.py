@@ -74,6 +74,7 @@ from .Log import Log
 
 # Stats
 from .StatsCounters import StatsCounters
+from .StatsCountersAgg import StatsCountersAgg
 from .StatsEvents import StatsEvents
 
 # General utility models, such as a database cache (for caching remote content of slow connections to external services providers for example)
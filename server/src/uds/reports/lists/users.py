@@ -36,8 +36,7 @@ from django.utils.translation import ugettext, ugettext_lazy as _
 from uds.core.ui.UserInterface import gui
 from uds.models import Authenticator
 
-import six
-import csv
+import itertools
 
 from .base import ListReport
 
@@ -105,16 +104,11 @@ class ListReportsUsersCSV(ListReportUsers):
             self.filename = auth.name + '.csv'
 
     def generate(self):
-        output = six.StringIO()
-        writer = csv.writer(output)
         auth = Authenticator.objects.get(uuid=self.authenticator.value)
-        users = auth.users.order_by('name')
-
-        writer.writerow([ugettext('User ID'), ugettext('Real Name'), ugettext('Last access')])
-
-        for v in users:
-            writer.writerow([v.name, v.real_name, v.last_access])
-
-        # writer.writerow(['ñoño', 'ádios', 'hola'])
+        users = auth.users.order_by('name').values_list('name', 'real_name', 'last_access')
 
-        return output.getvalue()
+        # Rows are sent as they are read from database
+        return self.asCSV(itertools.chain(
+            ([ugettext('User ID'), ugettext('Real Name'), ugettext('Last access')],),
+            users.iterator()
+        ))
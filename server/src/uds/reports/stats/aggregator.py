@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) 2012 Virtual Cable S.L.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#    * Neither the name of Virtual Cable S.L. nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Engine used by stats reports to obtain their data reading events just once, in stamp order,
+and accumulating them on compact structures (so memory does not depends on the number of events)
+
+.. moduleauthor:: Adolfo Gómez, dkmaster at dkmon dot com
+"""
+from __future__ import unicode_literals
+
+from django.db.models import Q
+
+from uds.core.util.stats import events
+
+import collections
+import hashlib
+import struct
+import bisect
+import array
+import math
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+__updated__ = '2018-10-18'
+
+Event = collections.namedtuple('Event', ['id', 'stamp', 'owner_id', 'event_type', 'fld1', 'fld2', 'fld3', 'fld4'])
+
+
+class DistinctCounter(object):
+    """
+    HyperLogLog distinct values counter.
+    Values are counted exactly until "exactLimit" different values are seen, and approximated (~2.3% standard error) from then on,
+    using a fixed amount of memory (2 ** precision bytes)
+    """
+    __slots__ = ('_values', '_registers')
+
+    precision = 11
+    exactLimit = 256
+
+    def __init__(self):
+        self._values = set()
+        self._registers = None
+
+    def __addHash(self, value):
+        h = struct.unpack('>Q', hashlib.md5(value.encode('utf8')).digest()[:8])[0]
+        index = h >> (64 - self.precision)
+        rest = (h << self.precision) & 0xFFFFFFFFFFFFFFFF
+        rank = 1
+        while rank <= 64 - self.precision and not rest & 0x8000000000000000:
+            rank += 1
+            rest <<= 1
+        if rank > self._registers[index]:
+            self._registers[index] = rank
+
+    def add(self, value):
+        if self._registers is not None:
+            self.__addHash(value)
+            return
+
+        self._values.add(value)
+        if len(self._values) > self.exactLimit:  # Switch to registers
+            self._registers = bytearray(1 << self.precision)
+            for v in self._values:
+                self.__addHash(v)
+            self._values = None
+
+    def count(self):
+        if self._registers is None:
+            return len(self._values)
+
+        m = len(self._registers)
+        estimate = (0.7213 / (1 + 1.079 / m)) * m * m / sum(2.0 ** -r for r in self._registers)
+        zeros = self._registers.count(0)
+        if estimate <= 2.5 * m and zeros:  # Small range correction
+            estimate = m * math.log(float(m) / zeros)
+        return int(round(estimate))
+
+
+def samplingIntervals(start, end, samplingPoints):
+    """
+    Splits [start, end) in consecutive intervals, as stats reports did always
+    """
+    result = []
+    prevVal = None
+    for val in range(start, end, int((end - start) / (samplingPoints + 1))):
+        if prevVal is not None:
+            result.append((prevVal, val))
+        prevVal = val
+    return result
+
+
+class IntervalCollector(object):
+    """
+    Counts events (and, optionally, distinct values of a field) per owner and interval
+    """
+    def __init__(self, intervals, distinctField=None):
+        self.intervals = intervals
+        self._starts = [i[0] for i in intervals]
+        self._distinctField = distinctField
+        self._counts = {}
+        self._distinct = {}
+
+    def add(self, event):
+        pos = bisect.bisect_right(self._starts, event.stamp) - 1
+        if pos < 0 or event.stamp >= self.intervals[pos][1]:
+            return
+
+        counts = self._counts.get(event.owner_id)
+        if counts is None:
+            counts = self._counts[event.owner_id] = array.array('l', [0] * len(self.intervals))
+        counts[pos] += 1
+
+        if self._distinctField is not None:
+            distinct = self._distinct.get(event.owner_id)
+            if distinct is None:
+                distinct = self._distinct[event.owner_id] = [None] * len(self.intervals)
+            if distinct[pos] is None:
+                distinct[pos] = DistinctCounter()
+            distinct[pos].add(getattr(event, self._distinctField))
+
+    def counts(self, ownerId=None):
+        """
+        Returns number of events per interval of an owner, or of every owner if ownerId is None
+        """
+        if ownerId is not None:
+            return list(self._counts.get(ownerId, ())) or [0] * len(self.intervals)
+        return [sum(c[i] for c in self._counts.values()) for i in range(len(self.intervals))]
+
+    def distinct(self, ownerId):
+        """
+        Returns (approximate for large numbers) number of different values of distinctField per interval of an owner
+        """
+        return [d.count() if d is not None else 0 for d in self._distinct.get(ownerId, [None] * len(self.intervals))]
+
+
+class WeekHourCollector(object):
+    """
+    Counts events by day of week and hour (local time)
+    """
+    def __init__(self):
+        self._counts = array.array('l', [0] * (7 * 24))
+        # Cache of quarter of hour since epoch -> slot, to avoid date conversions per event.
+        # Quarters instead of hours, because local offsets (and its changes) can be of half or quarter of hour
+        self._quarters = {}
+
+    def add(self, event):
+        quarter = event.stamp // 900
+        slot = self._quarters.get(quarter)
+        if slot is None:
+            s = datetime.datetime.fromtimestamp(event.stamp)
+            slot = self._quarters[quarter] = s.weekday() * 24 + s.hour
+        self._counts[slot] += 1
+
+    def week(self):
+        return [sum(self._counts[d * 24:(d + 1) * 24]) for d in range(7)]
+
+    def hour(self):
+        return [sum(self._counts[d * 24 + h] for d in range(7)) for h in range(24)]
+
+    def weekHour(self):
+        return [list(self._counts[d * 24:(d + 1) * 24]) for d in range(7)]
+
+
+class SessionsCollector(object):
+    """
+    Pairs login and logout events of same unique id (fld4), invoking onSession(uniqueId, loginStamp, seconds) for
+    every complete session. Only sessions opened and not closed yet are kept on memory.
+    """
+    def __init__(self, onSession=None):
+        self._onSession = onSession
+        self._logins = {}
+
+    def add(self, event):
+        """
+        Returns the (uniqueId, loginStamp, seconds) session completed by this event, if any
+        """
+        if event.event_type == events.ET_LOGIN:
+            self._logins[event.fld4] = event.stamp
+        elif event.event_type == events.ET_LOGOUT:
+            stamp = self._logins.pop(event.fld4, None)
+            if stamp is not None:
+                if self._onSession is not None:
+                    self._onSession(event.fld4, stamp, event.stamp - stamp)
+                return event.fld4, stamp, event.stamp - stamp
+        return None
+
+
+def streamEvents(ownerType, eventType, since, to, ownerId=None, chunkSize=2000):
+    """
+    Yields Event tuples sorted by stamp, reading them from database in chunks so
+    memory used does not grows with the number of events.
+    """
+    qs = events.statsManager().getEvents(ownerType, eventType, owner_id=ownerId, since=since, to=to).order_by('stamp', 'id')
+    lastStamp = lastId = None
+    while True:
+        chunk = qs
+        if lastStamp is not None:
+            chunk = chunk.filter(Q(stamp__gt=lastStamp) | Q(stamp=lastStamp, id__gt=lastId))
+        rows = list(chunk.values_list(*Event._fields)[:chunkSize])
+        for row in rows:
+            yield Event._make(row)
+        if len(rows) < chunkSize:
+            return
+        lastStamp, lastId = rows[-1][1], rows[-1][0]
+
+
+def aggregate(ownerType, eventType, since, to, collectors, ownerId=None):
+    """
+    Feeds every collector with the events requested, in just one pass over them
+    """
+    count = 0
+    for event in streamEvents(ownerType, eventType, since, to, ownerId):
+        for collector in collectors:
+            collector.add(event)
+        count += 1
+    logger.debug('Aggregated {} events'.format(count))
+    return collectors
+
+
+def sessions(ownerType, since, to, ownerId=None):
+    """
+    Yields (uniqueId, loginStamp, seconds) of sessions as they are completed while reading events
+    """
+    collector = SessionsCollector()
+    for event in streamEvents(ownerType, (events.ET_LOGIN, events.ET_LOGOUT), since, to, ownerId):
+        session = collector.add(event)
+        if session is not None:
+            yield session
@@ -37,10 +37,10 @@ from django.utils.translation import ugettext, ugettext_lazy as _
 from uds.core.ui.UserInterface import gui
 from uds.core.util.stats import events
 
-import io
-import csv
+import itertools
 
 from .base import StatsReport
+from . import aggregator
 
 from uds.models import ServicePool
 
@@ -49,7 +49,7 @@ import logging
 
 logger = logging.getLogger(__name__)
 
-__updated__ = '2018-04-25'
+__updated__ = '2018-10-18'
 
 
 class UsageSummaryByPool(StatsReport):
@@ -97,30 +97,15 @@ class UsageSummaryByPool(StatsReport):
         end = self.endDate.stamp()
         logger.debug(self.pool.value)
 
-        items = events.statsManager().getEvents(events.OT_DEPLOYED, (events.ET_LOGIN, events.ET_LOGOUT), owner_id=pool.id, since=start, to=end).order_by('stamp')
-
-        logins = {}
         users = {}
-        for i in items:
-            # if '\\' in i.fld1:
-            #    continue
-            username = i.fld4
-            if i.event_type == events.ET_LOGIN:
-                logins[username] = i.stamp
-            else:
-                if username in logins:
-                    stamp = logins[username]
-                    del logins[username]
-                    total = i.stamp - stamp
-                    if username not in users:
-                        users[username] = { 'sessions': 0, 'time': 0 }
-                    users[username]['sessions'] += 1
-                    users[username]['time'] += total
-                    # data.append({
-                    #    'name': i.fld4,
-                    #    'date': datetime.datetime.fromtimestamp(stamp),
-                    #    'time': total
-                    # })
+
+        def onSession(username, stamp, total):
+            if username not in users:
+                users[username] = {'sessions': 0, 'time': 0}
+            users[username]['sessions'] += 1
+            users[username]['time'] += total
+
+        aggregator.aggregate(events.OT_DEPLOYED, (events.ET_LOGIN, events.ET_LOGOUT), start, end, (aggregator.SessionsCollector(onSession),), ownerId=pool.id)
 
         # Extract different number of users
         data = []
@@ -165,14 +150,9 @@ class UsageSummaryByPoolCSV(UsageSummaryByPool):
     endDate = UsageSummaryByPool.endDate
 
     def generate(self):
-        output = io.StringIO()
-        writer = csv.writer(output)
-
         reportData, poolName = self.getData()
 
-        writer.writerow([ugettext('User'), ugettext('Sessions'), ugettext('Hours'), ugettext('Average')])
-
-        for v in reportData:
-            writer.writerow([v['user'], v['sessions'], v['hours'], v['average']])
-
-        return output.getvalue()
+        return self.asCSV(itertools.chain(
+            ([ugettext('User'), ugettext('Sessions'), ugettext('Hours'), ugettext('Average')],),
+            ([v['user'], v['sessions'], v['hours'], v['average']] for v in reportData)
+        ))
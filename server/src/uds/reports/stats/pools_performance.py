@@ -31,12 +31,11 @@
 .. moduleauthor:: Adolfo Gómez, dkmaster at dkmon dot com
 """
 import io
-import csv
+import itertools
 import datetime
 import logging
 
 from django.utils.translation import ugettext, ugettext_lazy as _
-from django.db.models import Count
 import django.template.defaultfilters as filters
 
 from uds.core.ui.UserInterface import gui
@@ -45,13 +44,14 @@ from uds.core.util.stats import events
 from uds.core.reports import graphs
 
 from .base import StatsReport
+from . import aggregator
 
 from uds.core.util import tools
 from uds.models import ServicePool
 
 logger = logging.getLogger(__name__)
 
-__updated__ = '2018-04-24'
+__updated__ = '2018-10-18'
 
 # several constants as Width height, margins, ..
 WIDTH, HEIGHT, DPI = 19.2, 10.8, 100
@@ -138,38 +138,29 @@ class PoolPerformanceReport(StatsReport):
             xLabelFormat = 'SHORT_DATETIME_FORMAT'
 
         # Generate samplings interval
-        samplingIntervals = []
-        prevVal = None
-        for val in range(start, end, int((end - start) / (samplingPoints + 1))):
-            if prevVal is None:
-                prevVal = val
-                continue
-            samplingIntervals.append((prevVal, val))
-            prevVal = val
+        samplingIntervals = aggregator.samplingIntervals(start, end, samplingPoints)
+
+        # All pools and intervals are computed with just one pass over the events
+        fld = events.statsManager().getEventFldFor('username')
+        collector = aggregator.IntervalCollector(samplingIntervals, distinctField=fld)
+        aggregator.aggregate(events.OT_DEPLOYED, events.ET_ACCESS, start, end, (collector,), ownerId=[p[0] for p in pools])
 
         # Store dataUsers for all pools
         poolsData = []
 
-        fld = events.statsManager().getEventFldFor('username')
-
         reportData = []
         for p in pools:
             dataUsers = []
             dataAccesses = []
-            for interval in samplingIntervals:
+            for interval, users, accesses in zip(samplingIntervals, collector.distinct(p[0]), collector.counts(p[0])):
                 key = (interval[0] + interval[1]) / 2
-                q = events.statsManager().getEvents(events.OT_DEPLOYED, events.ET_ACCESS, since=interval[0], to=interval[1], owner_id=p[0]).values(fld).annotate(cnt=Count(fld))
-                accesses = 0
-                for v in q:
-                    accesses += v['cnt']
-
-                dataUsers.append((key, len(q)))  # @UndefinedVariable
+                dataUsers.append((key, users))
                 dataAccesses.append((key, accesses))
                 reportData.append(
                     {
                         'name': p[1],
                         'date': tools.timestampAsStr(interval[0], xLabelFormat) + ' - ' + tools.timestampAsStr(interval[1], xLabelFormat),
-                        'users': len(q),
+                        'users': users,
                         'accesses': accesses
                     }
                 )
@@ -185,6 +176,7 @@ class PoolPerformanceReport(StatsReport):
     def generate(self):
         # Generate the sampling intervals and get dataUsers from db
         xLabelFormat, poolsData, reportData = self.getRangeData()
+        self.progress(40)
 
         graph1 = io.BytesIO()
         graph2 = io.BytesIO()
@@ -209,6 +201,7 @@ class PoolPerformanceReport(StatsReport):
         }
 
         graphs.barChart(SIZE, data, graph1)
+        self.progress(60)
 
         X = [v[0] for v in poolsData[0]['dataAccesses']]
         data = {
@@ -226,6 +219,7 @@ class PoolPerformanceReport(StatsReport):
         }
 
         graphs.barChart(SIZE, data, graph2)
+        self.progress(80)
 
         # Generate Data for pools, basically joining all pool data
 
@@ -257,14 +251,9 @@ class PoolPerformanceReportCSV(PoolPerformanceReport):
     samplingPoints = PoolPerformanceReport.samplingPoints
 
     def generate(self):
-        output = io.StringIO()
-        writer = csv.writer(output)
-
         reportData = self.getRangeData()[2]
 
-        writer.writerow([ugettext('Pool'), ugettext('Date range'), ugettext('Users'), ugettext('Accesses')])
-
-        for v in reportData:
-            writer.writerow([v['name'], v['date'], v['users'], v['accesses']])
-
-        return output.getvalue()
+        return self.asCSV(itertools.chain(
+            ([ugettext('Pool'), ugettext('Date range'), ugettext('Users'), ugettext('Accesses')],),
+            ([v['name'], v['date'], v['users'], v['accesses']] for v in reportData)
+        ))
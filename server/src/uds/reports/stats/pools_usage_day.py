@@ -35,7 +35,7 @@ from django.utils.translation import ugettext, ugettext_lazy as _
 from uds.core.ui.UserInterface import gui
 from uds.core.util.stats import counters
 
-import csv
+import itertools
 import io
 import datetime
 import logging
@@ -161,14 +161,9 @@ class CountersPoolAssignedCSV(CountersPoolAssigned):
     pools = CountersPoolAssigned.pools
 
     def generate(self):
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow([ugettext('Pool'), ugettext('Hour'), ugettext('Services')])
-
         items = self.getData()
 
-        for i in items:
-            for j in range(24):
-                writer.writerow([i['name'], '{:02d}'.format(j), i['hours'][j]])
-
-        return output.getvalue()
+        return self.asCSV(itertools.chain(
+            ([ugettext('Pool'), ugettext('Hour'), ugettext('Services')],),
+            ([i['name'], '{:02d}'.format(j), i['hours'][j]] for i in items for j in range(24))
+        ))
@@ -37,10 +37,10 @@ from django.utils.translation import ugettext, ugettext_lazy as _
 from uds.core.ui.UserInterface import gui
 from uds.core.util.stats import events
 
-import six
-import csv
+import itertools
 
 from .base import StatsReport
+from . import aggregator
 
 from uds.models import ServicePool
 
@@ -49,7 +49,7 @@ import logging
 
 logger = logging.getLogger(__name__)
 
-__updated__ = '2018-04-25'
+__updated__ = '2018-10-18'
 
 
 class UsageByPool(StatsReport):
@@ -92,33 +92,23 @@ class UsageByPool(StatsReport):
         ]
         self.pool.setValues(vals)
 
+    def iterData(self, pool):
+        """
+        Yields sessions of the pool, as they are read from database
+        """
+        for uniqueId, stamp, total in aggregator.sessions(events.OT_DEPLOYED, self.startDate.stamp(), self.endDate.stamp(), ownerId=pool.id):
+            yield {
+                'name': uniqueId,
+                'date': datetime.datetime.fromtimestamp(stamp),
+                'time': total
+            }
+
     def getData(self):
         # Generate the sampling intervals and get dataUsers from db
-        start = self.startDate.stamp()
-        end = self.endDate.stamp()
         logger.debug(self.pool.value)
         pool = ServicePool.objects.get(uuid=self.pool.value)
 
-        items = events.statsManager().getEvents(events.OT_DEPLOYED, (events.ET_LOGIN, events.ET_LOGOUT), owner_id=pool.id, since=start, to=end).order_by('stamp')
-
-        logins = {}
-        data = []
-        for i in items:
-            # if '\\' in i.fld1:
-            #    continue
-
-            if i.event_type == events.ET_LOGIN:
-                logins[i.fld4] = i.stamp
-            else:
-                if i.fld4 in logins:
-                    stamp = logins[i.fld4]
-                    del logins[i.fld4]
-                    total = i.stamp - stamp
-                    data.append({
-                        'name': i.fld4,
-                        'date': datetime.datetime.fromtimestamp(stamp),
-                        'time': total
-                    })
+        data = list(self.iterData(pool))
 
         logger.debug('data: {}'.format(data))
 
@@ -150,14 +140,9 @@ class UsageByPoolCSV(UsageByPool):
     endDate = UsageByPool.endDate
 
     def generate(self):
-        output = six.StringIO()
-        writer = csv.writer(output)
-
-        reportData, poolName = self.getData()
-
-        writer.writerow([ugettext('Date'), ugettext('User'), ugettext('Seconds')])
-
-        for v in reportData:
-            writer.writerow([v['date'], v['name'], v['time']])
+        pool = ServicePool.objects.get(uuid=self.pool.value)
 
-        return output.getvalue()
+        return self.asCSV(itertools.chain(
+            ([ugettext('Date'), ugettext('User'), ugettext('Seconds')],),
+            ([v['date'], v['name'], v['time']] for v in self.iterData(pool))
+        ))
@@ -30,7 +30,7 @@
 """
 .. moduleauthor:: Adolfo Gómez, dkmaster at dkmon dot com
 """
-import csv
+import itertools
 import io
 import datetime
 import logging
@@ -43,12 +43,13 @@ from uds.core.util.stats import events
 from uds.core.reports import graphs
 
 from .base import StatsReport
+from . import aggregator
 
 from uds.core.util import tools
 
 logger = logging.getLogger(__name__)
 
-__updated__ = '2018-04-25'
+__updated__ = '2018-10-18'
 
 # several constants as Width height
 WIDTH, HEIGHT, DPI = 19.2, 10.8, 100
@@ -112,20 +113,19 @@ class StatsReportLogin(StatsReport):
         else:
             xLabelFormat = 'SHORT_DATETIME_FORMAT'
 
-        samplingIntervals = []
-        prevVal = None
-        for val in range(start, end, int((end - start) / (samplingPoints + 1))):
-            if prevVal is None:
-                prevVal = val
-                continue
-            samplingIntervals.append((prevVal, val))
-            prevVal = val
+        samplingIntervals = aggregator.samplingIntervals(start, end, samplingPoints)
+
+        # Data by date and by week/hour are obtained on same pass over login events
+        collector, weekHour = aggregator.aggregate(
+            events.OT_AUTHENTICATOR, events.ET_LOGIN, start, end,
+            (aggregator.IntervalCollector(samplingIntervals), aggregator.WeekHourCollector())
+        )
+        self._weekHour = weekHour
 
         data = []
         reportData = []
-        for interval in samplingIntervals:
+        for interval, val in zip(samplingIntervals, collector.counts()):
             key = (interval[0] + interval[1]) / 2
-            val = events.statsManager().getEvents(events.OT_AUTHENTICATOR, events.ET_LOGIN, since=interval[0], to=interval[1]).count()
             data.append((key, val))  # @UndefinedVariable
             reportData.append(
                 {
@@ -137,20 +137,13 @@ class StatsReportLogin(StatsReport):
         return xLabelFormat, data, reportData
 
     def getWeekHourlyData(self):
-        start = self.startDate.stamp()
-        end = self.endDate.stamp()
-
-        dataWeek = [0] * 7
-        dataHour = [0] * 24
-        dataWeekHour = [[0] * 24 for _ in range(7)]
-        for val in events.statsManager().getEvents(events.OT_AUTHENTICATOR, events.ET_LOGIN, since=start, to=end):
-            s = datetime.datetime.fromtimestamp(val.stamp)
-            dataWeek[s.weekday()] += 1
-            dataHour[s.hour] += 1
-            dataWeekHour[s.weekday()][s.hour] += 1
-            logger.debug('Data: {} {}'.format(s.weekday(), s.hour))
+        weekHour = getattr(self, '_weekHour', None)
+        if weekHour is None:  # Not already collected with range data
+            weekHour, = aggregator.aggregate(
+                events.OT_AUTHENTICATOR, events.ET_LOGIN, self.startDate.stamp(), self.endDate.stamp(), (aggregator.WeekHourCollector(),)
+            )
 
-        return dataWeek, dataHour, dataWeekHour
+        return weekHour.week(), weekHour.hour(), weekHour.weekHour()
 
     def generate(self):
         # Sample query:
@@ -161,6 +154,7 @@ class StatsReportLogin(StatsReport):
         #   ' ORDER BY block'
 
         xLabelFormat, data, reportData = self.getRangeData()
+        self.progress(30)
 
         #
         # User access by date graph
@@ -184,6 +178,7 @@ class StatsReportLogin(StatsReport):
         }
 
         graphs.lineChart(SIZE, d, graph1)
+        self.progress(45)
 
         graph2 = io.BytesIO()
         graph3 = io.BytesIO()
@@ -206,6 +201,7 @@ class StatsReportLogin(StatsReport):
         }
 
         graphs.barChart(SIZE, d, graph2)
+        self.progress(55)
 
         X = list(range(24))
         d = {
@@ -222,6 +218,7 @@ class StatsReportLogin(StatsReport):
         }
 
         graphs.barChart(SIZE, d, graph3)
+        self.progress(65)
 
         X = list(range(24))
         Y = list(range(7))
@@ -239,6 +236,7 @@ class StatsReportLogin(StatsReport):
         }
 
         graphs.surfaceChart(SIZE, d, graph4)
+        self.progress(80)
 
         return self.templateAsPDF(
             'uds/reports/stats/user-access.html',
@@ -268,14 +266,9 @@ class StatsReportLoginCSV(StatsReportLogin):
     samplingPoints = StatsReportLogin.samplingPoints
 
     def generate(self):
-        output = io.StringIO()
-        writer = csv.writer(output)
-
         reportData = self.getRangeData()[2]
 
-        writer.writerow([ugettext('Date range'), ugettext('Users')])
-
-        for v in reportData:
-            writer.writerow([v['date'], v['users']])
-
-        return output.getvalue()
+        return self.asCSV(itertools.chain(
+            ([ugettext('Date range'), ugettext('Users')],),
+            ([v['date'], v['users']] for v in reportData)
+        ))
@@ -95,8 +95,10 @@ class IPMachinesService(services.Service):
     def getUnassignedMachine(self):
         # Search first unassigned machine
         try:
+            # State of all machines is read at once
+            assigned = self.storage.existsMany(self._ips)
             for ip in self._ips:
-                if self.storage.readData(ip) is None:
+                if ip not in assigned:
                     self.storage.saveData(ip, ip)
                     return ip
             return None
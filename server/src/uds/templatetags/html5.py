@@ -75,7 +75,7 @@ class EnhacedVisual(template.Node):
         self._nodelistFalse = nodelistFalse
 
     def render(self, context):
-        if GlobalConfig.UDS_THEME_VISUAL.getBool(True) is True:
+        if GlobalConfig.UDS_THEME_VISUAL.getBool() is True:
             return self._nodelistTrue.render(context)
         if self._nodelistFalse is None:
             return ''
@@ -152,12 +152,12 @@ def preference(parser, token):
 
 @register.simple_tag
 def preferences_allowed():
-    return GlobalConfig.PREFERENCES_ALLOWED.getBool(True)
+    return GlobalConfig.PREFERENCES_ALLOWED.getBool()
 
 
 @register.simple_tag
 def pageReloadTime():
-    return GlobalConfig.RELOAD_TIME.getInt(True)
+    return GlobalConfig.RELOAD_TIME.getInt()
 
 
 @register.simple_tag
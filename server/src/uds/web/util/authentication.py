@@ -75,7 +75,7 @@ def checkLogin(request, form, tag=None):
         except Exception:
             authenticator = Authenticator()
         userName = form.cleaned_data['user']
-        if GlobalConfig.LOWERCASE_USERNAME.getBool(True) is True:
+        if GlobalConfig.LOWERCASE_USERNAME.getBool() is True:
             userName = userName.lower()
 
         cache = Cache('auth')
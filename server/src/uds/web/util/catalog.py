@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (c) 2012 Virtual Cable S.L.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright notice,
+#      this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#    * Neither the name of Virtual Cable S.L. nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Services catalog shown on user portal.
+
+Everything that depends only on the user groups, the networks of the client ip and the client OS
+(pools, transports, groups, images, ...) is obtained with a few queries and cached (until something
+changes on administration). Then, the per user data (assignations, calendars access, ...) is overlaid on each request.
+
+@author: Adolfo Gómez, dkmaster at dkmon dot com
+"""
+from __future__ import unicode_literals
+
+from django.db import transaction
+from django.db.models import signals
+
+from uds.models import (
+    DeployedService, DeployedServicePublication, Transport, Network, Group,
+    ServicesPoolGroup, Image, Service, Provider, Calendar, CalendarAccess,
+    UserService, getSqlDatetime
+)
+from uds.core.util.Cache import Cache
+from uds.core.util.State import State
+from uds.core.util import states
+from uds.core.util.calendar import CalendarChecker
+from uds.core.util.NetworksIndex import NetworksIndex
+
+import hashlib
+import pickle
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+__updated__ = '2018-10-18'
+
+CATALOG_VALIDITY = 60  # Even without changes, catalog is rebuilt this often (maintenance, publications, ...)
+GENERATION_VALIDITY = 3600 * 24 * 7
+
+cache = Cache('portalCatalog')
+
+
+def generation():
+    """
+    Returns current catalog generation (changes when anything that affects catalogs is modified)
+    """
+    gen = cache.get('generation')
+    if gen is None:
+        gen = newGeneration()
+    return gen
+
+
+def newGeneration():
+    gen = uuid.uuid4().hex
+    cache.put('generation', gen, GENERATION_VALIDITY)
+    return gen
+
+
+def invalidate(*args, **kwargs):
+    """
+    Invalidates all cached catalogs (once changes are commited). Connected to models changes
+    """
+    transaction.on_commit(newGeneration)
+
+
+def buildEntries(pools, networkIds, osName):
+    """
+    Returns the catalog entries for a queryset of pools (only pools with valid transports are included)
+    """
+    pools = pools.select_related('service__provider', 'image', 'servicesPoolGroup__image').prefetch_related('transports', 'calendarAccess')
+    activePublications = dict(
+        DeployedServicePublication.objects.filter(deployed_service__in=pools, state=State.USABLE).values_list('deployed_service_id', 'id')
+    )
+    defaultGroup = ServicesPoolGroup.default().as_dict
+    networksIndex = NetworksIndex.index()
+
+    entries = []
+    for pool in pools:
+        transports = []
+        for t in sorted(pool.transports.all(), key=lambda x: x.priority):
+            typeTrans = t.getType()
+            if typeTrans is None:  # This may happen if we "remove" a transport type but we have a transport of that kind on DB
+                continue
+            if networksIndex.transportValidForNetworks(t.id, networkIds) and typeTrans.supportsOs(osName) and t.validForOs(osName):
+                transports.append({
+                    'id': t.uuid,
+                    'name': t.name,
+                    'priority': t.priority,
+                    'ownLink': typeTrans.ownLink is True
+                })
+
+        # If empty transports, do not include it on list
+        if not transports:
+            continue
+
+        entries.append({
+            'pool': pool.id,
+            'uuid': pool.uuid,
+            'name': pool.name,
+            'visual_name': pool.visual_name,
+            'comments': pool.comments,
+            'group': pool.servicesPoolGroup.as_dict if pool.servicesPoolGroup is not None else defaultGroup,
+            'transports': transports,
+            'imageId': pool.image.uuid if pool.image is not None else 'x',
+            'show_transports': pool.show_transports,
+            'allow_users_remove': pool.allow_users_remove,
+            'allow_users_reset': pool.allow_users_reset,
+            'maintenance': pool.isInMaintenance(),
+            'fallbackAccess': pool.fallbackAccess,
+            'calendarAccess': [(ca.calendar_id, ca.access) for ca in sorted(pool.calendarAccess.all(), key=lambda x: x.priority)],
+            'activePublication': activePublications.get(pool.id),
+        })
+
+    return entries
+
+
+def getCatalog(groups, networkIds, osName):
+    """
+    Returns the catalog entries (cached) for the pools visible by the groups, with the transports valid for networks and os
+    """
+    key = hashlib.sha1('{}|{}|{}|{}'.format(
+        generation(), sorted(g.id for g in groups), sorted(networkIds), osName
+    ).encode('utf8')).hexdigest()
+
+    entries = cache.get(key)
+    if entries is None:
+        pools = DeployedService.getDeployedServicesForGroups(groups)
+        entries = buildEntries(DeployedService.objects.filter(id__in=[p.id for p in pools]), networkIds, osName)
+        cache.put(key, entries, CATALOG_VALIDITY)
+
+    return entries
+
+
+class AccessChecker(object):
+    """
+    Evaluates calendar based access of catalog entries, loading each calendar once
+    """
+    def __init__(self, entries):
+        ids = set(c[0] for e in entries for c in e['calendarAccess'])
+        self._calendars = {c.id: c for c in Calendar.objects.filter(id__in=ids)} if ids else {}
+        self._results = {}
+        self._now = getSqlDatetime()
+
+    def __calendarMatches(self, calendarId):
+        if calendarId not in self._results:
+            calendar = self._calendars.get(calendarId)
+            self._results[calendarId] = calendar is not None and CalendarChecker(calendar).check(self._now) is True
+        return self._results[calendarId]
+
+    def isAccessAllowed(self, entry):
+        """
+        Same as ServicePool.isAccessAllowed, over a catalog entry
+        """
+        access = entry['fallbackAccess']
+        for calendarId, calendarAccess in entry['calendarAccess']:
+            if self.__calendarMatches(calendarId):
+                access = calendarAccess
+                break  # Stops on first rule match found
+        return access == states.action.ALLOW
+
+
+def userAssignations(user, entries):
+    """
+    Returns a dict pool id -> (in_use, publication id) of the services assigned to user from catalog pools
+    """
+    result = {}
+    qs = UserService.objects.filter(
+        user=user, cache_level=0, state__in=State.VALID_STATES, deployed_service__visible=True, deployed_service_id__in=[e['pool'] for e in entries]
+    ).values_list('deployed_service_id', 'in_use', 'publication_id')
+    for poolId, inUse, publicationId in qs:
+        result.setdefault(poolId, (inUse, publicationId))
+    return result
+
+
+def toBeReplaced(poolIds):
+    """
+    Returns a dict pool id -> datetime of replacement for the pools requested
+    """
+    result = {}
+    for pool in DeployedService.objects.filter(id__in=poolIds):
+        value = pool.recoverValue('toBeReplacedIn')
+        if value is not None:
+            try:
+                result[pool.id] = pickle.loads(value)
+            except Exception:
+                pass
+    return result
+
+
+def manuallyAssigned(user):
+    """
+    Returns the user services assigned manually to user (for services that must be assigned manually)
+    """
+    result = []
+    for us in UserService.objects.filter(user=user, deployed_service__state=State.ACTIVE).select_related('deployed_service__service'):
+        serviceType = us.deployed_service.service.getType()
+        if serviceType is not None and serviceType.mustAssignManually is True:
+            result.append(us)
+    return result
+
+
+# Any change of this models can change the catalogs
+for model in (DeployedService, DeployedServicePublication, Transport, Network, Group, ServicesPoolGroup, Image, Service, Provider, CalendarAccess):
+    signals.post_save.connect(invalidate, sender=model, dispatch_uid='catalog-save-{}'.format(model.__name__))
+    signals.post_delete.connect(invalidate, sender=model, dispatch_uid='catalog-delete-{}'.format(model.__name__))
+
+for through in (DeployedService.transports.through, DeployedService.assignedGroups.through, Network.transports.through):
+    signals.m2m_changed.connect(invalidate, sender=through, dispatch_uid='catalog-m2m-{}'.format(through.__name__))
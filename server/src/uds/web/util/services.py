@@ -33,11 +33,11 @@ from django.utils.translation import ugettext
 from django.utils import formats
 from django.urls.base import reverse
 
-from uds.models import DeployedService, Transport, UserService, Network, ServicesPoolGroup
+from uds.models import DeployedService, Transport, Network
 from uds.core.util.Config import GlobalConfig
 from uds.core.util import html
-
-from uds.core.managers.UserServiceManager import UserServiceManager
+from uds.core.util.NetworksIndex import NetworksIndex
+from uds.web.util import catalog
 
 import logging
 
@@ -52,8 +52,8 @@ def getServicesData(request):
 
     # We look for services for this authenticator groups. User is logged in in just 1 authenticator, so his groups must coincide with those assigned to ds
     groups = list(request.user.getGroups())
-    availServices = DeployedService.getDeployedServicesForGroups(groups)
-    availUserServices = UserService.getUserAssignedServices(request.user)
+    networksIndex = NetworksIndex.index()
+    networkIds = networksIndex.networksFor(request.ip)
 
     # Information for administrators
     nets = ''
@@ -62,107 +62,75 @@ def getServicesData(request):
     logger.debug('OS: {0}'.format(os['OS']))
 
     if request.user.isStaff():
-        nets = ','.join([n.name for n in Network.networksFor(request.ip)])
-        tt = []
-        for t in Transport.objects.all():
-            if t.validForIp(request.ip):
-                tt.append(t.name)
-        validTrans = ','.join(tt)
+        nets = ','.join(Network.objects.filter(id__in=networkIds).values_list('name', flat=True))
+        validTrans = ','.join([name for tId, name in Transport.objects.values_list('id', 'name') if networksIndex.transportValidForNetworks(tId, networkIds)])
+
+    def transportsLinks(entry, serviceId):
+        trans = []
+        for t in entry['transports']:
+            if t['ownLink'] is True:
+                link = reverse('TransportOwnLink', args=(serviceId, t['id']))
+            else:
+                link = html.udsAccessLink(request, serviceId, t['id'])
+            trans.append(
+                {
+                    'id': t['id'],
+                    'name': t['name'],
+                    'link': link,
+                    'priority': t['priority']
+                }
+            )
+        return trans
 
     # Extract required data to show to user
     services = []
-    # Select assigned user services (manually assigned)
-    for svr in availUserServices:
-        trans = []
-        for t in svr.transports.all().order_by('priority'):
-            typeTrans = t.getType()
-            if t.validForIp(request.ip) and typeTrans.supportsOs(os['OS']) and t.validForOs(os['OS']):
-                if typeTrans.ownLink is True:
-                    link = reverse('TransportOwnLink', args=('A' + svr.uuid, t.uuid))
-                else:
-                    link = html.udsAccessLink(request, 'A' + svr.uuid, t.uuid)
-                trans.append(
-                    {
-                        'id': t.uuid,
-                        'name': t.name,
-                        'link': link
-                    }
-                )
-
-        # If empty transports, do not include it on list
-        if not trans:
-            continue
-
-        servicePool = svr.deployed_service
-
-        if servicePool.image is not None:
-            imageId = servicePool.image.uuid
-        else:
-            imageId = 'x'  # Invalid
 
-        # Extract app group
-        group = servicePool.servicesPoolGroup if servicePool.servicesPoolGroup is not None else ServicesPoolGroup.default().as_dict
+    # Select assigned user services (manually assigned)
+    assigned = catalog.manuallyAssigned(request.user)
+    if assigned:
+        assignedEntries = {e['pool']: e for e in catalog.buildEntries(DeployedService.objects.filter(id__in=[us.deployed_service_id for us in assigned]), networkIds, os['OS'])}
+        accessChecker = catalog.AccessChecker(assignedEntries.values())
+        for svr in assigned:
+            entry = assignedEntries.get(svr.deployed_service_id)
+            # If empty transports, do not include it on list
+            if entry is None:
+                continue
 
-        services.append({
-            'id': 'A' + svr.uuid,
-            'name': servicePool.name,
-            'visual_name': servicePool.visual_name,
-            'description': servicePool.comments,
-            'group': group,
-            'transports': trans,
-            'imageId': imageId,
-            'show_transports': servicePool.show_transports,
-            'allow_users_remove': servicePool.allow_users_remove,
-            'allow_users_reset': servicePool.allow_users_reset,
-            'maintenance': servicePool.isInMaintenance(),
-            'not_accesible': not servicePool.isAccessAllowed(),
-            'in_use': svr.in_use,
-            'to_be_replaced': False,  # Manually assigned will not be autoremoved never
-            'comments': servicePool.comments,
-        })
+            services.append({
+                'id': 'A' + svr.uuid,
+                'name': entry['name'],
+                'visual_name': entry['visual_name'],
+                'description': entry['comments'],
+                'group': entry['group'],
+                'transports': transportsLinks(entry, 'A' + svr.uuid),
+                'imageId': entry['imageId'],
+                'show_transports': entry['show_transports'],
+                'allow_users_remove': entry['allow_users_remove'],
+                'allow_users_reset': entry['allow_users_reset'],
+                'maintenance': entry['maintenance'],
+                'not_accesible': not accessChecker.isAccessAllowed(entry),
+                'in_use': svr.in_use,
+                'to_be_replaced': False,  # Manually assigned will not be autoremoved never
+                'comments': entry['comments'],
+            })
 
     logger.debug(services)
 
-    # Now generic user service
-    for svr in availServices:
-        trans = []
-        for t in svr.transports.all().order_by('priority'):
-            typeTrans = t.getType()
-            if typeTrans is None:  # This may happen if we "remove" a transport type but we have a transport of that kind on DB
-                continue
-            if t.validForIp(request.ip) and typeTrans.supportsOs(os['OS']) and t.validForOs(os['OS']):
-                if typeTrans.ownLink is True:
-                    link = reverse('TransportOwnLink', args=('F' + svr.uuid, t.uuid))
-                else:
-                    link = html.udsAccessLink(request, 'F' + svr.uuid, t.uuid)
-                trans.append(
-                    {
-                        'id': t.uuid,
-                        'name': t.name,
-                        'link': link,
-                        'priority': t.priority
-                    }
-                )
-
-        # If empty transports, do not include it on list
-        if not trans:
-            continue
-
-        if svr.image is not None:
-            imageId = svr.image.uuid
-        else:
-            imageId = 'x'
+    # Now generic user service, from catalog (cached) with user data overlaid
+    entries = catalog.getCatalog(groups, networkIds, os['OS'])
+    assignations = catalog.userAssignations(request.user, entries)
+    accessChecker = catalog.AccessChecker(entries)
 
-        # Locate if user service has any already assigned user service for this
-        ads = UserServiceManager.manager().getExistingAssignationForUser(svr, request.user)
-        if ads is None:
-            in_use = False
-        else:
-            in_use = ads.in_use
+    # Pools where user service is not from active publication are going to be replaced
+    replaced = catalog.toBeReplaced([
+        e['pool'] for e in entries
+        if e['pool'] in assignations and e['activePublication'] is not None and e['activePublication'] != assignations[e['pool']][1]
+    ])
 
-        group = svr.servicesPoolGroup.as_dict if svr.servicesPoolGroup is not None else ServicesPoolGroup.default().as_dict
+    for entry in entries:
+        in_use = assignations[entry['pool']][0] if entry['pool'] in assignations else False
 
-        tbr = svr.toBeReplaced(request.user)
+        tbr = replaced.get(entry['pool'])
         if tbr:
             tbr = formats.date_format(tbr, "SHORT_DATETIME_FORMAT")
             tbrt = ugettext('This service is about to be replaced by a new version. Please, close the session before {} and save all your work to avoid loosing it.').format(tbr)
@@ -170,22 +138,22 @@ def getServicesData(request):
             tbrt = ''
 
         services.append({
-            'id': 'F' + svr.uuid,
-            'name': svr.name,
-            'visual_name': svr.visual_name,
-            'description': svr.comments,
-            'group': group,
-            'transports': trans,
-            'imageId': imageId,
-            'show_transports': svr.show_transports,
-            'allow_users_remove': svr.allow_users_remove,
-            'allow_users_reset': svr.allow_users_reset,
-            'maintenance': svr.isInMaintenance(),
-            'not_accesible': not svr.isAccessAllowed(),
+            'id': 'F' + entry['uuid'],
+            'name': entry['name'],
+            'visual_name': entry['visual_name'],
+            'description': entry['comments'],
+            'group': entry['group'],
+            'transports': transportsLinks(entry, 'F' + entry['uuid']),
+            'imageId': entry['imageId'],
+            'show_transports': entry['show_transports'],
+            'allow_users_remove': entry['allow_users_remove'],
+            'allow_users_reset': entry['allow_users_reset'],
+            'maintenance': entry['maintenance'],
+            'not_accesible': not accessChecker.isAccessAllowed(entry),
             'in_use': in_use,
             'to_be_replaced': tbr,
             'to_be_replaced_text': tbrt,
-            'comments': svr.comments,
+            'comments': entry['comments'],
         })
 
     logger.debug('Services: {0}'.format(services))
@@ -194,7 +162,7 @@ def getServicesData(request):
     services = [s for s in sorted(services, key=lambda s: s['name'].upper()) if len(s['transports']) > 0]
 
     autorun = False
-    if len(services) == 1 and GlobalConfig.AUTORUN_SERVICE.getBool(True) and len(services[0]['transports']) > 0:
+    if len(services) == 1 and GlobalConfig.AUTORUN_SERVICE.getBool() and len(services[0]['transports']) > 0:
         if request.session.get('autorunDone', '0') == '0':
             request.session['autorunDone'] = '1'
             autorun = True
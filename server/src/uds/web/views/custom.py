@@ -41,6 +41,6 @@ def custom(request, component):
 
     if component == 'styles.css':
         content_type = 'text/css'
-        value = Config.section('__custom').value('style').get(force=True)
+        value = Config.section('__custom').value('style').get()
 
     return HttpResponse(content_type=content_type, content=value)
@@ -83,7 +83,7 @@ def login(request, tag=None):
             {
                 'form': form,
                 'authenticators': Authenticator.getByTag(tag),
-                'customHtml': GlobalConfig.CUSTOM_HTML_LOGIN.get(True),
+                'customHtml': GlobalConfig.CUSTOM_HTML_LOGIN.get(),
                 'version': VERSION
 
             }
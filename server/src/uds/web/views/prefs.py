@@ -54,7 +54,7 @@ def prefs(request):
     :param request:
     """
     # Redirects to index if no preferences change allowed
-    if GlobalConfig.PREFERENCES_ALLOWED.getBool(True) is False:
+    if GlobalConfig.PREFERENCES_ALLOWED.getBool() is False:
         return redirect('uds.web.views.index')
     if request.method == 'POST':
         UserPrefsManager.manager().processRequestForUserPreferences(request.user, request.POST)